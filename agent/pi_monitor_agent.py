@@ -12,12 +12,26 @@ Metrics endpoint:
     http://<pi-ip>:5555/metrics
 """
 
+import functools
+import glob
+import hmac
+import importlib.util
 import json
 import os
+import queue
+import selectors
 import socket
+import struct
+import sys
+import threading
 import time
+from array import array
+from bisect import bisect_left
+from collections import deque
 from datetime import datetime
 from http.server import BaseHTTPRequestHandler, HTTPServer
+from time import perf_counter
+from urllib.parse import parse_qs
 
 # =============================================================================
 # Configuration
@@ -25,6 +39,221 @@ from http.server import BaseHTTPRequestHandler, HTTPServer
 
 PORT = 5555  # Change if needed
 
+# HTTP serving: a fixed pool of worker threads serves requests. Connections
+# stay open between requests (HTTP/1.1 keep-alive) without holding a worker.
+SERVER_WORKERS = 2  # Requests served at once (one or two suit a single-core Pi Zero)
+KEEPALIVE_TIMEOUT = 15  # Seconds an idle connection is kept open
+REQUEST_TIMEOUT = 2  # Seconds a worker waits for the rest of a request (< the dashboard's 3)
+
+# Shared secret for /debug/profile (pass ?token= or an X-Debug-Token header).
+# Profiling is disabled while this is empty.
+DEBUG_TOKEN = ""
+PROFILE_MAX_SECONDS = 60  # Upper bound for /debug/profile?seconds=N
+PROFILE_INTERVAL = 0.005  # Seconds between stack samples
+
+# Directory the kernel interfaces below are read from. Point it at a recorded
+# tree (see benchmarks/proctrace.py) to run the collectors on any machine.
+FS_ROOT = os.environ.get("PI_MONITOR_FS_ROOT", "/")
+
+# Kernel interfaces read by the collectors, relative to FS_ROOT
+KERNEL_PATHS = {
+    "PROC_STAT": "proc/stat",
+    "PROC_MEMINFO": "proc/meminfo",
+    "PROC_UPTIME": "proc/uptime",
+    "PROC_LOADAVG": "proc/loadavg",
+    "DEVICE_TREE_MODEL": "proc/device-tree/model",
+    "THERMAL_ZONE_TEMP": "sys/class/thermal/thermal_zone0/temp",
+    "PROC_NET_ROUTE": "proc/net/route",
+    "DISK_PATH": "",
+    "THERMAL_ZONES_GLOB": "sys/class/thermal/thermal_zone*/temp",
+    "CPUFREQ_GLOB": "sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_cur_freq",
+    "THROTTLED_PATH": "sys/devices/platform/soc/soc:firmware/get_throttled",
+}
+PROC_STAT = os.path.join(FS_ROOT, KERNEL_PATHS["PROC_STAT"])
+PROC_MEMINFO = os.path.join(FS_ROOT, KERNEL_PATHS["PROC_MEMINFO"])
+PROC_UPTIME = os.path.join(FS_ROOT, KERNEL_PATHS["PROC_UPTIME"])
+PROC_LOADAVG = os.path.join(FS_ROOT, KERNEL_PATHS["PROC_LOADAVG"])
+DEVICE_TREE_MODEL = os.path.join(FS_ROOT, KERNEL_PATHS["DEVICE_TREE_MODEL"])
+THERMAL_ZONE_TEMP = os.path.join(FS_ROOT, KERNEL_PATHS["THERMAL_ZONE_TEMP"])
+PROC_NET_ROUTE = os.path.join(FS_ROOT, KERNEL_PATHS["PROC_NET_ROUTE"])
+DISK_PATH = os.path.join(FS_ROOT, KERNEL_PATHS["DISK_PATH"])
+THERMAL_ZONES_GLOB = os.path.join(FS_ROOT, KERNEL_PATHS["THERMAL_ZONES_GLOB"])
+CPUFREQ_GLOB = os.path.join(FS_ROOT, KERNEL_PATHS["CPUFREQ_GLOB"])
+THROTTLED_PATH = os.path.join(FS_ROOT, KERNEL_PATHS["THROTTLED_PATH"])
+
+# Seconds between network address re-checks when no change was signalled
+NETWORK_REFRESH_INTERVAL = 300
+
+# Background sampling for rolling averages (SAMPLE_INTERVAL = 0 disables it)
+SAMPLE_INTERVAL = 0.25  # Seconds between samples
+AVERAGE_WINDOWS = (1, 10, 60, 300)  # Averaging windows in seconds
+MAX_CONSUMERS = 16  # Distinct ?consumer= names whose peaks are tracked
+
+# Seconds a finished /metrics response is reused for identical concurrent
+# requests (the collection itself is always shared while in flight)
+COALESCE_WINDOW = 0.5
+
+# Time budget in seconds per collector run, by cost class. A collector that
+# overruns is abandoned: its last good value is served marked stale and it is
+# quarantined, for QUARANTINE_BASE seconds doubling per consecutive overrun.
+COLLECTOR_BUDGETS = {"cheap": 0.25, "expensive": 1.0}
+QUARANTINE_BASE = 5
+QUARANTINE_MAX = 300  # Longest quarantine in seconds
+
+# Most distinct /metrics?fields= query strings whose parsed selection is cached
+MAX_FIELD_SELECTIONS = 64
+
+# Directory of third-party collector plugins (*.py files defining register(agent))
+COLLECTORS_DIR = "/etc/pi-monitor/collectors.d"
+
+# =============================================================================
+# Self-Instrumentation
+# =============================================================================
+
+# Upper bounds (seconds) of the latency histogram buckets; one overflow bucket follows
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)  # fmt: skip
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram.
+
+    observe() is a bisect plus a few additions and takes no lock, so counts
+    may be off by one under heavy thread contention.
+    """
+
+    __slots__ = ("counts", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        """Record one duration in seconds."""
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Estimate the q-quantile (0-1) as the upper bound of its bucket."""
+        count = sum(self.counts)
+        if count == 0:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for bound, bucket in zip(LATENCY_BUCKETS, self.counts):
+            seen += bucket
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        """Return the histogram as a JSON-serializable dictionary (milliseconds)."""
+        count = sum(self.counts)
+        return {
+            "count": count,
+            "mean_ms": round(self.total / count * 1000, 3) if count else 0.0,
+            "p50_ms": round(self.quantile(0.5) * 1000, 3),
+            "p90_ms": round(self.quantile(0.9) * 1000, 3),
+            "p99_ms": round(self.quantile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "buckets": {
+                **{str(bound): n for bound, n in zip(LATENCY_BUCKETS, self.counts)},
+                "+Inf": self.counts[-1],
+            },
+        }
+
+
+class Stats:
+    """Registry of named histograms and counters exposed at /debug/stats."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.histograms = {}
+        self.counters = {}
+
+    def histogram(self, name):
+        """Return the histogram called name, creating it on first use."""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def incr(self, name, amount=1):
+        """Add amount to the counter called name."""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        """Return all histograms and counters as a JSON-serializable dictionary."""
+        return {
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "counters": dict(self.counters),
+            "histograms": {
+                name: histogram.snapshot() for name, histogram in list(self.histograms.items())
+            },
+        }
+
+
+STATS = Stats()
+
+
+def sample_stacks(seconds, interval=PROFILE_INTERVAL):
+    """
+    Sample the stack of every other thread for the given number of seconds.
+
+    Returns a dict mapping collapsed stacks ("thread;outer;...;inner") to the
+    number of samples in which they were seen.
+    """
+    own = threading.get_ident()
+    counts = {}
+    deadline = perf_counter() + seconds
+    while perf_counter() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                filename = os.path.basename(code.co_filename)
+                stack.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            key = ";".join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+        time.sleep(interval)
+    return counts
+
+
+def format_collapsed(counts):
+    """Format sample counts as collapsed stacks, one "stack count" per line."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
+
+def timed(name):
+    """Decorator recording the duration of every call in the histogram called name."""
+
+    def decorator(func):
+        histogram = STATS.histogram(name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
 # =============================================================================
 # Metrics Collection (reads directly from /proc and /sys)
 # =============================================================================
@@ -35,20 +264,68 @@ HOSTNAME = socket.gethostname()
 def get_cpu_temp():
     """Get CPU temperature from thermal zone."""
     try:
-        with open("/sys/class/thermal/thermal_zone0/temp") as f:
+        with open(THERMAL_ZONE_TEMP) as f:
             return round(int(f.read().strip()) / 1000, 1)
     except (FileNotFoundError, PermissionError, ValueError):
         return None
 
 
+def read_cpu_times():
+    """Return (idle, total) jiffies from the aggregate cpu line of /proc/stat."""
+    with open(PROC_STAT) as f:
+        line = f.readline()
+    values = list(map(int, line.split()[1:]))
+    return values[3], sum(values)
+
+
+def read_all_cpu_times():
+    """Return (idle, total) jiffies for the aggregate line and every cpuN line."""
+    times = []
+    with open(PROC_STAT) as f:
+        for line in f:
+            if not line.startswith("cpu"):
+                break
+            values = list(map(int, line.split()[1:]))
+            times.append((values[3], sum(values)))
+    return times
+
+
+def read_sysfs_int(path, base=10):
+    """Read an integer from a sysfs file, or None if it is unavailable."""
+    try:
+        with open(path) as f:
+            return int(f.read().strip(), base)
+    except (FileNotFoundError, PermissionError, ValueError, OSError):
+        return None
+
+
+# Bits of the firmware's get_throttled value: (current, since boot) per condition
+THROTTLED_FLAGS = (
+    ("under_voltage", 0x1, 0x10000),
+    ("freq_capped", 0x2, 0x20000),
+    ("throttled", 0x4, 0x40000),
+    ("soft_temp_limit", 0x8, 0x80000),
+)
+
+
+def decode_throttled(bits):
+    """Decode get_throttled bits into {condition: {"now": bool, "since_boot": bool}}."""
+    return {
+        name: {"now": bool(bits & now), "since_boot": bool(bits & since_boot)}
+        for name, now, since_boot in THROTTLED_FLAGS
+    }
+
+
+def get_throttled():
+    """Get the firmware's throttling state (None on systems without it)."""
+    bits = read_sysfs_int(THROTTLED_PATH, 16)
+    return None if bits is None else decode_throttled(bits)
+
+
 def get_cpu_usage():
     """Get CPU usage percentage from /proc/stat."""
     try:
-        with open("/proc/stat") as f:
-            line = f.readline()
-        values = list(map(int, line.split()[1:]))
-        idle = values[3]
-        total = sum(values)
+        idle, total = read_cpu_times()
 
         # Store previous values for delta calculation
         if not hasattr(get_cpu_usage, "prev"):
@@ -73,7 +350,7 @@ def get_memory_info():
     """Get memory usage from /proc/meminfo."""
     try:
         mem = {}
-        with open("/proc/meminfo") as f:
+        with open(PROC_MEMINFO) as f:
             for line in f:
                 parts = line.split()
                 if parts[0] in ["MemTotal:", "MemAvailable:", "MemFree:"]:
@@ -97,7 +374,7 @@ def get_memory_info():
 def get_disk_info():
     """Get disk usage using os.statvfs."""
     try:
-        stat = os.statvfs("/")
+        stat = os.statvfs(DISK_PATH)
         total = (stat.f_blocks * stat.f_frsize) / (1024**3)  # GB
         free = (stat.f_bavail * stat.f_frsize) / (1024**3)
         used = total - free
@@ -116,7 +393,7 @@ def get_disk_info():
 def get_uptime():
     """Get system uptime in human-readable format."""
     try:
-        with open("/proc/uptime") as f:
+        with open(PROC_UPTIME) as f:
             uptime_seconds = float(f.read().split()[0])
 
         days = int(uptime_seconds // 86400)
@@ -136,50 +413,962 @@ def get_uptime():
 def get_load_average():
     """Get system load average."""
     try:
-        with open("/proc/loadavg") as f:
+        with open(PROC_LOADAVG) as f:
             loads = f.read().split()[:3]
         return [float(load) for load in loads]
     except (FileNotFoundError, PermissionError, ValueError):
         return [0.0, 0.0, 0.0]
 
 
-def get_network_ip():
-    """Get local IP address."""
+# rtnetlink constants (linux/netlink.h, linux/rtnetlink.h, linux/if_addr.h)
+NETLINK_ROUTE = 0
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+
+
+def kernel_addresses():
+    """Return {interface: [address, ...]} for every address, via an rtnetlink dump."""
+    addresses = {}
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE) as sock:
+        sock.settimeout(1.0)
+        header = struct.pack("=IHHII", 24, RTM_GETADDR, NLM_F_REQUEST | NLM_F_DUMP, 1, 0)
+        sock.sendto(header + struct.pack("=BBBBI", socket.AF_UNSPEC, 0, 0, 0, 0), (0, 0))
+        while True:
+            data = sock.recv(65536)
+            offset = 0
+            while offset + 16 <= len(data):
+                length, msg_type = struct.unpack_from("=IH", data, offset)
+                if msg_type == NLMSG_DONE:
+                    return addresses
+                if msg_type == NLMSG_ERROR:
+                    raise OSError("rtnetlink address dump failed")
+                if msg_type == RTM_NEWADDR:
+                    family, _, _, _, index = struct.unpack_from("=BBBBI", data, offset + 16)
+                    attrs = {}
+                    attr = offset + 24
+                    while attr + 4 <= offset + length:
+                        attr_len, attr_type = struct.unpack_from("=HH", data, attr)
+                        if attr_len < 4:
+                            break
+                        attrs[attr_type] = data[attr + 4 : attr + attr_len]
+                        attr += (attr_len + 3) & ~3
+                    raw = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+                    if raw and family in (socket.AF_INET, socket.AF_INET6):
+                        try:
+                            name = socket.if_indextoname(index)
+                        except OSError:
+                            name = str(index)
+                        addresses.setdefault(name, []).append(socket.inet_ntop(family, raw))
+                if length < 16:
+                    break
+                offset += (length + 3) & ~3
+
+
+def default_route_interface():
+    """Return the interface of the lowest-metric IPv4 default route, or None."""
+    try:
+        with open(PROC_NET_ROUTE) as f:
+            next(f)
+            routes = [line.split() for line in f]
+        defaults = [
+            (int(fields[6]), fields[0])
+            for fields in routes
+            if len(fields) > 7 and fields[1] == "00000000" and fields[7] == "00000000"
+        ]
+        return min(defaults)[1] if defaults else None
+    except (FileNotFoundError, PermissionError, StopIteration, ValueError):
+        return None
+
+
+def pick_primary_address(addresses, default_interface):
+    """
+    Choose the address to report as "ip".
+
+    Prefers the default route's IPv4 address, then any routable IPv4, then
+    link-local IPv4, then a global IPv6 address; loopback is never chosen.
+    """
+    ordered = sorted(addresses.items(), key=lambda item: item[0] != default_interface)
+    candidates = [address for _, group in ordered for address in group]
+    for usable in (
+        lambda a: ":" not in a and not a.startswith(("127.", "169.254.")),
+        lambda a: ":" not in a and not a.startswith("127."),
+        lambda a: ":" in a and a != "::1" and not a.lower().startswith("fe80:"),
+    ):
+        for address in candidates:
+            if usable(address):
+                return address
+    return "unknown"
+
+
+def open_change_watch():
+    """Subscribe to kernel link, address and route changes; None if unsupported."""
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    except (AttributeError, OSError):
+        return None
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
+        groups = (
+            RTMGRP_LINK
+            | RTMGRP_IPV4_IFADDR
+            | RTMGRP_IPV6_IFADDR
+            | RTMGRP_IPV4_ROUTE
+            | RTMGRP_IPV6_ROUTE
+        )
+        sock.bind((0, groups))
+        sock.setblocking(False)
+        return sock
     except OSError:
-        return "unknown"
+        sock.close()
+        return None
+
+
+class NetworkIdentity:
+    """
+    The host's interfaces and addresses, enumerated from the kernel.
+
+    Refreshed only when the netlink change subscription reports a link,
+    address or route change, or every NETWORK_REFRESH_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watch = None
+        self._watch_opened = False
+        self.interfaces = {}
+        self.primary = "unknown"
+        self.refreshed = None
+
+    def _changed(self):
+        """Drain pending change notifications; return True if there were any."""
+        if not self._watch_opened:
+            self._watch = open_change_watch()
+            self._watch_opened = True
+        if self._watch is None:
+            return False
+        changed = False
+        while True:
+            try:
+                if not self._watch.recv(65536):
+                    return changed
+                changed = True
+            except BlockingIOError:
+                return changed
+            except OSError:  # ENOBUFS: notifications were dropped, so assume a change
+                changed = True
+
+    def refresh(self):
+        """Re-enumerate interfaces and addresses from the kernel."""
+        try:
+            interfaces = kernel_addresses()
+        except (AttributeError, OSError, struct.error):
+            interfaces = {}
+        self.interfaces = interfaces
+        self.primary = pick_primary_address(interfaces, default_route_interface())
+        self.refreshed = time.monotonic()
+
+    def current(self):
+        """Return self, refreshed first if a change was signalled or the interval elapsed."""
+        with self._lock:
+            if (
+                self._changed()
+                or self.refreshed is None
+                or time.monotonic() - self.refreshed >= NETWORK_REFRESH_INTERVAL
+            ):
+                self.refresh()
+        return self
+
+
+NETWORK = NetworkIdentity()
+
+
+def get_network_ip():
+    """Get the primary local IP address (cached until the network changes)."""
+    return NETWORK.current().primary
+
+
+def get_network_interfaces():
+    """Get every interface and its addresses (cached until the network changes)."""
+    return NETWORK.current().interfaces
 
 
 def get_pi_model():
     """Get Raspberry Pi model string."""
     try:
-        with open("/proc/device-tree/model") as f:
+        with open(DEVICE_TREE_MODEL) as f:
             return f.read().strip().replace("\x00", "")
     except (FileNotFoundError, PermissionError):
         return "Unknown Model"
 
 
-def collect_metrics():
-    """Collect all system metrics into a dictionary."""
-    return {
-        "hostname": HOSTNAME,
-        "ip": get_network_ip(),
-        "model": get_pi_model(),
-        "timestamp": datetime.now().isoformat(),
-        "cpu": {
-            "usage_percent": get_cpu_usage(),
-            "temperature": get_cpu_temp(),
-            "load_average": get_load_average(),
-        },
-        "memory": get_memory_info(),
-        "disk": get_disk_info(),
-        "uptime": get_uptime(),
-    }
+def get_kernel():
+    """Get the running kernel release."""
+    return os.uname().release
+
+
+# =============================================================================
+# Background Sampling
+# =============================================================================
+
+
+class RollingAverages:
+    """
+    Averages of one series over several trailing windows.
+
+    Samples go into a fixed ring as long as the longest window, and each
+    window keeps a running sum, so add() is O(number of windows) no matter
+    how long the windows are. The sums are recomputed from the ring each
+    time it wraps to stop floating-point drift from accumulating.
+    """
+
+    __slots__ = ("ring", "lengths", "sums", "position", "count")
+
+    def __init__(self, lengths):
+        self.ring = array("d", [0.0]) * max(lengths)
+        self.lengths = lengths  # Samples per window
+        self.sums = [0.0] * len(lengths)
+        self.position = 0
+        self.count = 0
+
+    def add(self, value):
+        """Add a sample, dropping the oldest sample out of each full window."""
+        ring = self.ring
+        size = len(ring)
+        position = self.position
+        for i, length in enumerate(self.lengths):
+            if self.count >= length:
+                self.sums[i] -= ring[(position - length) % size]
+            self.sums[i] += value
+        ring[position] = value
+        self.count += 1
+        self.position = (position + 1) % size
+        if self.position == 0:
+            self.sums = [sum(ring[size - length :]) for length in self.lengths]
+
+    def averages(self):
+        """Return the average of each window (None before the first sample)."""
+        if not self.count:
+            return [None] * len(self.lengths)
+        return [total / min(self.count, length) for total, length in zip(self.sums, self.lengths)]
+
+
+class PeakWindow:
+    """
+    Min/max/average of the peak series and OR-ed throttling bits since a
+    consumer's previous scrape. add() folds in per-sample aggregates, so
+    its cost does not depend on how many cores or thermal zones there are.
+    """
+
+    __slots__ = ("started", "samples", "stats", "throttled")
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.samples = 0
+        self.stats = {}  # series -> [min, max, total, count]
+        self.throttled = None
+
+    def add(self, spans, throttled):
+        """Fold in one sample's {series: (min, max, total, count)} and throttle bits."""
+        self.samples += 1
+        for name, (low, high, total, count) in spans.items():
+            stats = self.stats.get(name)
+            if stats is None:
+                self.stats[name] = [low, high, total, count]
+            else:
+                stats[0] = min(stats[0], low)
+                stats[1] = max(stats[1], high)
+                stats[2] += total
+                stats[3] += count
+        if throttled is not None:
+            self.throttled = (self.throttled or 0) | throttled
+
+    def report(self):
+        """Return the window as a JSON-serializable dictionary."""
+        report = {
+            "seconds": round(time.monotonic() - self.started, 1),
+            "samples": self.samples,
+        }
+        for name in Sampler.PEAK_SERIES:
+            stats = self.stats.get(name)
+            report[name] = (
+                None
+                if stats is None
+                else {
+                    "min": round(stats[0], 1),
+                    "max": round(stats[1], 1),
+                    "avg": round(stats[2] / stats[3], 1),
+                }
+            )
+        report["throttled"] = None if self.throttled is None else decode_throttled(self.throttled)
+        return report
+
+
+def busy_percent(previous, current):
+    """Return the busy percentage between two (idle, total) readings, or None."""
+    (prev_idle, prev_total), (idle, total) = previous, current
+    if total <= prev_total:
+        return None
+    return (1 - (idle - prev_idle) / (total - prev_total)) * 100
+
+
+def span(values):
+    """Return (min, max, total, count) of a non-empty list of numbers."""
+    return min(values), max(values), sum(values), len(values)
+
+
+class Sampler:
+    """
+    Background thread sampling CPU usage, memory, temperature and frequency.
+
+    Every SAMPLE_INTERVAL seconds each series gets one sample. /metrics reads
+    the AVERAGE_WINDOWS averages and, per consumer, the peaks since that
+    consumer's previous scrape: per-core CPU usage, every thermal zone, every
+    core's frequency and the firmware's throttling bits. CPU usage is
+    computed from the sampler's own /proc/stat deltas, independent of
+    get_cpu_usage().
+    """
+
+    SERIES = ("cpu_percent", "memory_percent", "temperature")
+    PEAK_SERIES = ("cpu_percent", "temperature", "cpu_freq_mhz")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.series = {}
+        self.consumers = {}
+        self.prev_cpu = None
+        self.thermal_paths = []
+        self.cpufreq_paths = []
+
+    def reset(self):
+        """Size empty rings for the current settings and find zones and cores."""
+        if SAMPLE_INTERVAL > 0:
+            lengths = [max(1, round(window / SAMPLE_INTERVAL)) for window in AVERAGE_WINDOWS]
+        else:
+            lengths = [1] * len(AVERAGE_WINDOWS)  # Sampling disabled: the rings stay empty
+        with self.lock:
+            self.series = {name: RollingAverages(lengths) for name in self.SERIES}
+            self.consumers = {}
+            self.prev_cpu = None
+            self.thermal_paths = sorted(glob.glob(THERMAL_ZONES_GLOB))
+            self.cpufreq_paths = sorted(glob.glob(CPUFREQ_GLOB))
+
+    def read(self):
+        """
+        Read one sample.
+
+        Returns ({series: value or None} for the rolling averages,
+        {peak series: (min, max, total, count)} across cores and zones, and
+        the throttling bits or None).
+        """
+        values = dict.fromkeys(self.SERIES)
+        spans = {}
+        try:
+            times = read_all_cpu_times()
+        except (FileNotFoundError, PermissionError, ValueError, IndexError):
+            times = []
+        if self.prev_cpu and times:
+            usage = [busy_percent(*pair) for pair in zip(self.prev_cpu, times)]
+            values["cpu_percent"] = usage[0]
+            # Per-core lines only line up if no core went on or offline
+            cores = usage[1:] if len(times) == len(self.prev_cpu) else []
+            cores = [value for value in cores if value is not None]
+            if cores or usage[0] is not None:
+                spans["cpu_percent"] = span(cores or [usage[0]])
+        self.prev_cpu = times or None
+
+        memory = get_memory_info()
+        if memory["total_mb"]:
+            values["memory_percent"] = memory["percent"]
+        values["temperature"] = get_cpu_temp()
+
+        temperatures = [read_sysfs_int(path) for path in self.thermal_paths]
+        temperatures = [value / 1000 for value in temperatures if value is not None]
+        if temperatures:
+            spans["temperature"] = span(temperatures)
+        frequencies = [read_sysfs_int(path) for path in self.cpufreq_paths]
+        frequencies = [value / 1000 for value in frequencies if value is not None]
+        if frequencies:
+            spans["cpu_freq_mhz"] = span(frequencies)
+        return values, spans, read_sysfs_int(THROTTLED_PATH, 16)
+
+    def sample_once(self):
+        """Take one sample of every series and fold it into every consumer's peaks."""
+        values, spans, throttled = self.read()
+        with self.lock:
+            for name, value in values.items():
+                if value is not None:
+                    self.series[name].add(value)
+            for window in self.consumers.values():
+                window.add(spans, throttled)
+
+    def peaks(self, consumer):
+        """
+        Return and restart consumer's peaks since its previous call.
+
+        A consumer's first call starts its window and reports it empty. The
+        least recently read consumer is forgotten beyond MAX_CONSUMERS.
+        Returns None if the sampler never ran.
+        """
+        with self.lock:
+            if not self.series:
+                return None
+            window = self.consumers.pop(consumer, None)
+            if window is None:
+                window = PeakWindow()
+                if len(self.consumers) >= MAX_CONSUMERS:
+                    del self.consumers[next(iter(self.consumers))]
+            self.consumers[consumer] = PeakWindow()
+        return window.report()
+
+    def run(self):
+        """Sample on a fixed schedule until stopped, skipping missed ticks."""
+        deadline = time.monotonic()
+        while not self.stop_event.is_set():
+            self.sample_once()
+            deadline += SAMPLE_INTERVAL
+            delay = deadline - time.monotonic()
+            if delay < 0:
+                STATS.incr("sampler.missed")
+                deadline = time.monotonic()
+                delay = 0
+            self.stop_event.wait(delay)
+
+    def start(self):
+        """Start the sampling thread."""
+        self.reset()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the sampling thread."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def averages(self):
+        """Return {series: {"1s": avg, ...}}, or None if the sampler never ran."""
+        labels = [f"{window}s" for window in AVERAGE_WINDOWS]
+        with self.lock:
+            if not self.series:
+                return None
+            return {
+                name: {
+                    label: None if value is None else round(value, 1)
+                    for label, value in zip(labels, series.averages())
+                }
+                for name, series in self.series.items()
+            }
+
+
+SAMPLER = Sampler()
+
+
+# =============================================================================
+# Collector Registry
+# =============================================================================
+
+# Cost classes: cheap collectors parse a small /proc or /sys file; expensive
+# ones make syscalls that can be slow or block (statvfs, sockets).
+COST_CHEAP = "cheap"
+COST_EXPENSIVE = "expensive"
+
+
+class Collector:
+    """
+    A metrics getter with its own refresh interval and cost class.
+
+    Getters run on the watchdog's worker thread (see Watchdog), so getters
+    that keep state between calls (such as get_cpu_usage's previous
+    counters) are never run concurrently, and a getter that hangs only
+    makes its own value stale.
+    """
+
+    __slots__ = (
+        "name",
+        "path",
+        "func",
+        "interval",
+        "cost",
+        "value",
+        "updated",
+        "histogram",
+        "stale",
+        "running",
+        "overruns",
+        "quarantined_until",
+    )
+
+    def __init__(self, name, func, interval=0.0, cost=COST_CHEAP):
+        self.name = name  # Dotted output field, e.g. "cpu.temperature"
+        self.path = name.split(".")
+        self.func = func
+        self.interval = interval  # Seconds a value stays fresh; None = compute once
+        self.cost = cost
+        self.value = None
+        self.updated = None  # time.monotonic() of the last run
+        self.histogram = STATS.histogram("collector." + name)
+        self.stale = False  # True while value is not from the latest due run
+        self.running = False  # True while the getter runs (possibly hung)
+        self.overruns = 0  # Consecutive runs that exceeded the budget
+        self.quarantined_until = 0.0
+
+    def due(self, now):
+        """Return True if the cached value is older than the refresh interval."""
+        if self.updated is None:
+            return True
+        return self.interval is not None and now - self.updated >= self.interval
+
+    def needs_run(self, now):
+        """Return True if due and not already refreshed by a collection at now."""
+        return self.due(now) and (self.updated is None or self.updated < now)
+
+    def available(self, now):
+        """Return True unless quarantined or still stuck in an earlier run."""
+        return not self.running and now >= self.quarantined_until
+
+    def budget(self):
+        """Return the seconds a run may take before it is abandoned."""
+        return COLLECTOR_BUDGETS.get(self.cost, COLLECTOR_BUDGETS[COST_CHEAP])
+
+    def run(self, now):
+        """Run the getter and store its value (called on the watchdog's worker)."""
+        start = perf_counter()
+        value = self.func()
+        self.histogram.observe(perf_counter() - start)
+        self.value = value
+        self.updated = now
+        self.stale = False
+
+    def overrun(self, now):
+        """Mark the value stale and quarantine the collector with exponential backoff."""
+        self.overruns += 1
+        self.stale = True
+        backoff = min(QUARANTINE_MAX, QUARANTINE_BASE * 2 ** (self.overruns - 1))
+        self.quarantined_until = now + backoff
+        STATS.incr("collector.overruns")
+
+    def failed(self, now):
+        """Keep the last value, marked stale, until the next due run after the getter raised."""
+        self.updated = now
+        self.stale = True
+        STATS.incr("collector.errors")
+
+    def describe(self):
+        """Return the collector's settings and health as a JSON-serializable dictionary."""
+        return {
+            "interval": self.interval,
+            "cost": self.cost,
+            "stale": self.stale,
+            "overruns": self.overruns,
+            "quarantined_for": round(max(0.0, self.quarantined_until - time.monotonic()), 1),
+        }
+
+
+class Batch:
+    """The due collectors of one collection, run in order by the watchdog's worker."""
+
+    __slots__ = ("collectors", "now", "index", "deadline")
+
+    def __init__(self, collectors, now):
+        self.collectors = collectors
+        self.now = now
+        self.index = 0  # Next collector to run
+        self.deadline = None  # When the running collector overruns (None = none running)
+
+
+class Watchdog:
+    """
+    Runs collector getters on a worker thread under per-collector time budgets.
+
+    run() queues one collection's due collectors as a single batch and waits
+    while the worker runs them in order. If a getter exceeds its cost
+    class's budget, the caller stops waiting for it: the collector is marked
+    stale and quarantined, the stuck worker is abandoned, and a new worker
+    carries on with the rest of the batch. A collection therefore waits at
+    most one budget per hung collector, and a quarantined or still-stuck
+    collector is skipped without waiting at all. A getter that raises keeps
+    its last value, marked stale, and the rest of the batch still runs.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.queue = deque()
+        self.worker = None
+
+    def replace_worker(self):
+        """Start a new worker thread (called with the condition held)."""
+        self.worker = threading.Thread(target=self.work, name="collector-worker", daemon=True)
+        self.worker.start()
+
+    def work(self):
+        """Worker loop; returns once the thread has been replaced."""
+        me = threading.current_thread()
+        with self.condition:
+            while self.worker is me:
+                if not self.queue:
+                    self.condition.wait()
+                    continue
+                batch = self.queue[0]
+                if batch.index >= len(batch.collectors):
+                    self.queue.popleft()
+                    self.condition.notify_all()  # The batch's caller only waits for this
+                    continue
+                collector = batch.collectors[batch.index]
+                if not collector.needs_run(batch.now):
+                    batch.index += 1
+                    continue
+                if not collector.available(batch.now):
+                    collector.stale = True
+                    batch.index += 1
+                    continue
+                batch.deadline = time.monotonic() + collector.budget()
+                collector.running = True
+                self.condition.release()
+                failed = False
+                try:
+                    collector.run(batch.now)
+                except Exception:
+                    failed = True  # A broken getter only makes its own field stale
+                finally:
+                    self.condition.acquire()
+                    collector.running = False
+                if failed:
+                    collector.failed(batch.now)
+                if self.worker is not me:
+                    return  # Abandoned after an overrun; the value is kept but stays quarantined
+                collector.overruns = 0
+                batch.index += 1
+                batch.deadline = None
+
+    def run(self, collectors, now):
+        """Refresh the due collectors for a collection at now, within their budgets."""
+        batch = Batch(collectors, now)
+        with self.condition:
+            if self.worker is None:
+                self.replace_worker()
+            self.queue.append(batch)
+            self.condition.notify_all()
+            # The worker only notifies when a batch is finished, so the caller
+            # wakes by timeout to check the deadline of the collector running
+            while batch in self.queue:
+                if batch.deadline is None:
+                    self.condition.wait(COLLECTOR_BUDGETS[COST_CHEAP])
+                    continue
+                remaining = batch.deadline - time.monotonic()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+                batch.collectors[batch.index].overrun(now)
+                batch.index += 1
+                batch.deadline = None
+                self.replace_worker()
+
+
+WATCHDOG = Watchdog()
+
+
+# Collectors for /metrics and for /info, in registration (output) order
+COLLECTORS = {}
+INFO_COLLECTORS = {}
+
+# Parsed ?fields= selections, keyed by query string (cleared on registration)
+_selections = {}
+
+
+def register_collector(name, func, interval=0.0, cost=COST_CHEAP, info=False):
+    """
+    Register func as the collector for the dotted field name.
+
+    interval is how many seconds a value may be reused (0 = every scrape,
+    None = computed once); info collectors are served on /info instead of
+    /metrics and are computed once unless given an interval. Registering an
+    existing name replaces it.
+    """
+    registry = INFO_COLLECTORS if info else COLLECTORS
+    if info and not interval:
+        interval = None
+    registry[name] = Collector(name, func, interval, cost)
+    _selections.clear()
+    return func
+
+
+def invalidate_collectors():
+    """Force every collector, including info collectors, to re-run on next use."""
+    for collector in (*COLLECTORS.values(), *INFO_COLLECTORS.values()):
+        collector.updated = None
+
+
+def use_fs_root(root):
+    """
+    Read every kernel interface in KERNEL_PATHS from under root.
+
+    Resets the CPU usage baseline, the sampler and all collectors, so the
+    next collection reflects only files under the new root.
+    """
+    global FS_ROOT
+    FS_ROOT = root
+    module = sys.modules[__name__]
+    for setting, relative in KERNEL_PATHS.items():
+        setattr(module, setting, os.path.join(root, relative))
+    if hasattr(get_cpu_usage, "prev"):
+        del get_cpu_usage.prev
+    SAMPLER.reset()
+    invalidate_collectors()
+
+
+def store(metrics, path, value):
+    """Store value in the nested metrics dictionary under path (a list of keys)."""
+    for key in path[:-1]:
+        metrics = metrics.setdefault(key, {})
+    metrics[path[-1]] = value
+
+
+def refresh(collectors, now):
+    """Re-run the due collectors among collectors under the watchdog."""
+    due = [collector for collector in collectors if collector.due(now)]
+    if due:
+        WATCHDOG.run(due, now)
+
+
+def collect_info():
+    """Collect static host metadata (computed once per collector)."""
+    now = time.monotonic()
+    refresh(INFO_COLLECTORS.values(), now)
+    return {name: collector.value for name, collector in INFO_COLLECTORS.items()}
+
+
+def resolve_field(field):
+    """
+    Resolve a dotted field name to (collector, subpath) pairs.
+
+    "cpu" selects every cpu.* collector, "cpu.temperature" one collector and
+    "memory.percent" a single key of the memory collector's value. Raises
+    ValueError for unknown fields.
+    """
+    collectors = list(COLLECTORS.items()) + list(INFO_COLLECTORS.items())
+    matches = [
+        (collector, ())
+        for name, collector in collectors
+        if name == field or name.startswith(field + ".")
+    ]
+    if matches:
+        return matches
+    for name, collector in collectors:
+        if field.startswith(name + "."):
+            return [(collector, tuple(field[len(name) + 1 :].split(".")))]
+    raise ValueError(f"Unknown field: {field}")
+
+
+def select_fields(query):
+    """
+    Parse the fields= parameter of a /metrics query string.
+
+    Returns None (everything) when no fields are requested, otherwise a
+    tuple of (collector, subpath) pairs. Results are cached per query string
+    so repeated narrow scrapes skip the parsing.
+    """
+    selection = _selections.get(query)
+    if selection is not None or query in _selections:
+        return selection
+    fields = [
+        field.strip()
+        for value in parse_qs(query).get("fields", [])
+        for field in value.split(",")
+        if field.strip()
+    ]
+    if fields:
+        pairs = {}
+        for field in fields:
+            for collector, subpath in resolve_field(field):
+                pairs[(collector.name, subpath)] = (collector, subpath)
+        selection = tuple(pairs.values())
+    if len(_selections) >= MAX_FIELD_SELECTIONS:
+        _selections.clear()
+    _selections[query] = selection
+    return selection
+
+
+def scrape_metrics(query, selection):
+    """
+    Collect and encode the /metrics response for a query string.
+
+    Full scrapes, and scrapes naming a ?consumer=, also report the peaks
+    since that consumer's previous scrape ("default" when unnamed).
+    """
+    metrics = collect_metrics(selection)
+    consumer = parse_qs(query).get("consumer", [""])[0]
+    if selection is None or consumer:
+        peaks = SAMPLER.peaks(consumer or "default")
+        if peaks is not None:
+            metrics["peaks"] = peaks
+    return encode_metrics(metrics)
+
+
+@timed("collect_metrics")
+def collect_metrics(selection=None):
+    """
+    Collect system metrics into a dictionary, re-running only due collectors.
+
+    selection comes from select_fields(); None collects every field, otherwise
+    only the selected collectors run and only their values are returned.
+    Fields whose collector raised, overran its budget or is quarantined keep
+    their last good value and are listed under "stale".
+    """
+    now = time.monotonic()
+    hostname = INFO_COLLECTORS["hostname"]
+    if selection is None:
+        model = INFO_COLLECTORS["model"]
+        collectors = [hostname, model, *COLLECTORS.values()]
+        refresh(collectors, now)
+        metrics = {
+            "hostname": hostname.value,
+            "model": model.value,
+            "timestamp": datetime.now().isoformat(),
+        }
+        for collector in COLLECTORS.values():
+            store(metrics, collector.path, collector.value)
+    else:
+        collectors = [hostname, *dict.fromkeys(collector for collector, _ in selection)]
+        refresh(collectors, now)
+        metrics = {"hostname": hostname.value, "timestamp": datetime.now().isoformat()}
+        for collector, subpath in selection:
+            value = collector.value
+            for key in subpath:
+                value = value.get(key) if isinstance(value, dict) else None
+            store(metrics, collector.path + list(subpath), value)
+    stale = [collector.name for collector in collectors if collector.stale]
+    if stale:
+        metrics["stale"] = stale
+    return metrics
+
+
+def load_plugins(directory):
+    """
+    Load third-party collectors from *.py files in directory.
+
+    Each file must define register(agent), which is called with this module
+    so it can call agent.register_collector(...). Broken plugins are skipped.
+    """
+    if not os.path.isdir(directory):
+        return []
+    loaded = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".py"):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            spec = importlib.util.spec_from_file_location(
+                f"pi_monitor_plugin_{filename[:-3]}", path
+            )
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            module.register(sys.modules[__name__])
+        except Exception as e:
+            print(f"⚠️  Skipping collector plugin {path}: {e}")
+            continue
+        loaded.append(filename)
+    return loaded
+
+
+register_collector("hostname", lambda: HOSTNAME, info=True)
+register_collector("model", get_pi_model, info=True)
+register_collector("kernel", get_kernel, info=True)
+register_collector("interfaces", get_network_interfaces, interval=1, info=True)
+
+register_collector("ip", get_network_ip)
+register_collector("cpu.usage_percent", get_cpu_usage)
+register_collector("cpu.temperature", get_cpu_temp)
+register_collector("cpu.load_average", get_load_average, interval=5)  # Kernel updates every 5s
+register_collector("memory", get_memory_info)
+register_collector("disk", get_disk_info, interval=30, cost=COST_EXPENSIVE)
+register_collector("uptime", get_uptime, interval=30)
+register_collector("averages", SAMPLER.averages)
+register_collector("throttled", get_throttled)
+
+
+def encode_metrics(metrics):
+    """Serialize a metrics dictionary to the JSON bytes served on /metrics."""
+    return json.dumps(metrics, indent=2).encode()
+
+
+class Flight:
+    """One shared computation: its result (or error) and when it finished."""
+
+    __slots__ = ("done", "result", "error", "finished")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key into one computation.
+
+    The first caller for a key runs func; callers arriving while it runs wait
+    for its result, and callers arriving within COALESCE_WINDOW seconds after
+    it finished reuse it. Every caller of one flight gets the same object.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def do(self, key, func):
+        """Return func()'s result, shared with concurrent callers using key."""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None and (
+                flight.finished is None or time.monotonic() - flight.finished < COALESCE_WINDOW
+            ):
+                leader = False
+            else:
+                if len(self.flights) >= MAX_FIELD_SELECTIONS:
+                    self.prune()
+                flight = self.flights[key] = Flight()
+                leader = True
+
+        if not leader:
+            STATS.incr("singleflight.shared")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            flight.finished = time.monotonic()
+            flight.done.set()
+        return flight.result
+
+    def prune(self):
+        """Forget finished flights (called with the lock held)."""
+        for key in [key for key, flight in self.flights.items() if flight.done.is_set()]:
+            del self.flights[key]
+
+
+# Shared /metrics responses, keyed by query string
+METRICS_FLIGHT = SingleFlight()
 
 
 # =============================================================================
@@ -187,29 +1376,213 @@ def collect_metrics():
 # =============================================================================
 
 
+class AgentServer(HTTPServer):
+    """
+    HTTP server with a fixed pool of worker threads and keep-alive connections.
+
+    Idle connections, including newly accepted ones, wait in a selector
+    watched by one thread and are handed to a worker only once a request
+    arrives. A stalled or idle client therefore never occupies a worker,
+    and at most `workers` requests run at once. Connections idle for
+    KEEPALIVE_TIMEOUT seconds are closed.
+    """
+
+    request_queue_size = 32
+
+    def __init__(self, address, handler_class, workers=SERVER_WORKERS):
+        super().__init__(address, handler_class)
+        self.ready = queue.Queue()  # (request, client_address) with a request waiting
+        self.parked = deque()  # Connections handed back by workers and the acceptor
+        self.selector = selectors.DefaultSelector()
+        self.wakeup, self.waker = socket.socketpair()
+        self.wakeup.setblocking(False)
+        self.waker.setblocking(False)
+        self.selector.register(self.wakeup, selectors.EVENT_READ)
+        self.closing = False
+        self.threads = [threading.Thread(target=self.watch, name="http-idle", daemon=True)]
+        self.threads += [
+            threading.Thread(target=self.work, name=f"http-worker-{n}", daemon=True)
+            for n in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def process_request(self, request, client_address):
+        """Park a newly accepted connection until its first request arrives."""
+        self.park(request, client_address)
+
+    def park(self, request, client_address):
+        """Hand an idle connection to the watcher thread."""
+        self.parked.append((request, client_address))
+        try:
+            self.waker.send(b"\0")
+        except OSError:
+            pass  # Wake-up byte already pending, or closing
+
+    def watch(self):
+        """Dispatch connections with a request waiting and close expired idle ones."""
+        sweep_interval = min(1.0, KEEPALIVE_TIMEOUT)
+        last_sweep = time.monotonic()
+        while not self.closing:
+            for key, _ in self.selector.select(timeout=sweep_interval):
+                if key.fileobj is self.wakeup:
+                    try:
+                        self.wakeup.recv(4096)
+                    except OSError:
+                        pass
+                    continue
+                self.selector.unregister(key.fileobj)
+                self.ready.put(key.data[:2])
+            now = time.monotonic()
+            while self.parked:
+                request, client_address = self.parked.popleft()
+                self.selector.register(
+                    request, selectors.EVENT_READ, (request, client_address, now)
+                )
+            if now - last_sweep >= sweep_interval:
+                last_sweep = now
+                for key in list(self.selector.get_map().values()):
+                    if key.data is not None and now - key.data[2] >= KEEPALIVE_TIMEOUT:
+                        self.selector.unregister(key.fileobj)
+                        self.shutdown_request(key.fileobj)
+                        STATS.incr("http.idle_closed")
+
+    def work(self):
+        """Serve connections from the ready queue until None is received."""
+        while True:
+            item = self.ready.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                handler = self.RequestHandlerClass(request, client_address, self)
+            except Exception:
+                self.handle_error(request, client_address)
+                self.shutdown_request(request)
+                continue
+            if handler.close_connection or self.closing:
+                self.shutdown_request(request)
+            else:
+                self.park(request, client_address)
+
+    def server_close(self):
+        """Stop the watcher and workers and close every connection."""
+        self.closing = True
+        try:
+            self.waker.send(b"\0")
+        except OSError:
+            pass
+        for _ in self.threads[1:]:
+            self.ready.put(None)
+        for thread in self.threads:
+            thread.join(timeout=1)
+        for key in list(self.selector.get_map().values()):
+            if key.fileobj is not self.wakeup:
+                self.shutdown_request(key.fileobj)
+        for request, _ in self.parked:
+            self.shutdown_request(request)
+        self.selector.close()
+        self.wakeup.close()
+        self.waker.close()
+        super().server_close()
+
+
 class MetricsHandler(BaseHTTPRequestHandler):
     """Simple HTTP handler for the metrics endpoint."""
 
+    protocol_version = "HTTP/1.1"
+    timeout = REQUEST_TIMEOUT
+    disable_nagle_algorithm = True  # Headers and body are separate writes on a kept-alive socket
+
     def log_message(self, format, *args):
         """Suppress default logging for lightweight operation."""
         pass
 
+    def handle(self):
+        """
+        Serve requests on this connection.
+
+        On an AgentServer, return as soon as no further request is waiting
+        so the idle connection goes back to the server's watcher instead of
+        holding this worker thread.
+        """
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if isinstance(self.server, AgentServer) and not self.request_pending():
+                return
+            self.handle_one_request()
+
+    def request_pending(self):
+        """Return True if another request is buffered or readable without blocking."""
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
     def do_GET(self):
         """Handle GET requests."""
-        if self.path in ("/", "/metrics"):
-            metrics = collect_metrics()
-            response = json.dumps(metrics, indent=2)
-
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.send_header("Access-Control-Allow-Origin", "*")
-            self.end_headers()
-            self.wfile.write(response.encode())
+        start = perf_counter()
+        path, _, query = self.path.partition("?")
+        if path in ("/", "/metrics"):
+            route = "http./metrics"
+            try:
+                selection = select_fields(query)
+            except ValueError as e:
+                self.send_text(400, str(e).encode())
+            else:
+                self.send_json(METRICS_FLIGHT.do(query, lambda: scrape_metrics(query, selection)))
+        elif path == "/info":
+            route = "http./info"
+            self.send_json(json.dumps(collect_info(), indent=2).encode())
+        elif path == "/debug/stats":
+            route = "http./debug/stats"
+            stats = STATS.snapshot()
+            stats["collectors"] = {name: c.describe() for name, c in COLLECTORS.items()}
+            self.send_json(json.dumps(stats, indent=2).encode())
+        elif path == "/debug/profile":
+            route = "http./debug/profile"
+            self.send_profile(query)
         else:
-            self.send_response(404)
-            self.send_header("Content-Type", "text/plain")
-            self.end_headers()
-            self.wfile.write(b"Not Found")
+            route = "http.other"
+            STATS.incr("http.not_found")
+            self.send_text(404, b"Not Found")
+        STATS.histogram(route).observe(perf_counter() - start)
+
+    def send_profile(self, query):
+        """Run the sampling profiler and send collapsed stacks, if authorized."""
+        params = parse_qs(query)
+        token = params.get("token", [""])[0] or self.headers.get("X-Debug-Token", "")
+        if not DEBUG_TOKEN or not hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode()):
+            self.send_text(403, b"Forbidden")
+            return
+        try:
+            seconds = float(params.get("seconds", ["5"])[0])
+        except ValueError:
+            self.send_text(400, b"Invalid seconds")
+            return
+        seconds = max(0.0, min(seconds, PROFILE_MAX_SECONDS))
+        self.send_text(200, format_collapsed(sample_stacks(seconds)).encode())
+
+    def send_text(self, status, body):
+        """Send a plain text response."""
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, body):
+        """Send a 200 response with a JSON body."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
 
 
 # =============================================================================
@@ -220,6 +1593,7 @@ class MetricsHandler(BaseHTTPRequestHandler):
 def main():
     """Start the metrics server."""
     ip = get_network_ip()
+    plugins = load_plugins(COLLECTORS_DIR)
 
     print("=" * 50)
     print("🍓 Pi Monitor Agent")
@@ -228,16 +1602,22 @@ def main():
     print(f"IP:        {ip}")
     print(f"Port:      {PORT}")
     print(f"Endpoint:  http://{ip}:{PORT}/metrics")
+    if plugins:
+        print(f"Plugins:   {', '.join(plugins)}")
     print("=" * 50)
     print("Press Ctrl+C to stop")
     print()
 
-    server = HTTPServer(("0.0.0.0", PORT), MetricsHandler)
+    if SAMPLE_INTERVAL > 0:
+        SAMPLER.start()
+
+    server = AgentServer(("0.0.0.0", PORT), MetricsHandler)
 
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print("\n👋 Shutting down...")
+        SAMPLER.stop()
         server.shutdown()
 
 
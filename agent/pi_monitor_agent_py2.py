@@ -5,6 +5,11 @@ Pi Monitor Agent (Python 2/3 Compatible)
 Lightweight system metrics collector for Raspberry Pi.
 Works on OpenELEC and other systems with older Python versions.
 
+This is the minimal-footprint agent: it imports only os, select, socket,
+threading and time, serves HTTP directly on sockets instead of through
+http.server, and renders /metrics from a template instead of building dictionaries and
+calling json (which is imported only to quote an unusual string).
+
 Usage:
     python pi_monitor_agent_py2.py
 
@@ -14,28 +19,28 @@ Metrics endpoint:
 
 from __future__ import print_function
 
-import json
 import os
+import select
 import socket
+import threading
 import time
 
-# Python 2/3 compatible imports
-try:
-    from http.server import BaseHTTPRequestHandler, HTTPServer
-except ImportError:
-    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
-
-try:
-    from datetime import datetime
-except ImportError:
-    import datetime
-
 # =============================================================================
 # Configuration
 # =============================================================================
 
 PORT = 5555  # Change if needed
 
+# HTTP serving: SERVER_WORKERS threads serve requests. Connections stay open
+# between requests (HTTP/1.1 keep-alive); while idle they wait in poll() on one
+# watcher thread instead of holding a worker, until idle for KEEPALIVE_TIMEOUT
+# seconds. A worker waits at most REQUEST_TIMEOUT seconds for the rest of a
+# partly sent request, less than the dashboard's 3 second fetch timeout.
+SERVER_WORKERS = 2
+KEEPALIVE_TIMEOUT = 15
+REQUEST_TIMEOUT = 2
+REQUEST_BUFFER_SIZE = 4096  # Bytes preallocated per connection for request headers
+
 # =============================================================================
 # Metrics Collection (reads directly from /proc and /sys)
 # =============================================================================
@@ -61,13 +66,9 @@ def get_cpu_usage():
         idle = values[3]
         total = sum(values)
 
-        # Store previous values for delta calculation
-        if not hasattr(get_cpu_usage, "prev"):
-            get_cpu_usage.prev = (idle, total)
-            time.sleep(0.1)
-            return get_cpu_usage()
-
-        prev_idle, prev_total = get_cpu_usage.prev
+        # Store previous values for delta calculation; the first call reports
+        # the average since boot instead of sleeping for a baseline
+        prev_idle, prev_total = getattr(get_cpu_usage, "prev", (0, 0))
         get_cpu_usage.prev = (idle, total)
 
         idle_delta = idle - prev_idle
@@ -81,47 +82,40 @@ def get_cpu_usage():
 
 
 def get_memory_info():
-    """Get memory usage from /proc/meminfo."""
+    """Get (total_mb, used_mb, available_mb, percent) from /proc/meminfo."""
     try:
-        mem = {}
+        total = available = free = 0
         with open("/proc/meminfo") as f:
             for line in f:
-                parts = line.split()
-                if parts[0] in ["MemTotal:", "MemAvailable:", "MemFree:"]:
-                    mem[parts[0][:-1]] = int(parts[1])
-
-        total = mem.get("MemTotal", 0) / 1024.0  # Convert to MB
-        available = mem.get("MemAvailable", mem.get("MemFree", 0)) / 1024.0
+                if line.startswith("MemTotal:"):
+                    total = int(line.split()[1])
+                elif line.startswith("MemAvailable:"):
+                    available = int(line.split()[1])
+                elif line.startswith("MemFree:"):
+                    free = int(line.split()[1])
+
+        total = total / 1024.0  # Convert to MB
+        available = (available or free) / 1024.0
         used = total - available
         percent = round((used / total) * 100, 1) if total > 0 else 0
 
-        return {
-            "total_mb": int(round(total)),
-            "used_mb": int(round(used)),
-            "available_mb": int(round(available)),
-            "percent": percent,
-        }
+        return int(round(total)), int(round(used)), int(round(available)), percent
     except (IOError, OSError, ValueError):
-        return {"total_mb": 0, "used_mb": 0, "available_mb": 0, "percent": 0}
+        return 0, 0, 0, 0
 
 
 def get_disk_info():
-    """Get disk usage using os.statvfs."""
+    """Get (total_gb, used_gb, free_gb, percent) using os.statvfs."""
     try:
         stat = os.statvfs("/")
-        total = (stat.f_blocks * stat.f_frsize) / (1024**3)  # GB
-        free = (stat.f_bavail * stat.f_frsize) / (1024**3)
+        total = (stat.f_blocks * stat.f_frsize) / float(1024**3)  # GB
+        free = (stat.f_bavail * stat.f_frsize) / float(1024**3)
         used = total - free
         percent = round((used / total) * 100, 1) if total > 0 else 0
 
-        return {
-            "total_gb": round(total, 1),
-            "used_gb": round(used, 1),
-            "free_gb": round(free, 1),
-            "percent": percent,
-        }
+        return round(total, 1), round(used, 1), round(free, 1), percent
     except OSError:
-        return {"total_gb": 0, "used_gb": 0, "free_gb": 0, "percent": 0}
+        return 0, 0, 0, 0
 
 
 def get_uptime():
@@ -149,9 +143,9 @@ def get_load_average():
     try:
         with open("/proc/loadavg") as f:
             loads = f.read().split()[:3]
-        return [float(load) for load in loads]
-    except (IOError, OSError, ValueError):
-        return [0.0, 0.0, 0.0]
+        return float(loads[0]), float(loads[1]), float(loads[2])
+    except (IOError, OSError, ValueError, IndexError):
+        return 0.0, 0.0, 0.0
 
 
 def get_network_ip():
@@ -162,7 +156,7 @@ def get_network_ip():
         ip = s.getsockname()[0]
         s.close()
         return ip
-    except OSError:
+    except socket.error:
         return "unknown"
 
 
@@ -183,57 +177,304 @@ def get_pi_model():
         return "Unknown Model"
 
 
-def collect_metrics():
-    """Collect all system metrics into a dictionary."""
-    try:
-        timestamp = datetime.now().isoformat()
-    except:
-        timestamp = str(time.time())
-
-    return {
-        "hostname": HOSTNAME,
-        "ip": get_network_ip(),
-        "model": get_pi_model(),
-        "timestamp": timestamp,
-        "cpu": {
-            "usage_percent": get_cpu_usage(),
-            "temperature": get_cpu_temp(),
-            "load_average": get_load_average(),
-        },
-        "memory": get_memory_info(),
-        "disk": get_disk_info(),
-        "uptime": get_uptime(),
-    }
+# Serializes collections; get_cpu_usage keeps its previous counters between calls
+collect_lock = threading.Lock()
+
+# Static fields, quoted on first use
+static_fields = {}
+
+# The /metrics body: every value is a JSON literal rendered by json_value()
+METRICS_TEMPLATE = (
+    '{"hostname": %s, "ip": %s, "model": %s, "timestamp": %s, '
+    '"cpu": {"usage_percent": %s, "temperature": %s, "load_average": [%s, %s, %s]}, '
+    '"memory": {"total_mb": %s, "used_mb": %s, "available_mb": %s, "percent": %s}, '
+    '"disk": {"total_gb": %s, "used_gb": %s, "free_gb": %s, "percent": %s}, '
+    '"uptime": %s}'
+)
+
+
+def json_value(value):
+    """Return value as a JSON literal; json is only imported for unusual strings."""
+    if value is None:
+        return "null"
+    if not isinstance(value, str):
+        return repr(value)
+    for char in value:
+        if not " " <= char <= "~" or char in '"\\':
+            import json
+
+            return json.dumps(value)
+    return '"' + value + '"'
+
+
+def format_timestamp(now):
+    """Format epoch seconds as local time like datetime.isoformat(), without datetime."""
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now)) + ".%06d" % (now % 1 * 1e6)
+
+
+def render_metrics():
+    """Collect all system metrics and return the /metrics JSON body as bytes."""
+    if not static_fields:
+        static_fields["hostname"] = json_value(HOSTNAME)
+        static_fields["model"] = json_value(get_pi_model())
+    with collect_lock:
+        usage = get_cpu_usage()
+    loads = get_load_average()
+    memory = get_memory_info()
+    disk = get_disk_info()
+    values = (
+        static_fields["hostname"],
+        json_value(get_network_ip()),
+        static_fields["model"],
+        json_value(format_timestamp(time.time())),
+        json_value(usage),
+        json_value(get_cpu_temp()),
+        json_value(loads[0]),
+        json_value(loads[1]),
+        json_value(loads[2]),
+        json_value(memory[0]),
+        json_value(memory[1]),
+        json_value(memory[2]),
+        json_value(memory[3]),
+        json_value(disk[0]),
+        json_value(disk[1]),
+        json_value(disk[2]),
+        json_value(disk[3]),
+        json_value(get_uptime()),
+    )
+    return (METRICS_TEMPLATE % values).encode("ascii")
 
 
 # =============================================================================
 # HTTP Server
 # =============================================================================
 
-
-class MetricsHandler(BaseHTTPRequestHandler):
-    """Simple HTTP handler for the metrics endpoint."""
-
-    def log_message(self, format, *args):
-        """Suppress default logging for lightweight operation."""
-        pass
-
-    def do_GET(self):
-        """Handle GET requests."""
-        if self.path in ("/", "/metrics"):
-            metrics = collect_metrics()
-            response = json.dumps(metrics, indent=2)
-
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.send_header("Access-Control-Allow-Origin", "*")
-            self.end_headers()
-            self.wfile.write(response.encode("utf-8"))
+# Responses are status line and headers followed by Content-Length and the body
+METRICS_HEAD = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Access-Control-Allow-Origin: *\r\n"
+    b"Content-Length: "
+)
+NOT_FOUND = b"HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\nContent-Length: 9\r\n"
+BAD_REQUEST = (
+    b"HTTP/1.1 400 Bad Request\r\nContent-Type: text/plain\r\nContent-Length: 11\r\n"
+    b"Connection: close\r\n\r\nBad Request"
+)
+CLOSE = b"Connection: close\r\n"
+
+
+def read_request(connection, buffer, filled):
+    """
+    Read one request's head into buffer, which holds filled bytes already.
+
+    Returns (head, filled) with the bytes after the head moved to the start
+    of buffer, or (None, 0) when the client closed the connection. A head
+    larger than the buffer is returned as b"".
+    """
+    view = memoryview(buffer)
+    while True:
+        end = buffer.find(b"\r\n\r\n", 0, filled)
+        if end >= 0:
+            head = bytes(buffer[:end])
+            rest = filled - end - 4
+            buffer[:rest] = buffer[end + 4 : filled]
+            return head, rest
+        if filled == len(buffer):
+            return b"", 0
+        received = connection.recv_into(view[filled:])
+        if not received:
+            return None, 0
+        filled += received
+
+
+def keep_alive(version, headers):
+    """Return whether the connection stays open after this request."""
+    connection = b""
+    for line in headers.split(b"\r\n"):
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"connection":
+            connection = value.strip().lower()
+    if version == b"HTTP/1.1":
+        return connection != b"close"
+    return connection == b"keep-alive"
+
+
+class Connection(object):
+    """A client connection and the request bytes read from it so far."""
+
+    __slots__ = ("sock", "buffer", "filled", "since")
+
+    def __init__(self, sock, now):
+        self.sock = sock
+        self.buffer = bytearray(REQUEST_BUFFER_SIZE)
+        self.filled = 0  # Bytes of buffer holding the start of the next request
+        self.since = now  # time.time() the connection became idle
+
+
+def serve_connection(connection):
+    """
+    Serve the requests that have arrived on connection.
+
+    Returns True once no request is left in its buffer, so the connection can
+    wait idle for the next one, or False when it must be closed.
+    """
+    sock = connection.sock
+    sock.settimeout(REQUEST_TIMEOUT)
+    while True:
+        head, connection.filled = read_request(sock, connection.buffer, connection.filled)
+        if head is None:
+            return False
+        request_line, _, headers = head.partition(b"\r\n")
+        parts = request_line.split()
+        if len(parts) != 3 or parts[0] not in (b"GET", b"HEAD"):
+            sock.sendall(BAD_REQUEST)
+            return False
+        method, path, version = parts
+        persistent = keep_alive(version, headers)
+        if path.split(b"?", 1)[0] in (b"/", b"/metrics"):
+            body = render_metrics()
+            response = METRICS_HEAD + str(len(body)).encode("ascii") + b"\r\n"
         else:
-            self.send_response(404)
-            self.send_header("Content-Type", "text/plain")
-            self.end_headers()
-            self.wfile.write(b"Not Found")
+            body = b"Not Found"
+            response = NOT_FOUND
+        response += (b"" if persistent else CLOSE) + b"\r\n"
+        sock.sendall(response if method == b"HEAD" else response + body)
+        if not persistent:
+            return False
+        if not connection.filled:
+            return True
+
+
+class AgentServer(object):
+    """
+    HTTP server with a fixed pool of worker threads and keep-alive connections.
+
+    Idle connections, including newly accepted ones, wait in a poll() set
+    watched by one thread and are handed to a worker only once a request
+    arrives. An idle or stalled client therefore never occupies a worker,
+    and at most `workers` requests run at once. Connections idle for
+    KEEPALIVE_TIMEOUT seconds are closed.
+    """
+
+    def __init__(self, address, workers=SERVER_WORKERS):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(address)
+        self.listener.listen(32)
+        self.listener.setblocking(False)
+        self.server_address = self.listener.getsockname()
+        self.wakeup, self.waker = socket.socketpair()
+        self.wakeup.setblocking(False)
+        self.waker.setblocking(False)
+        self.condition = threading.Condition()
+        self.ready = []  # Connections with a request waiting; None stops a worker
+        self.parked = []  # Connections handed back by workers
+        self.closing = False
+        self.threads = [threading.Thread(target=self.watch)]
+        self.threads += [threading.Thread(target=self.work) for _ in range(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def park(self, connection):
+        """Hand an idle connection back to the watcher thread."""
+        with self.condition:
+            self.parked.append(connection)
+        self.wake()
+
+    def wake(self):
+        """Interrupt the watcher's poll()."""
+        try:
+            self.waker.send(b"\0")
+        except socket.error:
+            pass  # Wake-up byte already pending, or closing
+
+    def watch(self):
+        """Accept connections, dispatch those with a request waiting and close expired ones."""
+        poller = select.poll()
+        poller.register(self.listener, select.POLLIN)
+        poller.register(self.wakeup, select.POLLIN)
+        listener, wakeup = self.listener.fileno(), self.wakeup.fileno()
+        idle = {}  # File descriptor -> Connection
+        last_sweep = time.time()
+        while not self.closing:
+            try:
+                events = poller.poll(1000)
+            except select.error:
+                continue  # Interrupted by a signal (Python 2)
+            now = time.time()
+            for fd, _ in events:
+                if fd == listener:
+                    try:
+                        sock, _ = self.listener.accept()
+                    except socket.error:
+                        continue  # The client gave up before it was accepted
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    idle[sock.fileno()] = Connection(sock, now)
+                    poller.register(sock, select.POLLIN)
+                elif fd == wakeup:
+                    try:
+                        self.wakeup.recv(4096)
+                    except socket.error:
+                        pass
+                else:
+                    poller.unregister(fd)
+                    with self.condition:
+                        self.ready.append(idle.pop(fd))
+                        self.condition.notify()
+            with self.condition:
+                parked, self.parked = self.parked, []
+            for connection in parked:
+                connection.since = now
+                idle[connection.sock.fileno()] = connection
+                poller.register(connection.sock, select.POLLIN)
+            if now - last_sweep >= 1:
+                last_sweep = now
+                for fd, connection in list(idle.items()):
+                    if now - connection.since >= KEEPALIVE_TIMEOUT:
+                        poller.unregister(fd)
+                        del idle[fd]
+                        connection.sock.close()
+        for connection in idle.values():
+            connection.sock.close()
+
+    def work(self):
+        """Serve connections from the ready list until None is received."""
+        while True:
+            with self.condition:
+                while not self.ready:
+                    self.condition.wait()
+                connection = self.ready.pop(0)
+            if connection is None:
+                return
+            try:
+                idle = serve_connection(connection)
+            except socket.error:
+                idle = False  # Timed out or reset by the client
+            except Exception as e:
+                print("Error serving a request: {0!r}".format(e))
+                idle = False
+            if idle:
+                self.park(connection)
+            else:
+                connection.sock.close()
+
+    def stop(self):
+        """Stop accepting, close idle connections and wait for the workers to finish."""
+        self.closing = True
+        with self.condition:
+            self.ready.extend([None] * (len(self.threads) - 1))
+            self.condition.notify_all()
+        self.wake()
+        for thread in self.threads:
+            thread.join()
+        with self.condition:
+            parked, self.parked = self.parked, []
+        for connection in parked:
+            connection.sock.close()
+        for sock in (self.listener, self.wakeup, self.waker):
+            sock.close()
 
 
 # =============================================================================
@@ -256,13 +497,14 @@ def main():
     print("Press Ctrl+C to stop")
     print("")
 
-    server = HTTPServer(("0.0.0.0", PORT), MetricsHandler)
+    server = AgentServer(("0.0.0.0", PORT))
 
     try:
-        server.serve_forever()
+        while True:
+            time.sleep(3600)
     except KeyboardInterrupt:
         print("\nShutting down...")
-        server.shutdown()
+        server.stop()
 
 
 if __name__ == "__main__":
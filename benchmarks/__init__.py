@@ -0,0 +1,5 @@
+# Pi Monitor - Benchmarks Package
+# ================================
+#
+# Benchmark harnesses for the agent and dashboard. Run them from the
+# repository root, e.g. ``python3 -m benchmarks.fleet --help``.
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Pi Monitor Agent Collector Micro-Benchmark
+==========================================
+Times each agent collector, collect_metrics() (with cached and with all
+collectors due), the full collect+serialize path, the background sampler tick
+and the self-instrumentation hot path, against the live /proc and /sys and
+against recorded fixture trees in benchmarks/fixtures/.
+
+Usage:
+    python3 -m benchmarks.collectors
+    python3 -m benchmarks.collectors --source fixture:pi-zero-w --number 2000
+    python3 -m benchmarks.collectors --save-baseline benchmarks/baselines/collectors.json
+    python3 -m benchmarks.collectors --baseline benchmarks/baselines/collectors.json
+
+Results are per-call microseconds (best and median of --repeat rounds). The
+baseline is machine specific: record it on the machine that runs the
+comparison. Exits with status 1 if a best time regressed by more than
+--threshold.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from agent import pi_monitor_agent as agent
+from benchmarks.common import compare_to_baseline, load_json, save_json
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "baselines", "collectors.json"
+)
+
+# A typical high-frequency narrow scrape
+NARROW_QUERY = "fields=cpu.temperature,cpu.load_average"
+
+# =============================================================================
+# Benchmarks
+# =============================================================================
+
+
+def benchmark_cases():
+    """Return (name, callable) pairs for everything that gets timed."""
+    sample = agent.collect_metrics()
+    histogram = agent.Histogram()
+    sampler = agent.Sampler()
+    sampler.reset()
+    rolling = agent.RollingAverages([4, 40, 240, 1200])
+    return [
+        ("get_cpu_temp", agent.get_cpu_temp),
+        ("get_cpu_usage", agent.get_cpu_usage),
+        ("get_memory_info", agent.get_memory_info),
+        ("get_disk_info", agent.get_disk_info),
+        ("get_uptime", agent.get_uptime),
+        ("get_load_average", agent.get_load_average),
+        ("get_network_ip", agent.get_network_ip),
+        ("get_pi_model", agent.get_pi_model),
+        ("get_throttled", agent.get_throttled),
+        ("collect_metrics", agent.collect_metrics),
+        ("collect_metrics_cold", lambda: (agent.invalidate_collectors(), agent.collect_metrics())),
+        ("encode_metrics", lambda: agent.encode_metrics(sample)),
+        ("collect_and_encode", lambda: agent.encode_metrics(agent.collect_metrics())),
+        (
+            "collect_and_encode_narrow",
+            lambda: agent.encode_metrics(agent.collect_metrics(agent.select_fields(NARROW_QUERY))),
+        ),
+        ("histogram_observe", lambda: histogram.observe(0.0003)),
+        ("rolling_averages_add", lambda: rolling.add(42.0)),
+        ("sampler_sample_once", sampler.sample_once),
+    ]
+
+
+def time_call(func, number, repeat):
+    """Return per-call seconds for each of repeat rounds of number calls."""
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - start) / number)
+    return rounds
+
+
+def use_source(source):
+    """Point the agent at the live system or at a fixture tree."""
+    if source == "real":
+        return
+    name = source.split(":", 1)[1]
+    root = os.path.join(FIXTURES_DIR, name)
+    if not os.path.isdir(root):
+        raise SystemExit(f"Unknown fixture tree: {root}")
+    agent.use_fs_root(root)
+
+
+def run_source(source, number, repeat):
+    """Benchmark every case against one source and return per-case results."""
+    defaults = {setting: getattr(agent, setting) for setting in ("FS_ROOT", *agent.KERNEL_PATHS)}
+    use_source(source)
+    try:
+        if hasattr(agent.get_cpu_usage, "prev"):
+            del agent.get_cpu_usage.prev
+        agent.invalidate_collectors()
+        agent.get_cpu_usage()  # Prime the delta so the 0.1s warm-up sleep is excluded
+        results = {}
+        for name, func in benchmark_cases():
+            rounds = time_call(func, number, repeat)
+            results[name] = {
+                "best_us": round(min(rounds) * 1e6, 2),
+                "median_us": round(statistics.median(rounds) * 1e6, 2),
+            }
+        return results
+    finally:
+        for setting, value in defaults.items():
+            setattr(agent, setting, value)
+        agent.invalidate_collectors()
+
+
+def available_sources():
+    """Return the live system plus every recorded fixture tree."""
+    fixtures = sorted(
+        name for name in os.listdir(FIXTURES_DIR) if os.path.isdir(os.path.join(FIXTURES_DIR, name))
+    )
+    return ["real"] + [f"fixture:{name}" for name in fixtures]
+
+
+def baseline_checks(report):
+    """Return the best time of every benchmarked case as a lower-is-better check."""
+    return {
+        f"results.{source}.{name}.best_us": "lower"
+        for source, cases in report["results"].items()
+        for name in cases
+    }
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--source",
+        action="append",
+        help="'real' or 'fixture:<name>' (repeatable, default: all)",
+    )
+    parser.add_argument("--number", type=int, default=500, help="calls per round")
+    parser.add_argument("--repeat", type=int, default=5, help="rounds per case")
+    parser.add_argument("--baseline", nargs="?", const=DEFAULT_BASELINE, help="compare to file")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, help="write file")
+    parser.add_argument(
+        "--threshold", type=float, default=0.25, help="allowed regression (fraction)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the collector benchmark from the command line."""
+    args = parse_args(argv)
+    sources = args.source or available_sources()
+    report = {
+        "config": {"number": args.number, "repeat": args.repeat},
+        "results": {source: run_source(source, args.number, args.repeat) for source in sources},
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        save_json(args.save_baseline, report)
+
+    if args.baseline:
+        regressions = compare_to_baseline(
+            report, load_json(args.baseline), baseline_checks(report), args.threshold
+        )
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
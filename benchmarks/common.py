@@ -0,0 +1,97 @@
+# Pi Monitor - Benchmark Helpers
+# ===============================
+#
+# Shared helpers for the benchmark scripts: percentiles, memory usage and
+# comparison of a report against a stored baseline.
+
+import json
+import math
+import resource
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile (0-100) of values using nearest-rank."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = min(len(ordered) - 1, max(0, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(values, scale=1.0):
+    """Summarize a list of samples as count/mean/p50/p99/max, multiplied by scale."""
+    if not values:
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values) * scale, 4),
+        "p50": round(percentile(values, 50) * scale, 4),
+        "p99": round(percentile(values, 99) * scale, 4),
+        "max": round(max(values) * scale, 4),
+    }
+
+
+def rss_mb():
+    """Return the current resident set size of this process in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except (FileNotFoundError, PermissionError, ValueError):
+        pass
+    return 0.0
+
+
+def max_rss_mb():
+    """Return the peak resident set size of this process in MB."""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def lookup(report, path):
+    """Look up a dotted path such as "poll.cycle_seconds.p50" in a report."""
+    value = report
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare_to_baseline(report, baseline, checks, threshold):
+    """
+    Compare report against baseline.
+
+    checks maps a dotted metric path to "lower" or "higher" (which direction
+    is better). Returns a list of human-readable regression messages; an
+    empty list means no metric regressed by more than threshold (a fraction).
+    """
+    regressions = []
+    for path, better in checks.items():
+        current = lookup(report, path)
+        previous = lookup(baseline, path)
+        if not isinstance(current, (int, float)) or not isinstance(previous, (int, float)):
+            continue
+        if previous <= 0:
+            continue
+        change = (current - previous) / previous
+        if (better == "lower" and change > threshold) or (
+            better == "higher" and change < -threshold
+        ):
+            regressions.append(
+                f"{path}: {previous} -> {current} ({change:+.0%}, limit {threshold:.0%})"
+            )
+    return regressions
+
+
+def load_json(path):
+    """Load a JSON document from path."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_json(path, data):
+    """Write data to path as indented JSON."""
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
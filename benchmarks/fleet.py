@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Pi Monitor Fleet Benchmark
+==========================
+Spins up a synthetic fleet of fake agents on loopback and drives the real
+dashboard poller and HTTP handler against it.
+
+Every fake agent listens on its own 127.x.y.z address (Linux routes the whole
+127.0.0.0/8 block to loopback), all on the same port, so the dashboard's
+``MONITORED_HOSTS``/``AGENT_PORT`` configuration is used unchanged.
+
+Usage:
+    python3 -m benchmarks.fleet --agents 500 --latency-ms 5 --failure-rate 0.01
+    python3 -m benchmarks.fleet --agents 200 --save-baseline fleet-baseline.json
+    python3 -m benchmarks.fleet --agents 200 --baseline fleet-baseline.json
+    python3 -m benchmarks.fleet --agents 2000 --query "sort=-temperature&limit=50"
+
+Reported metrics:
+    poll.cycle_seconds      Duration of one poll_once() pass over the fleet
+    staleness_seconds       Age of the oldest online host seen by API clients
+    api                     /api/metrics throughput and latency percentiles
+    rss_mb / max_rss_mb     Memory of the benchmark process (dashboard + fleet)
+
+Exits with status 1 if --baseline is given and a metric regressed by more
+than --threshold.
+"""
+
+import argparse
+import json
+import random
+import resource
+import selectors
+import socketserver
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import urlopen
+
+from benchmarks.common import (
+    compare_to_baseline,
+    load_json,
+    max_rss_mb,
+    rss_mb,
+    save_json,
+    summarize,
+)
+from dashboard import pi_monitor_dashboard as dashboard
+
+# Metrics compared against a baseline, and which direction is better.
+BASELINE_CHECKS = {
+    "poll.cycle_seconds.p50": "lower",
+    "poll.cycle_seconds.p99": "lower",
+    "staleness_seconds.p99": "lower",
+    "api.throughput_rps": "higher",
+    "api.latency_ms.p50": "lower",
+    "api.latency_ms.p99": "lower",
+    "max_rss_mb": "lower",
+}
+
+# =============================================================================
+# Fake Agents
+# =============================================================================
+
+
+def fleet_addresses(count, base=1):
+    """Return count distinct loopback addresses, starting at 127.<base>.0.1."""
+    addresses = []
+    for i in range(count):
+        high, low = divmod(i, 250)
+        addresses.append(f"127.{base + high // 250}.{high % 250}.{low + 1}")
+    return addresses
+
+
+def fake_metrics(hostname, ip, rng):
+    """Build a metrics document shaped like the real agent's /metrics output."""
+    return {
+        "hostname": hostname,
+        "ip": ip,
+        "model": "Raspberry Pi 4 Model B Rev 1.4",
+        "timestamp": datetime.now().isoformat(),
+        "cpu": {
+            "usage_percent": round(rng.uniform(0, 100), 1),
+            "temperature": round(rng.uniform(38, 75), 1),
+            "load_average": [round(rng.uniform(0, 4), 2) for _ in range(3)],
+        },
+        "memory": {
+            "total_mb": 3884,
+            "used_mb": rng.randint(200, 3800),
+            "available_mb": rng.randint(80, 3600),
+            "percent": round(rng.uniform(5, 98), 1),
+        },
+        "disk": {"total_gb": 29.5, "used_gb": 8.2, "free_gb": 21.3, "percent": 27.8},
+        "uptime": f"{rng.randint(0, 90)}d {rng.randint(0, 23)}h {rng.randint(0, 59)}m",
+    }
+
+
+class FakeAgentHandler(BaseHTTPRequestHandler):
+    """Stand-in for the agent's MetricsHandler with injectable latency and faults."""
+
+    def log_message(self, format, *args):
+        """Suppress default logging."""
+        pass
+
+    def do_GET(self):
+        """Serve /metrics, possibly after a delay, a hang or with an error."""
+        behaviour = self.server.behaviour
+        rng = self.server.rng
+        roll = rng.random()
+
+        if roll < behaviour["timeout_rate"]:
+            time.sleep(behaviour["hang_seconds"])
+        elif roll < behaviour["timeout_rate"] + behaviour["failure_rate"]:
+            self.send_response(500)
+            self.send_header("Content-Type", "text/plain")
+            self.end_headers()
+            self.wfile.write(b"Internal Server Error")
+            return
+
+        latency = behaviour["latency"]
+        if latency > 0:
+            time.sleep(rng.uniform(0.5 * latency, 1.5 * latency))
+
+        response = json.dumps(fake_metrics(self.server.hostname, self.server.ip, rng), indent=2)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(response.encode())
+
+
+class FakeAgentServer(ThreadingHTTPServer):
+    """One fake agent; requests are dispatched by FakeFleet's selector loop."""
+
+    daemon_threads = True
+    timeout = 0
+
+    def server_bind(self):
+        """Bind without HTTPServer's reverse DNS lookup, which is slow for 127.x.y.z."""
+        socketserver.TCPServer.server_bind(self)
+        self.server_name, self.server_port = self.server_address[:2]
+
+    def handle_error(self, request, client_address):
+        """Ignore clients that gave up waiting on a deliberately slow response."""
+        pass
+
+
+class FakeFleet:
+    """A set of fake agents served from a single selector thread."""
+
+    def __init__(self, count, port, behaviour, seed=0):
+        self.port = port
+        self.behaviour = behaviour
+        self.addresses = fleet_addresses(count)
+        self.servers = []
+        self._selector = selectors.DefaultSelector()
+        self._stop = threading.Event()
+        self._thread = None
+
+        for i, ip in enumerate(self.addresses):
+            server = FakeAgentServer((ip, port), FakeAgentHandler)
+            server.behaviour = behaviour
+            server.rng = random.Random(seed + i)  # noqa: S311 - not security relevant
+            server.hostname = f"fake-pi-{i:04d}"
+            server.ip = ip
+            self.servers.append(server)
+            self._selector.register(server.socket, selectors.EVENT_READ, server)
+
+    def _serve(self):
+        while not self._stop.is_set():
+            for key, _ in self._selector.select(timeout=0.1):
+                key.data.handle_request()
+
+    def start(self):
+        """Start accepting connections in a background thread."""
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving and close every listening socket."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._selector.close()
+        for server in self.servers:
+            server.server_close()
+
+
+def raise_fd_limit(needed):
+    """Raise the soft open-file limit so large fleets fit, if the hard limit allows."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+
+# =============================================================================
+# Measurements
+# =============================================================================
+
+
+def measure_poll_cycles(cycles):
+    """Time cycles consecutive poll_once() passes over the fleet."""
+    durations = []
+    for _ in range(cycles):
+        start = time.perf_counter()
+        dashboard.poll_once()
+        durations.append(time.perf_counter() - start)
+    with dashboard.data_lock:
+        online = sum(1 for m in dashboard.pi_data.values() if m.get("status") == "online")
+    return durations, online
+
+
+def staleness(data, now):
+    """Return the age in seconds of the oldest online host in an /api/metrics document."""
+    hosts = data["hosts"] if isinstance(data.get("hosts"), list) else data.values()
+    ages = [
+        now - datetime.fromisoformat(m["last_seen"]).timestamp()
+        for m in hosts
+        if m.get("status") == "online" and "last_seen" in m
+    ]
+    return max(ages) if ages else None
+
+
+def measure_api(url, clients, duration):
+    """Hammer url from clients threads for duration seconds."""
+    latencies = []
+    ages = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        local_latencies, local_ages, local_errors = [], [], 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                with urlopen(url, timeout=10) as response:
+                    body = response.read()
+            except OSError:
+                local_errors += 1
+                continue
+            local_latencies.append(time.perf_counter() - start)
+            age = staleness(json.loads(body), time.time())
+            if age is not None:
+                local_ages.append(age)
+        with lock:
+            latencies.extend(local_latencies)
+            ages.extend(local_ages)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return latencies, ages, errors[0], elapsed
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+
+def run(args):
+    """Run the benchmark described by args and return the report."""
+    raise_fd_limit(args.agents + 256)
+    behaviour = {
+        "latency": args.latency_ms / 1000.0,
+        "failure_rate": args.failure_rate,
+        "timeout_rate": args.timeout_rate,
+        "hang_seconds": args.hang_seconds,
+    }
+    fleet = FakeFleet(args.agents, args.port, behaviour, seed=args.seed)
+    fleet.start()
+
+    saved = (
+        dashboard.MONITORED_HOSTS,
+        dashboard.AGENT_PORT,
+        dashboard.POLL_INTERVAL,
+        dashboard.STATE_FILE,
+    )
+    dashboard.MONITORED_HOSTS = list(fleet.addresses)
+    dashboard.STATE_FILE = ""
+    dashboard.AGENT_PORT = args.port
+    dashboard.POLL_INTERVAL = args.poll_interval
+    dashboard.stop_event.clear()
+    with dashboard.data_lock:
+        dashboard.pi_data.clear()
+
+    server = dashboard.DashboardServer(("127.0.0.1", 0), dashboard.DashboardHandler)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    poller = threading.Thread(target=dashboard.poll_all_hosts, daemon=True)
+
+    try:
+        cycle_times, online = measure_poll_cycles(args.cycles)
+
+        server_thread.start()
+        poller.start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/api/metrics"
+        if args.query:
+            url += "?" + args.query
+        latencies, ages, errors, elapsed = measure_api(url, args.clients, args.duration)
+    finally:
+        dashboard.stop_event.set()
+        server.shutdown()
+        server.server_close()
+        poller.join()
+        fleet.stop()
+        (
+            dashboard.MONITORED_HOSTS,
+            dashboard.AGENT_PORT,
+            dashboard.POLL_INTERVAL,
+            dashboard.STATE_FILE,
+        ) = saved
+
+    return {
+        "config": {
+            "agents": args.agents,
+            "latency_ms": args.latency_ms,
+            "failure_rate": args.failure_rate,
+            "timeout_rate": args.timeout_rate,
+            "poll_interval": args.poll_interval,
+            "clients": args.clients,
+            "duration": args.duration,
+            "query": args.query,
+        },
+        "poll": {"cycle_seconds": summarize(cycle_times), "hosts_online": online},
+        "staleness_seconds": summarize(ages),
+        "api": {
+            "requests": len(latencies),
+            "errors": errors,
+            "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            "latency_ms": summarize(latencies, scale=1000),
+        },
+        "rss_mb": rss_mb(),
+        "max_rss_mb": max_rss_mb(),
+    }
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--agents", type=int, default=100, help="number of fake agents")
+    parser.add_argument("--port", type=int, default=15555, help="port every fake agent uses")
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="mean agent latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of HTTP 500s")
+    parser.add_argument(
+        "--timeout-rate", type=float, default=0.0, help="fraction of requests that hang"
+    )
+    parser.add_argument(
+        "--hang-seconds", type=float, default=5.0, help="how long a hanging request stalls"
+    )
+    parser.add_argument("--cycles", type=int, default=3, help="timed poll_once() passes")
+    parser.add_argument(
+        "--poll-interval", type=float, default=1.0, help="POLL_INTERVAL for the live poller"
+    )
+    parser.add_argument("--clients", type=int, default=4, help="concurrent /api/metrics clients")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of API load")
+    parser.add_argument(
+        "--query", default="", help="/api/metrics query string, e.g. 'sort=-temperature&limit=50'"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed for fault injection")
+    parser.add_argument("--baseline", help="compare against this baseline report")
+    parser.add_argument("--save-baseline", help="write the report to this path")
+    parser.add_argument(
+        "--threshold", type=float, default=0.25, help="allowed regression (fraction)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the fleet benchmark from the command line."""
+    args = parse_args(argv)
+    report = run(args)
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        save_json(args.save_baseline, report)
+
+    if args.baseline:
+        regressions = compare_to_baseline(
+            report, load_json(args.baseline), BASELINE_CHECKS, args.threshold
+        )
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Pi Monitor History Compression Benchmark
+========================================
+Measures how well the dashboard's sealed history blocks compress and how
+fast they encode and decode, on realistic Pi metric series:
+
+    synthetic      --hours of 5 second polls of an idle-to-busy Pi: bursty
+                   CPU, temperature in thermal-sensor steps, the kernel's 1
+                   minute load average and slowly drifting memory and disk,
+                   rounded as the agent rounds them
+    trace:<name>   every frame of a proctrace recording replayed through the
+                   agent's collectors (see benchmarks/proctrace.py)
+
+Usage:
+    python3 -m benchmarks.history
+    python3 -m benchmarks.history --hours 24 --repeat 5
+    python3 -m benchmarks.history --trace pi4.trace.gz
+    python3 -m benchmarks.history --save-baseline history-baseline.json
+    python3 -m benchmarks.history --baseline history-baseline.json
+
+Samples are cut into HISTORY_BLOCK_SIZE blocks and every block is sealed
+(SealedBlock) and read back in full. The compression ratio compares the
+encoded streams with the 8 bytes per timestamp and value of an uncompressed
+block. Encode and decode throughput are samples per second (best of
+--repeat). Exits with status 1 if --baseline is given and a metric
+regressed by more than --threshold.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+from agent import pi_monitor_agent as agent
+from benchmarks import proctrace
+from benchmarks.common import compare_to_baseline, load_json, save_json
+from dashboard import pi_monitor_dashboard as dashboard
+
+# Start of the synthetic series (epoch seconds)
+SYNTHETIC_START = 1760000000.0
+
+# =============================================================================
+# Metric Series
+# =============================================================================
+
+
+def synthetic_samples(hours, seed=0):
+    """Return [(timestamp, values)] of a simulated Pi polled every POLL_INTERVAL seconds."""
+    rng = random.Random(seed)  # noqa: S311 - not security relevant
+    decay = math.exp(-dashboard.POLL_INTERVAL / 60)
+    timestamp = SYNTHETIC_START
+    busy = 0.0
+    millidegrees = 45000
+    load = 0.3
+    memory = 32.0
+    disk = 41.3
+    samples = []
+    for _ in range(int(hours * 3600 / dashboard.POLL_INTERVAL)):
+        # The poller sleeps POLL_INTERVAL after a cycle of a few milliseconds
+        timestamp += dashboard.POLL_INTERVAL + rng.uniform(0.004, 0.02)
+        if rng.random() < 0.01:
+            busy = rng.uniform(40, 100) if busy < 20 else 0.0  # A job starts or ends
+        cpu = min(100.0, max(0.0, busy + rng.gauss(4, 2)))
+        # The SoC sensor moves in steps of about half a degree towards its load point
+        target = 40000 + cpu * 250
+        step = 538 * max(-2, min(2, round((target - millidegrees) / 2000)))
+        millidegrees += step if rng.random() < 0.5 else 0
+        load = load * decay + (cpu / 25) * (1 - decay)
+        memory = min(95.0, max(10.0, memory + rng.gauss(0, 0.03)))
+        disk += 0.1 if rng.random() < 0.001 else 0.0
+        values = [
+            round(cpu, 1),
+            round(millidegrees / 1000, 1),
+            round(load, 2),
+            round(memory, 1),
+            round(disk, 1),
+        ]
+        samples.append((timestamp, values))
+    return samples
+
+
+def trace_samples(path):
+    """Return [(timestamp, values)] collected by replaying a proctrace recording."""
+    frames = proctrace.load_trace(path)["frames"]
+    samples = []
+    with proctrace.replay_root(frames[0]) as root:
+        for offset, changed in frames[1:]:
+            proctrace.apply_frame(root, [offset, changed])
+            agent.invalidate_collectors()
+            metrics = agent.collect_metrics()
+            samples.append((SYNTHETIC_START + offset, dashboard.sample_values(metrics)))
+    return samples
+
+
+# =============================================================================
+# Benchmark
+# =============================================================================
+
+
+def build_blocks(samples, size):
+    """Cut samples into uncompressed HistoryBlocks of at most size samples."""
+    blocks = []
+    for start in range(0, len(samples), size):
+        block = dashboard.HistoryBlock()
+        for timestamp, values in samples[start : start + size]:
+            block.append(timestamp, values)
+        blocks.append(block)
+    return blocks
+
+
+def best_time(func, repeat):
+    """Return the fastest of repeat calls of func, in seconds."""
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        rounds.append(time.perf_counter() - start)
+    return min(rounds)
+
+
+def decode_all(sealed):
+    """Read back every row of every sealed block."""
+    return [row for block in sealed for row in block.rows(len(block), -math.inf, math.inf)]
+
+
+def lossless(blocks, rows):
+    """Return whether rows match blocks, with timestamps to the millisecond."""
+    expected = [
+        (round(timestamp * dashboard.HISTORY_TIME_SCALE), values)
+        for block in blocks
+        for timestamp, values in block.rows(len(block), -math.inf, math.inf)
+    ]
+    actual = [
+        (round(timestamp * dashboard.HISTORY_TIME_SCALE), values) for timestamp, values in rows
+    ]
+    # Compare values as text so that NaN (a missing metric) equals NaN
+    return repr(expected) == repr(actual)
+
+
+def measure(samples, repeat):
+    """Seal and decode samples block by block and return the results."""
+    blocks = build_blocks(samples, dashboard.HISTORY_BLOCK_SIZE)
+    sealed = [dashboard.SealedBlock(block) for block in blocks]
+    count = len(samples)
+    streams = 1 + len(dashboard.HISTORY_COLUMNS)
+    raw_bytes = count * streams * 8
+    encoded_bytes = sum(block.nbytes() for block in sealed)
+    encode_seconds = best_time(lambda: [dashboard.SealedBlock(block) for block in blocks], repeat)
+    decode_seconds = best_time(lambda: decode_all(sealed), repeat)
+    bits = {"timestamp": sum(len(block.timestamps) for block in sealed) * 8 / count}
+    for index, name in enumerate(dashboard.HISTORY_COLUMNS):
+        bits[name] = sum(len(block.columns[index][1]) for block in sealed) * 8 / count
+    return {
+        "samples": count,
+        "blocks": len(blocks),
+        "raw_bytes": raw_bytes,
+        "encoded_bytes": encoded_bytes,
+        "compression_ratio": round(raw_bytes / encoded_bytes, 2),
+        "bits_per_value": {name: round(value, 2) for name, value in bits.items()},
+        "encode_samples_per_second": round(count / encode_seconds),
+        "decode_samples_per_second": round(count / decode_seconds),
+        "lossless": lossless(blocks, decode_all(sealed)),
+    }
+
+
+def baseline_checks(report):
+    """Return higher-is-better ratio and throughput checks per source."""
+    checks = {}
+    for source in report["results"]:
+        checks[f"results.{source}.compression_ratio"] = "higher"
+        checks[f"results.{source}.encode_samples_per_second"] = "higher"
+        checks[f"results.{source}.decode_samples_per_second"] = "higher"
+    return checks
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--hours", type=float, default=24.0, help="hours of synthetic polls")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the synthetic series")
+    parser.add_argument(
+        "--trace", action="append", default=[], help="proctrace recording (repeatable)"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="timed rounds per source")
+    parser.add_argument("--baseline", help="compare against this baseline report")
+    parser.add_argument("--save-baseline", help="write the report to this path")
+    parser.add_argument(
+        "--threshold", type=float, default=0.25, help="allowed regression (fraction)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the history compression benchmark from the command line."""
+    args = parse_args(argv)
+    sources = {"synthetic": synthetic_samples(args.hours, args.seed)}
+    for path in args.trace:
+        # Baseline checks are dotted paths, so the name stops at the first dot
+        sources["trace:" + os.path.basename(path).split(".")[0]] = trace_samples(path)
+    report = {
+        "config": {
+            "hours": args.hours,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "block_size": dashboard.HISTORY_BLOCK_SIZE,
+        },
+        "results": {name: measure(samples, args.repeat) for name, samples in sources.items()},
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        save_json(args.save_baseline, report)
+
+    if args.baseline:
+        regressions = compare_to_baseline(
+            report, load_json(args.baseline), baseline_checks(report), args.threshold
+        )
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Pi Monitor /proc and /sys Trace Recorder and Replayer
+=====================================================
+Records timed snapshots of the kernel files the agent reads (KERNEL_PATHS)
+into a compact trace, and replays a trace into a directory tree that the
+agent reads through FS_ROOT. Collector throughput and rate calculations can
+then be measured on any Linux machine, not only on the Pi that was recorded.
+
+Usage:
+    python3 -m benchmarks.proctrace record pi4.trace.gz --samples 120 --interval 1
+    python3 -m benchmarks.proctrace replay pi4.trace.gz
+    python3 -m benchmarks.proctrace replay pi4.trace.gz --speed 10
+    python3 -m benchmarks.proctrace replay pi4.trace.gz --save-baseline replay-baseline.json
+    python3 -m benchmarks.proctrace replay pi4.trace.gz --baseline replay-baseline.json
+
+A trace is gzipped JSON. The first frame holds every recorded file and each
+later frame only the files that changed, together with its offset in
+seconds from the start of the recording. Replay writes the frames into a
+temporary tree (replacing each file atomically) and runs a cold
+collect_metrics() after every frame, --speed times faster than recorded
+(0, the default, replays as fast as possible). The report gives collection
+latency, frames per second and the largest difference between the agent's
+CPU usage and the usage computed directly from the trace's /proc/stat.
+Exits with status 1 if --baseline is given and a metric regressed by more
+than --threshold.
+"""
+
+import argparse
+import contextlib
+import glob
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+from agent import pi_monitor_agent as agent
+from benchmarks.common import compare_to_baseline, load_json, save_json, summarize
+
+TRACE_FORMAT = 1
+
+# =============================================================================
+# Recording
+# =============================================================================
+
+
+def trace_files(root):
+    """Return the paths (relative to root) of every kernel file the agent reads."""
+    paths = set()
+    for relative in agent.KERNEL_PATHS.values():
+        if not relative:
+            continue  # DISK_PATH is a mount point, not a file
+        for path in glob.glob(os.path.join(root, relative)):
+            if os.path.isfile(path):
+                paths.add(os.path.relpath(path, root))
+    return sorted(paths)
+
+
+def read_files(root, paths):
+    """Return {relative path: contents} for every readable path under root."""
+    contents = {}
+    for relative in paths:
+        try:
+            with open(os.path.join(root, relative), "rb") as f:
+                contents[relative] = f.read().decode("latin-1")
+        except OSError:
+            pass
+    return contents
+
+
+def record(root="/", samples=60, interval=1.0):
+    """Snapshot the kernel files under root samples times, interval seconds apart."""
+    paths = trace_files(root)
+    frames = []
+    previous = {}
+    start = time.monotonic()
+    for index in range(samples):
+        delay = start + index * interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        offset = time.monotonic() - start
+        contents = read_files(root, paths)
+        changed = {path: text for path, text in contents.items() if previous.get(path) != text}
+        frames.append([round(offset, 3), changed])
+        previous = contents
+    return {"format": TRACE_FORMAT, "interval": interval, "frames": frames}
+
+
+def save_trace(path, trace):
+    """Write a trace as gzipped JSON."""
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(trace, f, separators=(",", ":"))
+
+
+def load_trace(path):
+    """Read a trace written by save_trace()."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        trace = json.load(f)
+    if trace.get("format") != TRACE_FORMAT:
+        raise SystemExit(f"Unsupported trace format in {path}: {trace.get('format')}")
+    return trace
+
+
+# =============================================================================
+# Replay
+# =============================================================================
+
+
+def write_file(root, relative, text):
+    """Atomically replace root/relative with text, creating directories as needed."""
+    path = os.path.join(root, relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(text.encode("latin-1"))
+    os.replace(temporary, path)
+
+
+def apply_frame(root, frame):
+    """Write one frame's changed files into the replay tree."""
+    for relative, text in frame[1].items():
+        write_file(root, relative, text)
+
+
+def stat_cpu_percent(previous, current):
+    """Return CPU usage between two /proc/stat texts, as get_cpu_usage() computes it."""
+    before = list(map(int, previous.split("\n", 1)[0].split()[1:]))
+    after = list(map(int, current.split("\n", 1)[0].split()[1:]))
+    total = sum(after) - sum(before)
+    if total == 0:
+        return 0.0
+    return round((1 - (after[3] - before[3]) / total) * 100, 1)
+
+
+@contextlib.contextmanager
+def replay_root(frame):
+    """
+    Write frame into a temporary tree and point the agent at it.
+
+    Yields the tree's root and seeds the CPU usage baseline; the agent's
+    paths and collector state are restored on exit.
+    """
+    settings = ("FS_ROOT", *agent.KERNEL_PATHS)
+    defaults = {setting: getattr(agent, setting) for setting in settings}
+    with tempfile.TemporaryDirectory(prefix="pi-monitor-replay-") as root:
+        try:
+            apply_frame(root, frame)
+            agent.use_fs_root(root)
+            agent.get_cpu_usage()
+            yield root
+        finally:
+            for setting, value in defaults.items():
+                setattr(agent, setting, value)
+            if hasattr(agent.get_cpu_usage, "prev"):
+                del agent.get_cpu_usage.prev
+            agent.SAMPLER.reset()
+            agent.invalidate_collectors()
+
+
+def replay(trace, speed=0.0):
+    """
+    Replay trace through the agent's collectors and return the results.
+
+    The first frame only seeds the tree and the CPU usage baseline; every
+    later frame is followed by one timed cold collection.
+    """
+    frames = trace["frames"]
+    durations = []
+    max_error = 0.0
+    with replay_root(frames[0]) as root:
+        stat = frames[0][1].get("proc/stat")
+        start = time.perf_counter()
+        for offset, changed in frames[1:]:
+            if speed > 0:
+                delay = start + offset / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            apply_frame(root, [offset, changed])
+            agent.invalidate_collectors()
+            began = time.perf_counter()
+            metrics = agent.collect_metrics()
+            durations.append(time.perf_counter() - began)
+            if "proc/stat" in changed and stat is not None:
+                expected = stat_cpu_percent(stat, changed["proc/stat"])
+                actual = metrics["cpu"]["usage_percent"]
+                max_error = max(max_error, abs(actual - expected))
+                stat = changed["proc/stat"]
+        elapsed = time.perf_counter() - start
+    return {
+        "frames": len(frames) - 1,
+        "replay_seconds": round(elapsed, 4),
+        "frames_per_second": round(len(durations) / elapsed, 1) if elapsed else 0.0,
+        "collect_us": summarize(durations, scale=1e6),
+        "cpu_percent_max_error": round(max_error, 1),
+    }
+
+
+# Report metrics compared against a baseline, and which direction is better
+BASELINE_CHECKS = {
+    "results.collect_us.p50": "lower",
+    "results.collect_us.p99": "lower",
+    "results.frames_per_second": "higher",
+}
+
+# =============================================================================
+# Main
+# =============================================================================
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    recorder = commands.add_parser("record", help="record a trace from a live system")
+    recorder.add_argument("trace", help="output file (gzipped JSON)")
+    recorder.add_argument("--root", default="/", help="filesystem root to record from")
+    recorder.add_argument("--samples", type=int, default=60, help="number of snapshots")
+    recorder.add_argument("--interval", type=float, default=1.0, help="seconds between snapshots")
+
+    replayer = commands.add_parser("replay", help="replay a trace through the collectors")
+    replayer.add_argument("trace", help="trace file written by 'record'")
+    replayer.add_argument(
+        "--speed", type=float, default=0.0, help="times faster than recorded (0 = no pacing)"
+    )
+    replayer.add_argument("--baseline", help="compare against this baseline report")
+    replayer.add_argument("--save-baseline", help="write the report to this path")
+    replayer.add_argument(
+        "--threshold", type=float, default=0.25, help="allowed regression (fraction)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Record or replay a trace from the command line."""
+    args = parse_args(argv)
+    if args.command == "record":
+        trace = record(args.root, args.samples, args.interval)
+        save_trace(args.trace, trace)
+        changes = sum(len(frame[1]) for frame in trace["frames"])
+        print(f"Recorded {len(trace['frames'])} frames ({changes} file snapshots) to {args.trace}")
+        return 0
+
+    report = {
+        "config": {"trace": args.trace, "speed": args.speed},
+        "results": replay(load_trace(args.trace), args.speed),
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        save_json(args.save_baseline, report)
+
+    if args.baseline:
+        regressions = compare_to_baseline(
+            report, load_json(args.baseline), BASELINE_CHECKS, args.threshold
+        )
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
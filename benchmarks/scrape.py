@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Pi Monitor Agent Concurrent Scrape Benchmark
+============================================
+Serves the real agent handler on loopback and measures /metrics latency and
+throughput while several scrapers hit it at once, for each serving mode:
+
+    single     one-thread HTTPServer speaking HTTP/1.0 (the original agent)
+    threading  a thread per connection, HTTP/1.0
+    pool       AgentServer: SERVER_WORKERS workers and HTTP/1.1 keep-alive
+
+The server runs in a separate process. Every scraper reuses one
+http.client connection, which reconnects for each request when the server
+closes it (HTTP/1.0). --stalled adds clients that connect and never send a
+request; they hold the single-threaded server for REQUEST_TIMEOUT seconds
+each.
+
+Usage:
+    python3 -m benchmarks.scrape
+    python3 -m benchmarks.scrape --scrapers 10 --duration 5 --mode single --mode pool
+    python3 -m benchmarks.scrape --stalled 2 --mode threading --mode pool
+    python3 -m benchmarks.scrape --save-baseline scrape-baseline.json
+    python3 -m benchmarks.scrape --baseline scrape-baseline.json
+
+Exits with status 1 if --baseline is given and a metric regressed by more
+than --threshold.
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import socket
+import sys
+import threading
+import time
+from http.server import HTTPServer, ThreadingHTTPServer
+
+from agent import pi_monitor_agent as agent
+from benchmarks.common import compare_to_baseline, load_json, save_json, summarize
+
+MODES = ("single", "threading", "pool")
+
+# =============================================================================
+# Servers
+# =============================================================================
+
+
+class Http10Handler(agent.MetricsHandler):
+    """The agent handler answering with HTTP/1.0, closing after every response."""
+
+    protocol_version = "HTTP/1.0"
+
+
+def serve(mode, workers, ports):
+    """Serve the agent handler on an ephemeral loopback port, reporting it on ports."""
+    if mode == "single":
+        server = HTTPServer(("127.0.0.1", 0), Http10Handler)
+    elif mode == "threading":
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Http10Handler)
+    else:
+        server = agent.AgentServer(("127.0.0.1", 0), agent.MetricsHandler, workers=workers)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_server(mode, workers):
+    """
+    Start a server process for mode and return (process, port).
+
+    The server runs in its own process so the scraper threads do not compete
+    with it for the interpreter lock.
+    """
+    context = multiprocessing.get_context("spawn")
+    ports = context.Queue()
+    process = context.Process(target=serve, args=(mode, workers, ports), daemon=True)
+    process.start()
+    return process, ports.get(timeout=10)
+
+
+# =============================================================================
+# Benchmark
+# =============================================================================
+
+
+def scrape_load(port, path, scrapers, duration):
+    """Scrape path from scrapers threads for duration seconds; return (latencies, errors)."""
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + duration
+
+    def scraper():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        own = []
+        failed = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                continue
+            own.append(time.perf_counter() - start)
+        connection.close()
+        latencies.extend(own)
+        errors.append(failed)
+
+    threads = [threading.Thread(target=scraper) for _ in range(scrapers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, sum(errors)
+
+
+def run_mode(mode, args):
+    """Benchmark one serving mode and return its results."""
+    process, port = start_server(mode, args.workers)
+    stalled = [socket.create_connection(("127.0.0.1", port)) for _ in range(args.stalled)]
+    try:
+        scrape_load(port, args.path, 1, 0.2)  # Warm up collectors and the CPU baseline
+        latencies, errors = scrape_load(port, args.path, args.scrapers, args.duration)
+    finally:
+        for sock in stalled:
+            sock.close()
+        process.terminate()
+        process.join()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / args.duration, 1),
+        "latency_ms": summarize(latencies, scale=1000),
+    }
+
+
+def baseline_checks(report):
+    """Return lower-is-better latency and higher-is-better throughput checks per mode."""
+    checks = {}
+    for mode in report["results"]:
+        checks[f"results.{mode}.latency_ms.p50"] = "lower"
+        checks[f"results.{mode}.latency_ms.p99"] = "lower"
+        checks[f"results.{mode}.throughput_rps"] = "higher"
+    return checks
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--mode", action="append", choices=MODES, help="serving mode (repeatable, default: all)"
+    )
+    parser.add_argument("--scrapers", type=int, default=10, help="concurrent scrapers")
+    parser.add_argument("--stalled", type=int, default=0, help="clients that never send")
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds of load per mode")
+    parser.add_argument("--path", default="/metrics", help="path every scraper requests")
+    parser.add_argument(
+        "--workers", type=int, default=agent.SERVER_WORKERS, help="AgentServer worker threads"
+    )
+    parser.add_argument("--baseline", help="compare against this baseline report")
+    parser.add_argument("--save-baseline", help="write the report to this path")
+    parser.add_argument(
+        "--threshold", type=float, default=0.25, help="allowed regression (fraction)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the scrape benchmark from the command line."""
+    args = parse_args(argv)
+    modes = args.mode or list(MODES)
+    report = {
+        "config": {
+            "scrapers": args.scrapers,
+            "stalled": args.stalled,
+            "duration": args.duration,
+            "path": args.path,
+            "workers": args.workers,
+        },
+        "results": {mode: run_mode(mode, args) for mode in modes},
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        save_json(args.save_baseline, report)
+
+    if args.baseline:
+        regressions = compare_to_baseline(
+            report, load_json(args.baseline), baseline_checks(report), args.threshold
+        )
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Pi Monitor Agent Startup Time and Memory Budget Check
+=====================================================
+Starts an agent in a fresh interpreter on a free loopback port, scrapes
+/metrics as soon as it answers and reports:
+
+    import_ms       loading the agent module (what running the script does
+                    before main())
+    main_ms         from main() to the first served /metrics response
+    startup_ms      import_ms + main_ms
+    rss_mb          resident memory after the first response
+    rss_after_mb    resident memory after --scrapes more scrapes
+
+for the lean agent (agent/pi_monitor_agent_py2.py) and the full agent
+(agent/pi_monitor_agent.py). Times are wall-clock and include the
+interpreter's own work, such as compiling a changed source file.
+
+Usage:
+    python3 -m benchmarks.startup
+    python3 -m benchmarks.startup --agent lean --python python2
+    python3 -m benchmarks.startup --max-startup-ms 200 --max-rss-mb 11
+
+Each measurement is the median of --runs launches. Exits with status 1 if
+the lean agent exceeds the startup or RSS budget.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+AGENT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "agent")
+
+# Module name of each agent in AGENT_DIR
+AGENTS = {"lean": "pi_monitor_agent_py2", "full": "pi_monitor_agent"}
+
+# Budgets for the lean agent. The time budget has headroom for a Pi Zero;
+# tighten it with --max-startup-ms on faster hardware.
+STARTUP_BUDGET_MS = 1000
+RSS_BUDGET_MB = 12
+
+# Run in the agent's interpreter (Python 2 or 3): record the time, import
+# the agent, report when main() starts, then run it on the given port
+LAUNCHER = """
+import sys, time
+started = time.time()
+sys.path.insert(0, {directory!r})
+import {module} as agent
+agent.PORT = {port}
+sys.stdout.write("%r %r\\n" % (started, time.time()))
+sys.stdout.flush()
+agent.main()
+"""
+
+# =============================================================================
+# Measurement
+# =============================================================================
+
+
+def free_port():
+    """Return a loopback port that is free right now."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_of(pid):
+    """Return the resident set size of process pid in MB."""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def scrape(connection):
+    """GET /metrics on connection and return the parsed body; raises on failure."""
+    connection.request("GET", "/metrics")
+    response = connection.getresponse()
+    body = response.read()
+    if response.status != 200:
+        raise http.client.HTTPException(f"status {response.status}")
+    return json.loads(body)
+
+
+def launch(name, python, scrapes, timeout=30.0):
+    """Start an agent, wait for its first /metrics response and return one run's results."""
+    port = free_port()
+    source = LAUNCHER.format(directory=AGENT_DIR, module=AGENTS[name], port=port)
+    process = subprocess.Popen(  # noqa: S603 - runs our own launcher
+        [python, "-c", source], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+            try:
+                scrape(connection)
+                break
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"{name} agent did not serve /metrics") from None
+                time.sleep(0.001)
+        served = time.time()
+        started, main_started = map(float, process.stdout.readline().split())
+        rss = rss_of(process.pid)
+        for _ in range(scrapes):
+            scrape(connection)
+        connection.close()
+        return {
+            "import_ms": (main_started - started) * 1000,
+            "main_ms": (served - main_started) * 1000,
+            "startup_ms": (served - started) * 1000,
+            "rss_mb": rss,
+            "rss_after_mb": rss_of(process.pid),
+        }
+    finally:
+        process.terminate()
+        process.wait()
+        process.stdout.close()
+
+
+def measure(name, python=sys.executable, runs=5, scrapes=100):
+    """Return the median of each result over runs launches of an agent."""
+    results = [launch(name, python, scrapes) for _ in range(runs)]
+    return {key: round(statistics.median(r[key] for r in results), 1) for key in results[0]}
+
+
+def over_budget(results, max_startup_ms, max_rss_mb):
+    """Return a message for every budget the results exceed."""
+    messages = []
+    if results["startup_ms"] > max_startup_ms:
+        messages.append(f"startup_ms: {results['startup_ms']} > {max_startup_ms}")
+    for key in ("rss_mb", "rss_after_mb"):
+        if results[key] > max_rss_mb:
+            messages.append(f"{key}: {results[key]} > {max_rss_mb}")
+    return messages
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--agent", action="append", choices=sorted(AGENTS), help="agent (repeatable, default: all)"
+    )
+    parser.add_argument(
+        "--python", default=sys.executable, help="interpreter for the lean agent (e.g. python2)"
+    )
+    parser.add_argument("--runs", type=int, default=5, help="launches per agent")
+    parser.add_argument("--scrapes", type=int, default=100, help="scrapes before rss_after_mb")
+    parser.add_argument(
+        "--max-startup-ms", type=float, default=STARTUP_BUDGET_MS, help="lean startup budget"
+    )
+    parser.add_argument("--max-rss-mb", type=float, default=RSS_BUDGET_MB, help="lean RSS budget")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the startup check from the command line."""
+    args = parse_args(argv)
+    agents = args.agent or ["lean", "full"]
+    report = {
+        "config": {
+            "python": args.python,
+            "runs": args.runs,
+            "scrapes": args.scrapes,
+            "max_startup_ms": args.max_startup_ms,
+            "max_rss_mb": args.max_rss_mb,
+        },
+        "results": {
+            name: measure(
+                name, args.python if name == "lean" else sys.executable, args.runs, args.scrapes
+            )
+            for name in agents
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+    if "lean" in report["results"]:
+        messages = over_budget(report["results"]["lean"], args.max_startup_ms, args.max_rss_mb)
+        for message in messages:
+            print(f"OVER BUDGET lean {message}", file=sys.stderr)
+        return 1 if messages else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,15 +11,32 @@ Usage:
     3. Open: http://<this-pi-ip>:8080
 """
 
+import csv
+import gzip
+import hashlib
+import hmac
+import io
+import ipaddress
 import json
+import multiprocessing
+import os
+import selectors
+import signal
 import socket
+import struct
+import sys
 import threading
 import time
+from array import array
+from bisect import bisect_left, bisect_right
 from datetime import datetime
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from typing import List
-from urllib.error import URLError
-from urllib.request import urlopen
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+from math import nan as NAN
+from time import perf_counter
+from typing import Dict, List
+from urllib.parse import parse_qs
 
 # =============================================================================
 # Configuration - EDIT THIS LIST
@@ -33,16 +50,465 @@ MONITORED_HOSTS: List[str] = [
     # "octopi.local",
 ]
 
+# Optional tags per host for /api/metrics?tag= filtering, as "key:value"
+# strings. Every host is also tagged "model:<model>" from its agent.
+HOST_TAGS: Dict[str, List[str]] = {
+    # "192.168.1.100": ["site:garage", "role:pihole"],
+}
+
 AGENT_PORT = 5555  # Port where agents are running
 DASHBOARD_PORT = 8080  # Port for this web dashboard
 POLL_INTERVAL = 5  # Seconds between metric polls
 
+# Hostname resolution cache for the poller (IP addresses bypass it)
+DNS_CACHE_TTL = 300  # Seconds a resolved address is used before it is refreshed
+DNS_NEGATIVE_TTL = 30  # Seconds a failed lookup is remembered
+
+# Circuit breaker: after this many consecutive failed polls a host is only
+# probed with a non-blocking TCP connect until its agent port answers again
+BREAKER_FAILURES = 3  # Failed polls before the breaker opens (0 disables)
+PROBE_TIMEOUT = 0.2  # Seconds a connect probe may take before it counts as failed
+
+# Paging of /api/metrics?sort=&limit=&offset= queries
+API_PAGE_LIMIT = 100  # Hosts per page when no limit is given
+API_MAX_PAGE_LIMIT = 1000  # Largest limit a request may ask for
+
+# In-memory metrics history served by /api/export
+HISTORY_RETENTION = 24 * 3600  # Seconds of history kept per host (0 disables)
+HISTORY_BLOCK_SIZE = 720  # Samples per history block (1 hour at a 5s poll interval)
+EXPORT_CHUNK_SIZE = 16384  # Bytes buffered before each chunk of an export is sent
+
+# Streaming anomaly detection on the history fields
+ANOMALY_ALPHA = 0.05  # EWMA weight of each new sample (about the last 20 polls)
+ANOMALY_WARMUP = 20  # Samples per host before scores are reported
+ANOMALY_THRESHOLD = 3.0  # Absolute z-score at which a metric is flagged
+
+# Long-poll /api/watch requests
+WATCH_DEFAULT_TIMEOUT = 30  # Seconds a watch waits when no timeout is given
+WATCH_MAX_TIMEOUT = 60  # Longest timeout a watch may ask for
+MAX_WATCHERS = 200  # Concurrent waiting watches (more get 503)
+THREAD_STACK_SIZE = 256 * 1024  # Bytes of stack per request thread (0 = platform default)
+
+# Multi-process mode: the poller publishes fleet state to shared memory and
+# this many separate processes serve HTTP from it (0 = one threaded process)
+SERVER_PROCESSES = 0
+SHARED_STATE_SIZE = 1 << 20  # Bytes reserved for the published /api/metrics body
+
+# Fleet state is checkpointed here and reloaded at startup ("" disables)
+STATE_FILE = "/var/lib/pi-monitor/dashboard-state.json"
+SNAPSHOT_INTERVAL = 30  # Seconds between checkpoints
+
+# Shared secret for /debug/profile (pass ?token= or an X-Debug-Token header).
+# Profiling is disabled while this is empty.
+DEBUG_TOKEN = ""
+PROFILE_MAX_SECONDS = 60  # Upper bound for /debug/profile?seconds=N
+PROFILE_INTERVAL = 0.005  # Seconds between stack samples
+
+# =============================================================================
+# Self-Instrumentation
+# =============================================================================
+
+# Upper bounds (seconds) of the latency histogram buckets; one overflow bucket follows
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)  # fmt: skip
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram.
+
+    observe() is a bisect plus a few additions and takes no lock, so counts
+    may be off by one under heavy thread contention.
+    """
+
+    __slots__ = ("counts", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        """Record one duration in seconds."""
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Estimate the q-quantile (0-1) as the upper bound of its bucket."""
+        count = sum(self.counts)
+        if count == 0:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for bound, bucket in zip(LATENCY_BUCKETS, self.counts):
+            seen += bucket
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        """Return the histogram as a JSON-serializable dictionary (milliseconds)."""
+        count = sum(self.counts)
+        return {
+            "count": count,
+            "mean_ms": round(self.total / count * 1000, 3) if count else 0.0,
+            "p50_ms": round(self.quantile(0.5) * 1000, 3),
+            "p90_ms": round(self.quantile(0.9) * 1000, 3),
+            "p99_ms": round(self.quantile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "buckets": {
+                **{str(bound): n for bound, n in zip(LATENCY_BUCKETS, self.counts)},
+                "+Inf": self.counts[-1],
+            },
+        }
+
+
+class Stats:
+    """Registry of named histograms and counters exposed at /debug/stats."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.histograms = {}
+        self.counters = {}
+
+    def histogram(self, name):
+        """Return the histogram called name, creating it on first use."""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def incr(self, name, amount=1):
+        """Add amount to the counter called name."""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        """Return all histograms and counters as a JSON-serializable dictionary."""
+        return {
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "counters": dict(self.counters),
+            "histograms": {
+                name: histogram.snapshot() for name, histogram in list(self.histograms.items())
+            },
+        }
+
+
+STATS = Stats()
+
+
+def sample_stacks(seconds, interval=PROFILE_INTERVAL):
+    """
+    Sample the stack of every other thread for the given number of seconds.
+
+    Returns a dict mapping collapsed stacks ("thread;outer;...;inner") to the
+    number of samples in which they were seen.
+    """
+    own = threading.get_ident()
+    counts = {}
+    deadline = perf_counter() + seconds
+    while perf_counter() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                filename = os.path.basename(code.co_filename)
+                stack.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            key = ";".join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+        time.sleep(interval)
+    return counts
+
+
+def format_collapsed(counts):
+    """Format sample counts as collapsed stacks, one "stack count" per line."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
+
+class TimedLock:
+    """A threading.Lock that records how long callers waited to acquire it."""
+
+    def __init__(self, name):
+        self._lock = threading.Lock()
+        self._wait = STATS.histogram(name)
+
+    def __enter__(self):
+        start = perf_counter()
+        self._lock.acquire()
+        self._wait.observe(perf_counter() - start)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
+
+    def condition(self):
+        """Return a threading.Condition sharing this lock."""
+        return threading.Condition(self._lock)
+
+
 # =============================================================================
 # Shared State
 # =============================================================================
 
 pi_data = {}
-data_lock = threading.Lock()
+data_lock = TimedLock("lock.data_lock.wait")
+stop_event = threading.Event()
+
+# Incremented on every host update; host_versions[host] is the fleet version
+# at which that host last changed. Both are guarded by data_lock.
+fleet_version = 0
+host_versions = {}
+
+# Long-poll watchers: a condition per watched host, notified on that host's
+# update, and one for "any host", notified once per poll cycle. All share
+# data_lock. watchers counts requests currently waiting.
+host_changed = {}
+fleet_changed = data_lock.condition()
+watchers = 0
+
+# Per-host polling state: last poll time and consecutive failed polls
+schedule = {}
+
+# Per-host metrics history (HostHistory), guarded by history_lock
+history = {}
+history_lock = threading.Lock()
+
+# SharedState in multi-process mode (written by the poller, read by servers)
+shared_state = None
+
+# Held by every thread start. threading.stack_size() is process-wide, so
+# DashboardServer holds it while request threads start with a smaller stack.
+thread_start_lock = threading.Lock()
+
+
+def start_thread(thread):
+    """Start a background thread with the platform default stack size."""
+    with thread_start_lock:
+        thread.start()
+
+
+# =============================================================================
+# Name Resolution
+# =============================================================================
+
+
+def is_ip_address(name):
+    """Return True if name is an IPv4 or IPv6 address literal."""
+    try:
+        ipaddress.ip_address(name)
+    except ValueError:
+        return False
+    return True
+
+
+class ResolverCache:
+    """
+    TTL cache of hostname lookups for the poller.
+
+    Only the first lookup of a name blocks. Once an entry expires it keeps
+    being returned while a background thread resolves the name again, so a
+    slow or unreachable mDNS responder never stalls a poll cycle. Every
+    address of a name is kept, in getaddrinfo() order, so connections can
+    fall back from one the agent does not listen on. Failed lookups are
+    cached as None for negative_ttl seconds.
+    """
+
+    def __init__(self, ttl=DNS_CACHE_TTL, negative_ttl=DNS_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = {}  # name -> (tuple of addresses or None, monotonic expiry)
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    def lookup(self, name):
+        """Resolve name now, cache the result and return its addresses (None on failure)."""
+        start = perf_counter()
+        try:
+            infos = socket.getaddrinfo(name, AGENT_PORT, type=socket.SOCK_STREAM)
+            addresses = tuple(dict.fromkeys(info[4][0] for info in infos)) or None
+        except OSError:
+            addresses = None
+        STATS.histogram("resolve." + name).observe(perf_counter() - start)
+        STATS.incr("resolve.ok" if addresses else "resolve.failed")
+        ttl = self.ttl if addresses else self.negative_ttl
+        with self.lock:
+            self.entries[name] = (addresses, time.monotonic() + ttl)
+            self.refreshing.discard(name)
+        return addresses
+
+    def resolve(self, name):
+        """Return the addresses to connect to for name, or None if it does not resolve."""
+        if is_ip_address(name):
+            return (name,)
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and entry[1] <= time.monotonic() and name not in self.refreshing:
+                self.refreshing.add(name)
+                start_thread(
+                    threading.Thread(
+                        target=self.lookup, args=(name,), name=f"resolve-{name}", daemon=True
+                    )
+                )
+        if entry is None:
+            return self.lookup(name)
+        return entry[0]
+
+
+RESOLVER = ResolverCache()
+
+
+def agent_socket(address):
+    """Return an unconnected TCP socket of the right family for address."""
+    return socket.socket(socket.AF_INET6 if ":" in address else socket.AF_INET, socket.SOCK_STREAM)
+
+
+def connect_agent(addresses, timeout):
+    """
+    Connect to AGENT_PORT at the first of addresses that accepts.
+
+    Like socket.create_connection(), each address is tried in order, so a
+    name whose first address the agent does not listen on (an IPv6 address
+    of an agent bound to 0.0.0.0) still connects over the next one.
+    """
+    error = OSError("no addresses to connect to")
+    for address in addresses:
+        sock = None
+        try:
+            sock = agent_socket(address)
+            sock.settimeout(timeout)
+            sock.connect((address, AGENT_PORT))
+            return sock
+        except OSError as e:
+            error = e
+            if sock is not None:
+                sock.close()
+    raise error
+
+
+class AgentConnection(HTTPConnection):
+    """HTTP connection to host's agent over its resolved addresses, sending host as Host."""
+
+    def __init__(self, host, addresses, timeout):
+        super().__init__(host, AGENT_PORT, timeout=timeout)
+        self.addresses = addresses
+
+    def connect(self):
+        """Connect to the first address that accepts."""
+        self.sock = connect_agent(self.addresses, self.timeout)
+
+
+# =============================================================================
+# Circuit Breaker
+# =============================================================================
+
+
+class ConnectProbe:
+    """Non-blocking TCP connects to each address of an agent, left in flight between checks."""
+
+    __slots__ = ("socks", "started")
+
+    def __init__(self, addresses):
+        self.socks = []
+        self.started = time.monotonic()
+        for address in addresses:
+            try:
+                sock = agent_socket(address)
+            except OSError:
+                continue  # Address family not supported here
+            sock.setblocking(False)
+            sock.connect_ex((address, AGENT_PORT))
+            self.socks.append(sock)
+
+    def result(self, timeout):
+        """
+        Wait up to timeout seconds and close; True if any connect succeeded.
+
+        Uses a selector rather than select(), which fails for descriptors
+        above FD_SETSIZE (1024) in large fleets. A probe that cannot be
+        checked counts as failed.
+        """
+        deadline = time.monotonic() + timeout
+        selector = selectors.DefaultSelector()
+        try:
+            for sock in self.socks:
+                selector.register(sock, selectors.EVENT_WRITE)
+            while selector.get_map():
+                events = selector.select(max(0.0, deadline - time.monotonic()))
+                if not events:
+                    return False
+                for key, _ in events:
+                    if not key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+                        return True
+                    selector.unregister(key.fileobj)  # Refused; keep waiting for the others
+            return False
+        except (OSError, ValueError):
+            return False
+        finally:
+            selector.close()
+            self.close()
+
+    def close(self):
+        """Close every connect."""
+        for sock in self.socks:
+            sock.close()
+
+
+# Probes in flight per host, started by one poll cycle and checked by the next.
+# Only touched by the poller thread.
+probes = {}
+
+
+def probe_host(host):
+    """
+    Return True if host's agent port accepts TCP connections.
+
+    The probe started by the previous call has had a whole poll cycle to
+    connect, so checking it rarely waits; only a probe younger than
+    PROBE_TIMEOUT is waited on. After a failure a new probe is left in
+    flight for the next call.
+    """
+    addresses = RESOLVER.resolve(host)
+    if addresses is None:
+        return False
+    probe = probes.pop(host, None) or ConnectProbe(addresses)
+    connected = probe.result(max(0.0, PROBE_TIMEOUT - (time.monotonic() - probe.started)))
+    if not connected:
+        probes[host] = ConnectProbe(addresses)
+    return connected
+
+
+def breaker_open(failures):
+    """Return True if a host with this many consecutive failed polls is only probed."""
+    return 0 < BREAKER_FAILURES <= failures
+
+
+def poll_host(host, failures):
+    """
+    Fetch host's metrics, or probe it first while its circuit breaker is open.
+
+    A tripped host costs one non-blocking connect check per cycle instead of a
+    full fetch timeout. Once the probe connects, the next fetch decides: success
+    closes the breaker, while a failed fetch from a host whose port answers is
+    reported as "degraded".
+    """
+    if not breaker_open(failures):
+        return fetch_metrics(host)
+    STATS.incr("breaker.probe")
+    if not probe_host(host):
+        return {"hostname": host, "status": "offline", "ip": host}
+    metrics = fetch_metrics(host)
+    if metrics["status"] != "online":
+        metrics["status"] = "degraded"
+    return metrics
+
 
 # =============================================================================
 # Metrics Collection
@@ -50,41 +516,1073 @@ data_lock = threading.Lock()
 
 
 def fetch_metrics(host):
-    """Fetch metrics from a Pi agent."""
+    """Fetch metrics from a Pi agent, connecting to its cached addresses in order."""
+    addresses = RESOLVER.resolve(host)
+    if addresses is None:
+        return {"hostname": host, "status": "offline", "ip": host}
+    connection = AgentConnection(host, addresses, timeout=3)
     try:
-        url = f"http://{host}:{AGENT_PORT}/metrics"
-        with urlopen(url, timeout=3) as response:
-            data = json.loads(response.read().decode())
-            data["status"] = "online"
-            data["last_seen"] = datetime.now().isoformat()
-            return data
-    except URLError:
+        # Our own sampler peaks window, not reset by other scrapers of the agent
+        connection.request("GET", "/metrics?consumer=dashboard")
+        response = connection.getresponse()
+        if response.status != 200:
+            return {"hostname": host, "status": "offline", "ip": host}
+        data = json.loads(response.read().decode())
+        data["status"] = "online"
+        data["last_seen"] = datetime.now().isoformat()
+        return data
+    except OSError:
         return {"hostname": host, "status": "offline", "ip": host}
     except Exception as e:
         return {"hostname": host, "status": "error", "error": str(e), "ip": host}
+    finally:
+        connection.close()
+
+
+def update_host(host, metrics):
+    """Store a host's latest metrics and bump its version. Caller holds data_lock."""
+    global fleet_version
+    fleet_version += 1
+    pi_data[host] = metrics
+    host_versions[host] = fleet_version
+    fleet_index.update(host, metrics)
+    changed = host_changed.get(host)
+    if changed is not None:
+        changed.notify_all()
+
+
+def poll_once():
+    """Poll every configured host once and store the results."""
+    cycle_start = perf_counter()
+    for host in MONITORED_HOSTS:
+        start = perf_counter()
+        metrics = poll_host(host, schedule.get(host, {}).get("failures", 0))
+        STATS.histogram("fetch." + host).observe(perf_counter() - start)
+        STATS.incr("fetch." + metrics["status"])
+        now = time.time()
+        if metrics["status"] == "online":
+            metrics["anomaly"] = ANOMALIES.observe(host, metrics)
+        with data_lock:
+            update_host(host, metrics)
+            state = schedule.setdefault(host, {"last_polled": None, "failures": 0})
+            state["last_polled"] = now
+            state["failures"] = 0 if metrics["status"] == "online" else state["failures"] + 1
+        if metrics["status"] == "online":
+            record_history(host, now, metrics)
+    with data_lock:
+        fleet_index.invalidate_orders()
+        fleet_changed.notify_all()
+    STATS.histogram("poll.cycle").observe(perf_counter() - cycle_start)
 
 
 def poll_all_hosts():
-    """Background thread to poll all configured hosts."""
-    while True:
+    """Background thread to poll all configured hosts until stop_event is set."""
+    last_snapshot = time.monotonic()
+    while not stop_event.is_set():
+        poll_once()
+        if shared_state is not None:
+            publish_state(shared_state)
+        if STATE_FILE and time.monotonic() - last_snapshot >= SNAPSHOT_INTERVAL:
+            save_snapshot(STATE_FILE)
+            last_snapshot = time.monotonic()
+        stop_event.wait(POLL_INTERVAL)
+
+
+# =============================================================================
+# Metrics History
+# =============================================================================
+
+# Numeric fields kept in the history: (column name, path into the agent's metrics)
+HISTORY_FIELDS = (
+    ("cpu_percent", ("cpu", "usage_percent")),
+    ("temperature", ("cpu", "temperature")),
+    ("load_1m", ("cpu", "load_average", 0)),
+    ("memory_percent", ("memory", "percent")),
+    ("disk_percent", ("disk", "percent")),
+)
+HISTORY_COLUMNS = tuple(name for name, _ in HISTORY_FIELDS)
+
+
+class HistoryBlock:
+    """
+    Up to HISTORY_BLOCK_SIZE samples for one host, stored column-wise.
+
+    This is the block being appended to; once full it is replaced by a
+    SealedBlock.
+    """
+
+    __slots__ = ("timestamps", "columns")
+
+    def __init__(self):
+        self.timestamps = array("d")
+        self.columns = tuple(array("d") for _ in HISTORY_FIELDS)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, timestamp, values):
+        """Append one sample; missing values are stored as NaN."""
+        self.timestamps.append(timestamp)
+        for column, value in zip(self.columns, values):
+            column.append(NAN if value is None else value)
+
+    def bounds(self, count):
+        """Return the first and the count-th timestamp."""
+        return self.timestamps[0], self.timestamps[count - 1]
+
+    def rows(self, count, start, end):
+        """Yield (timestamp, values) for the first count samples within [start, end]."""
+        timestamps = self.timestamps
+        columns = self.columns
+        for i in range(bisect_left(timestamps, start, 0, count), count):
+            timestamp = timestamps[i]
+            if timestamp > end:
+                return
+            yield timestamp, [column[i] for column in columns]
+
+
+class SealedBlock:
+    """
+    A full HistoryBlock compressed with Gorilla encoding.
+
+    Timestamps (to the millisecond) are delta-of-delta encoded and every
+    column is scaled to whole numbers where possible and XOR encoded, each
+    as its own bit stream. Rows are decoded on demand, so a range query
+    only pays for the blocks it overlaps.
+    """
+
+    __slots__ = ("count", "first", "last", "timestamps", "columns")
+
+    def __init__(self, block):
+        self.count = len(block)
+        self.timestamps = encode_timestamps(block.timestamps)
+        self.columns = tuple(encode_column(column) for column in block.columns)
+        self.first = round(block.timestamps[0] * HISTORY_TIME_SCALE) / HISTORY_TIME_SCALE
+        self.last = round(block.timestamps[-1] * HISTORY_TIME_SCALE) / HISTORY_TIME_SCALE
+
+    def __len__(self):
+        return self.count
+
+    def nbytes(self):
+        """Return the size of the encoded streams in bytes."""
+        return len(self.timestamps) + sum(len(data) for _, data in self.columns)
+
+    def bounds(self, count):
+        """Return the first and last timestamp (a sealed block never grows)."""
+        return self.first, self.last
+
+    def rows(self, count, start, end):
+        """Yield (timestamp, values) for the samples within [start, end]."""
+        timestamps = decode_timestamps(self.timestamps, self.count)
+        low = bisect_left(timestamps, start)
+        high = bisect_right(timestamps, end)
+        if low >= high:
+            return
+        # Columns are only decoded as far as the last sample in range
+        columns = [decode_column(scale, data, high) for scale, data in self.columns]
+        for i in range(low, high):
+            yield timestamps[i], [column[i] for column in columns]
+
+
+class HostHistory:
+    """A host's history: sealed blocks followed by the current block."""
+
+    __slots__ = ("blocks",)
+
+    def __init__(self):
+        self.blocks = [HistoryBlock()]
+
+    def append(self, timestamp, values):
+        """
+        Append a sample, starting a new block when the current one is full.
+
+        Returns the full block that should be sealed, or None.
+        """
+        full = None
+        if len(self.blocks[-1]) >= HISTORY_BLOCK_SIZE:
+            full = self.blocks[-1]
+            self.blocks.append(HistoryBlock())
+        self.blocks[-1].append(timestamp, values)
+        horizon = timestamp - HISTORY_RETENTION
+        while len(self.blocks) > 1 and self.blocks[0].bounds(len(self.blocks[0]))[1] < horizon:
+            del self.blocks[0]
+        return full
+
+    def seal(self, block, sealed):
+        """Replace a full block with its SealedBlock, unless it has expired meanwhile."""
+        for i, current in enumerate(self.blocks):
+            if current is block:
+                self.blocks[i] = sealed
+                return
+
+    def view(self):
+        """Return [(block, sample count)] for a consistent read without holding a lock."""
+        return [(block, len(block)) for block in self.blocks]
+
+
+def metric_value(metrics, path):
+    """Return the number at path in a metrics dictionary, or None."""
+    value = metrics
+    for key in path:
+        try:
+            value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def sample_values(metrics):
+    """Return the HISTORY_FIELDS values of a metrics dictionary (None if missing)."""
+    return [metric_value(metrics, path) for _, path in HISTORY_FIELDS]
+
+
+def record_history(host, timestamp, metrics):
+    """Append an online host's numeric metrics to its history."""
+    if HISTORY_RETENTION <= 0:
+        return
+    values = sample_values(metrics)
+    with history_lock:
+        entry = history.get(host)
+        if entry is None:
+            entry = history[host] = HostHistory()
+        full = entry.append(timestamp, values)
+    if full is not None:
+        # Only the poller appends, so the full block can be encoded without the lock
+        sealed = SealedBlock(full)
+        with history_lock:
+            entry.seal(full, sealed)
+
+
+def history_rows(hosts, start, end):
+    """
+    Yield (host, timestamp, values) for every sample of hosts within [start, end].
+
+    Blocks are only touched while iterating, so memory use does not depend
+    on the size of the range.
+    """
+    for host in hosts:
+        with history_lock:
+            entry = history.get(host)
+            view = entry.view() if entry else []
+        for block, count in view:
+            if count == 0:
+                continue
+            first, last = block.bounds(count)
+            if first > end or last < start:
+                continue
+            for timestamp, values in block.rows(count, start, end):
+                yield host, timestamp, values
+
+
+def format_ndjson(rows):
+    """Encode history rows as newline-delimited JSON objects."""
+    for host, timestamp, values in rows:
+        row = {"host": host, "timestamp": datetime.fromtimestamp(timestamp).isoformat()}
+        for name, value in zip(HISTORY_COLUMNS, values):
+            row[name] = None if value != value else value  # NaN -> null
+        yield json.dumps(row) + "\n"
+
+
+def format_csv(rows):
+    """Encode history rows as CSV with a header line."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(("host", "timestamp") + HISTORY_COLUMNS)
+    for host, timestamp, values in rows:
+        writer.writerow(
+            [host, datetime.fromtimestamp(timestamp).isoformat()]
+            + ["" if value != value else value for value in values]
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def chunked(pieces, size=EXPORT_CHUNK_SIZE):
+    """Group encoded text pieces into byte chunks of roughly size bytes."""
+    batch = []
+    length = 0
+    for piece in pieces:
+        batch.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(batch).encode()
+            batch = []
+            length = 0
+    if batch:
+        yield "".join(batch).encode()
+
+
+def parse_time(value, default):
+    """Parse an epoch-seconds or ISO 8601 query value; raises ValueError."""
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+# =============================================================================
+# History Compression
+# =============================================================================
+
+# Sealed blocks keep timestamps to the millisecond
+HISTORY_TIME_SCALE = 1000
+
+# Largest number of decimal places a column is scaled by before XOR encoding
+HISTORY_MAX_DECIMALS = 3
+
+# Delta-of-delta buckets after the "0" (unchanged) code: (prefix, prefix bits, value bits)
+DOD_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12), (0b1111, 4, 64))
+
+
+class BitWriter:
+    """Accumulates big-endian bit fields into bytes."""
+
+    __slots__ = ("buffer", "value", "bits")
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.value = 0
+        self.bits = 0
+
+    def write(self, value, bits):
+        """Append the low bits of a non-negative value."""
+        self.value = (self.value << bits) | value
+        self.bits += bits
+        if self.bits >= 64:
+            spare = self.bits & 7
+            self.buffer += (self.value >> spare).to_bytes(self.bits >> 3, "big")
+            self.value &= (1 << spare) - 1
+            self.bits = spare
+
+    def getvalue(self):
+        """Return everything written, zero-padded to a whole byte."""
+        pad = -self.bits & 7
+        return bytes(self.buffer) + (self.value << pad).to_bytes((self.bits + pad) >> 3, "big")
+
+
+class BitReader:
+    """Reads big-endian bit fields written by BitWriter."""
+
+    __slots__ = ("data", "position")
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def read(self, bits):
+        """Return the next bits as a non-negative integer."""
+        position = self.position
+        first = position >> 3
+        last = (position + bits + 7) >> 3
+        self.position = position + bits
+        value = int.from_bytes(self.data[first:last], "big")
+        return (value >> ((last << 3) - position - bits)) & ((1 << bits) - 1)
+
+
+def encode_timestamps(timestamps):
+    """
+    Encode epoch-second timestamps as delta-of-delta milliseconds.
+
+    The first timestamp is stored in 64 bits; each later one as the change
+    in its interval: "0" when the interval repeats, otherwise the smallest
+    DOD_BUCKETS bucket that holds the difference.
+    """
+    writer = BitWriter()
+    write = writer.write
+    previous = round(timestamps[0] * HISTORY_TIME_SCALE)
+    write(previous, 64)
+    delta = 0
+    for timestamp in islice(timestamps, 1, None):
+        current = round(timestamp * HISTORY_TIME_SCALE)
+        dod = current - previous - delta
+        delta = current - previous
+        previous = current
+        if dod == 0:
+            write(0, 1)
+            continue
+        for prefix, prefix_bits, bits in DOD_BUCKETS:
+            if -(1 << (bits - 1)) <= dod < 1 << (bits - 1):
+                write((prefix << bits) | (dod & ((1 << bits) - 1)), prefix_bits + bits)
+                break
+    return writer.getvalue()
+
+
+def decode_timestamps(data, count):
+    """Decode the first count timestamps written by encode_timestamps()."""
+    read = BitReader(data).read
+    current = read(64)
+    delta = 0
+    timestamps = array("d", [current / HISTORY_TIME_SCALE])
+    for _ in range(count - 1):
+        if read(1):
+            # Each further 1 bit selects the next bucket; the last has no terminating 0
+            bits = DOD_BUCKETS[-1][2]
+            for _, _, size in DOD_BUCKETS[:-1]:
+                if not read(1):
+                    bits = size
+                    break
+            dod = read(bits)
+            if dod >= 1 << (bits - 1):
+                dod -= 1 << bits
+            delta += dod
+        current += delta
+        timestamps.append(current / HISTORY_TIME_SCALE)
+    return timestamps
+
+
+def encode_floats(values):
+    """
+    XOR encode an array('d') (Gorilla): each value is XORed with the one before.
+
+    An unchanged value costs one bit. Otherwise the XOR's meaningful bits are
+    stored either inside the previous leading/trailing-zero window ("10") or
+    with a new window ("11", 5 bits of leading zeros, 6 bits of length - 1).
+    Lossless, NaN included.
+    """
+    words = array("Q", values.tobytes())
+    writer = BitWriter()
+    write = writer.write
+    previous = words[0]
+    write(previous, 64)
+    leading = trailing = 64  # No window yet
+    for word in islice(words, 1, None):
+        xor = word ^ previous
+        previous = word
+        if not xor:
+            write(0, 1)
+            continue
+        lead = min(64 - xor.bit_length(), 31)
+        trail = (xor & -xor).bit_length() - 1
+        if lead >= leading and trail >= trailing:
+            write(0b10, 2)
+            write(xor >> trailing, 64 - leading - trailing)
+        else:
+            leading, trailing = lead, trail
+            meaningful = 64 - lead - trail
+            write((0b11 << 11) | (lead << 6) | (meaningful - 1), 13)
+            write(xor >> trail, meaningful)
+    return writer.getvalue()
+
+
+def decode_floats(data, count):
+    """Decode the first count values written by encode_floats() into an array('d')."""
+    read = BitReader(data).read
+    word = read(64)
+    words = array("Q", [word])
+    trailing = meaningful = 0
+    for _ in range(count - 1):
+        if read(1):
+            if read(1):
+                leading = read(5)
+                meaningful = read(6) + 1
+                trailing = 64 - leading - meaningful
+            word ^= read(meaningful) << trailing
+        words.append(word)
+    return array("d", words.tobytes())
+
+
+def decimal_scale(column):
+    """
+    Return (scale, scaled column) for XOR encoding.
+
+    The agent rounds its metrics to one or two decimals, which are not exact
+    binary fractions, so consecutive values differ in most mantissa bits.
+    Scaled to whole numbers they differ in only a few. scale is the smallest
+    power of ten (up to 10**HISTORY_MAX_DECIMALS) for which dividing the
+    scaled column gives back the original bit for bit; 1 (the column
+    unchanged) when there is none.
+    """
+    original = column.tobytes()
+    for places in range(HISTORY_MAX_DECIMALS + 1):
+        scale = 10**places
+        scaled = array("d")
+        for value in column:
+            value *= scale
+            scaled.append(float(round(value)) if value - value == 0 else value)  # Not inf/NaN
+        if array("d", [value / scale for value in scaled]).tobytes() == original:
+            return scale, scaled
+    return 1, column
+
+
+def encode_column(column):
+    """Encode an array('d') column as (decimal scale, XOR encoded bytes)."""
+    scale, scaled = decimal_scale(column)
+    return scale, encode_floats(scaled)
+
+
+def decode_column(scale, data, count):
+    """Decode the first count values of a column written by encode_column()."""
+    values = decode_floats(data, count)
+    if scale == 1:
+        return values
+    return array("d", [value / scale for value in values])
+
+
+# =============================================================================
+# Anomaly Detection
+# =============================================================================
+
+
+class AnomalyDetector:
+    """
+    Exponentially weighted mean and variance per host and HISTORY_FIELDS column.
+
+    State is kept structure-of-arrays: each column has one array('d') of
+    means and one of variances, indexed by a per-host slot. Updating a host
+    is a constant number of float operations, memory is fixed per host, and
+    the state of one metric across the whole fleet is a single contiguous
+    array. Only the poller thread calls observe().
+    """
+
+    def __init__(self):
+        self.slots = {}
+        self.counts = array("L")
+        self.means = tuple(array("d") for _ in HISTORY_FIELDS)
+        self.variances = tuple(array("d") for _ in HISTORY_FIELDS)
+
+    def slot(self, host):
+        """Return the index of host's state, allocating it on first use."""
+        index = self.slots.get(host)
+        if index is None:
+            index = self.slots[host] = len(self.counts)
+            self.counts.append(0)
+            for column in self.means + self.variances:
+                column.append(NAN)
+        return index
+
+    def observe(self, host, metrics):
+        """
+        Update host's statistics with a sample and score it.
+
+        Each value is scored against the mean and variance from before the
+        sample, so a spike cannot hide itself. Returns {"scores": {column:
+        z-score or None}, "flagged": [columns with |z| >= ANOMALY_THRESHOLD]}.
+        """
+        index = self.slot(host)
+        self.counts[index] += 1
+        count = self.counts[index]
+        warm = count > ANOMALY_WARMUP
+        # Plain running mean/variance until 1/count drops below ANOMALY_ALPHA
+        alpha = max(ANOMALY_ALPHA, 1.0 / count)
+        scores = {}
+        flagged = []
+        for name, value, means, variances in zip(
+            HISTORY_COLUMNS, sample_values(metrics), self.means, self.variances
+        ):
+            mean = means[index]
+            if value is None:
+                scores[name] = None
+                continue
+            if mean != mean:  # First sample of this metric
+                means[index] = value
+                variances[index] = 0.0
+                scores[name] = None
+                continue
+            variance = variances[index]
+            diff = value - mean
+            if not warm:
+                score = None
+            elif variance > 0:
+                score = round(diff / variance**0.5, 2)
+            else:
+                score = 0.0
+            increment = alpha * diff
+            means[index] = mean + increment
+            variances[index] = (1 - alpha) * (variance + diff * increment)
+            scores[name] = score
+            if score is not None and abs(score) >= ANOMALY_THRESHOLD:
+                flagged.append(name)
+        return {"scores": scores, "flagged": flagged}
+
+
+ANOMALIES = AnomalyDetector()
+
+
+# =============================================================================
+# Fleet Queries
+# =============================================================================
+
+# Sort keys for /api/metrics?sort= and the path of each in a host's data
+SORT_KEYS = {
+    "hostname": ("hostname",),
+    "status": ("status",),
+    "temperature": ("cpu", "temperature"),
+    "cpu": ("cpu", "usage_percent"),
+    "memory": ("memory", "percent"),
+    "disk": ("disk", "percent"),
+    "last_seen": ("last_seen",),
+}
+FLEET_QUERY_PARAMS = ("tag", "status", "sort", "limit", "offset")
+
+
+def sort_value(host, data, key):
+    """Return host's value for a sort key (None sorts last)."""
+    value = data
+    for name in SORT_KEYS[key]:
+        value = value.get(name) if isinstance(value, dict) else None
+    if key == "hostname" and not value:
+        value = host
+    if isinstance(value, str):
+        return value.casefold()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return None
+
+
+class FleetIndex:
+    """
+    Inverted tag and status indexes over the fleet, plus cached sort orders.
+
+    update() keeps the indexes current as each host changes. A sort order
+    is built on first use after invalidate_orders(), which the poller calls
+    once per cycle, so pages cost O(offset + limit) and filtered queries
+    O(matches) instead of a sort of the whole fleet per request. Callers
+    serialize access (data_lock in the poller's process).
+    """
+
+    def __init__(self):
+        self.host_tags = {}
+        self.models = {}
+        self.statuses = {}
+        self.by_tag = {}
+        self.by_status = {}
+        self.orders = {}  # sort key -> (hosts with a value in order, hosts without, ranks)
+
+    def update(self, host, data):
+        """Re-index host after its data changed."""
+        model = data.get("model")
+        if isinstance(model, str) and model:
+            self.models[host] = model  # Offline hosts keep their last known model
+        tags = set(HOST_TAGS.get(host, ()))
+        if host in self.models:
+            tags.add("model:" + self.models[host])
+        tags = frozenset(tags)
+        previous = self.host_tags.get(host, frozenset())
+        for tag in previous - tags:
+            move(self.by_tag, tag, host, None)
+        for tag in tags - previous:
+            move(self.by_tag, None, host, tag)
+        self.host_tags[host] = tags
+
+        status = data.get("status")
+        move(self.by_status, self.statuses.get(host), host, status)
+        self.statuses[host] = status
+
+    def invalidate_orders(self):
+        """Drop the cached sort orders (rebuilt lazily on the next query)."""
+        self.orders = {}
+
+    def order(self, data, key):
+        """Return the cached (valued, missing, ranks) order of data by key."""
+        cached = self.orders.get(key)
+        if cached is not None and len(cached[2]) == len(data):
+            return cached
+        valued = []
+        missing = []
+        for host, entry in data.items():
+            value = sort_value(host, entry, key)
+            if value is None:
+                missing.append(host)
+            else:
+                valued.append((value, host))
+        valued.sort()
+        missing.sort()
+        hosts = [host for _, host in valued]
+        ranks = {host: rank for rank, host in enumerate(hosts + missing)}
+        self.orders[key] = cached = (hosts, missing, ranks)
+        return cached
+
+    def query(
+        self, data, tags=(), status=None, sort="hostname", descending=False, offset=0, limit=None
+    ):
+        """
+        Return (number of matching hosts, one page of them in order).
+
+        tags must all match; descending reverses the order of hosts that have
+        a value for the sort key, and hosts without one always come last.
+        """
+        if limit is None:
+            limit = API_PAGE_LIMIT
+        valued, missing, ranks = self.order(data, sort)
+        filters = [self.by_tag.get(tag, ()) for tag in tags]
+        if status:
+            filters.append(self.by_status.get(status, ()))
+
+        if not filters:
+            total = len(ranks)
+            ordered = self.ordered(valued, missing, descending)
+            return total, list(islice(ordered, offset, offset + limit))
+
+        filters.sort(key=len)
+        matches = set(filters[0]).intersection(*filters[1:])
+        if len(matches) * 8 < len(ranks):
+            # Few matches: sort them by their cached rank instead of scanning
+            count = len(valued)
+
+            def position(host):
+                rank = ranks[host]
+                return count - 1 - rank if descending and rank < count else rank
+
+            page = sorted(matches, key=position)[offset : offset + limit]
+        else:
+            ordered = self.ordered(valued, missing, descending)
+            page = list(islice((h for h in ordered if h in matches), offset, offset + limit))
+        return len(matches), page
+
+    @staticmethod
+    def ordered(valued, missing, descending):
+        """Iterate an order lazily, reversing the valued part if descending."""
+        yield from reversed(valued) if descending else valued
+        yield from missing
+
+
+def move(index, old, host, new):
+    """Move host from index[old] to index[new] (either may be None)."""
+    if old == new:
+        return
+    if old is not None:
+        members = index.get(old)
+        if members is not None:
+            members.discard(host)
+            if not members:
+                del index[old]
+    if new is not None:
+        index.setdefault(new, set()).add(host)
+
+
+def parse_fleet_query(query):
+    """
+    Parse /api/metrics query parameters into FleetIndex.query() arguments.
+
+    Returns None when no fleet query parameter is present (the legacy
+    response of every host); raises ValueError for invalid values.
+    """
+    params = parse_qs(query)
+    if not any(name in params for name in FLEET_QUERY_PARAMS):
+        return None
+    sort = params.get("sort", ["hostname"])[0]
+    descending = sort.startswith("-")
+    sort = sort.lstrip("-")
+    if sort not in SORT_KEYS:
+        raise ValueError(f"Unknown sort key: {sort}")
+    try:
+        limit = int(params.get("limit", [API_PAGE_LIMIT])[0])
+        offset = int(params.get("offset", [0])[0])
+    except ValueError:
+        raise ValueError("limit and offset must be integers") from None
+    if limit < 0 or offset < 0:
+        raise ValueError("limit and offset must not be negative")
+    return {
+        "tags": params.get("tag", []),
+        "status": params.get("status", [None])[0],
+        "sort": sort,
+        "descending": descending,
+        "offset": offset,
+        "limit": min(limit, API_MAX_PAGE_LIMIT),
+    }
+
+
+def fleet_page(index, data, version, spec):
+    """Run a parsed fleet query and encode the paged /api/metrics response."""
+    total, hosts = index.query(data, **spec)
+    return json.dumps(
+        {
+            "version": version,
+            "total": total,
+            "offset": spec["offset"],
+            "limit": spec["limit"],
+            "hosts": [
+                dict(data[host], host=host, tags=sorted(index.host_tags.get(host, ())))
+                for host in hosts
+            ],
+        }
+    ).encode()
+
+
+fleet_index = FleetIndex()
+
+
+# =============================================================================
+# Watch API
+# =============================================================================
+
+
+class TooManyWatchers(Exception):
+    """Raised when MAX_WATCHERS requests are already waiting."""
+
+
+def watch(host, since, timeout):
+    """
+    Wait until host (or any host, if None) changes after fleet version since.
+
+    Returns the JSON delta {"version": fleet_version, "hosts": {host: data}}
+    of hosts changed after since; "hosts" is empty if timeout expired first.
+    since=None returns the current data at once. Raises KeyError for hosts
+    that are not monitored and TooManyWatchers at MAX_WATCHERS.
+    """
+    global watchers
+    with data_lock:
+        if host is not None and host not in pi_data and host not in MONITORED_HOSTS:
+            raise KeyError(host)
+        if since is not None:
+            if watchers >= MAX_WATCHERS:
+                raise TooManyWatchers()
+
+            def changed():
+                if host is None:
+                    return fleet_version > since
+                return host_versions.get(host, 0) > since
+
+            if host is None:
+                condition = fleet_changed
+            else:
+                condition = host_changed.get(host)
+                if condition is None:
+                    condition = host_changed[host] = data_lock.condition()
+            watchers += 1
+            try:
+                condition.wait_for(changed, timeout)
+            finally:
+                watchers -= 1
+        names = pi_data if host is None else [host]
+        delta = {
+            name: pi_data[name]
+            for name in names
+            if name in pi_data and host_versions.get(name, 0) > (since or 0)
+        }
+        return json.dumps({"version": fleet_version, "hosts": delta}).encode()
+
+
+# =============================================================================
+# State Snapshots
+# =============================================================================
+
+SNAPSHOT_FORMAT = 1
+
+
+def save_snapshot(path):
+    """
+    Checkpoint fleet state, host versions and polling state to path.
+
+    The snapshot is written to a temporary file, fsynced and renamed over
+    path, so readers only ever see a complete snapshot. Returns False if
+    the snapshot could not be written.
+    """
+    start = perf_counter()
+    with data_lock:
+        state = {
+            "format": SNAPSHOT_FORMAT,
+            "saved_at": time.time(),
+            "fleet_version": fleet_version,
+            "hosts": {
+                host: {
+                    "data": data,
+                    "version": host_versions.get(host, 0),
+                    "schedule": dict(schedule.get(host, {})),
+                }
+                for host, data in pi_data.items()
+            },
+        }
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError) as e:
+        STATS.incr("snapshot.errors")
+        if STATS.counters["snapshot.errors"] == 1:
+            print(f"⚠️  Could not write state snapshot {path}: {e}")
+        return False
+    STATS.histogram("snapshot.save").observe(perf_counter() - start)
+    return True
+
+
+def load_snapshot(path):
+    """
+    Restore state saved by save_snapshot() for hosts that are still configured.
+
+    The file is read and parsed in one pass. Restored hosts are flagged
+    "restored" until their first poll. Returns the number of hosts restored
+    (0 if the snapshot is missing or unreadable).
+    """
+    global fleet_version
+    start = perf_counter()
+    try:
+        with open(path, "rb") as f:
+            state = json.loads(f.read())
+        if state.get("format") != SNAPSHOT_FORMAT:
+            return 0
+        hosts = state["hosts"]
+    except (OSError, ValueError, KeyError, AttributeError):
+        return 0
+
+    restored = 0
+    with data_lock:
+        fleet_version = max(fleet_version, int(state.get("fleet_version", 0)))
         for host in MONITORED_HOSTS:
-            metrics = fetch_metrics(host)
-            with data_lock:
-                pi_data[host] = metrics
-        time.sleep(POLL_INTERVAL)
+            entry = hosts.get(host)
+            if not isinstance(entry, dict) or not isinstance(entry.get("data"), dict):
+                continue
+            pi_data[host] = dict(entry["data"], restored=True)
+            host_versions[host] = int(entry.get("version", 0))
+            schedule[host] = dict(entry.get("schedule") or {"last_polled": None, "failures": 0})
+            fleet_index.update(host, pi_data[host])
+            restored += 1
+        fleet_index.invalidate_orders()
+    STATS.histogram("snapshot.load").observe(perf_counter() - start)
+    return restored
+
+
+# =============================================================================
+# Multi-Process Mode
+# =============================================================================
+
+# Shared memory layout: sequence, fleet version, body length, then the body
+SHARED_SEQUENCE = struct.Struct("<Q")
+SHARED_SIZES = struct.Struct("<QQ")
+SHARED_HEADER_SIZE = SHARED_SEQUENCE.size + SHARED_SIZES.size
+SHARED_READ_RETRIES = 100
+
+
+class SharedState:
+    """
+    The latest /api/metrics body in shared memory, guarded by a seqlock.
+
+    The single writer makes the sequence odd, writes the body and sizes, then
+    makes it even again. Readers take no lock: they copy the body and retry
+    if the sequence was odd or changed meanwhile. Each reader caches the
+    copy until the sequence moves, so repeated requests cost one 8-byte read.
+    """
+
+    def __init__(self, shm):
+        self.shm = shm
+        self.sequence = 0
+        self.cached = (0, 0, b"{}")
+        self.decoded = None
+
+    def publish(self, version, body):
+        """Publish body as fleet version; returns False if it does not fit."""
+        buf = self.shm.buf
+        if SHARED_HEADER_SIZE + len(body) > len(buf):
+            return False
+        SHARED_SEQUENCE.pack_into(buf, 0, self.sequence + 1)
+        buf[SHARED_HEADER_SIZE : SHARED_HEADER_SIZE + len(body)] = body
+        SHARED_SIZES.pack_into(buf, SHARED_SEQUENCE.size, version, len(body))
+        self.sequence += 2
+        SHARED_SEQUENCE.pack_into(buf, 0, self.sequence)
+        return True
+
+    def read(self):
+        """Return (fleet version, body) of the latest consistent publication."""
+        buf = self.shm.buf
+        for _ in range(SHARED_READ_RETRIES):
+            (sequence,) = SHARED_SEQUENCE.unpack_from(buf, 0)
+            if sequence == self.cached[0]:
+                break
+            if sequence & 1:
+                time.sleep(0.0001)  # Writer is mid-update
+                continue
+            version, length = SHARED_SIZES.unpack_from(buf, SHARED_SEQUENCE.size)
+            body = bytes(buf[SHARED_HEADER_SIZE : SHARED_HEADER_SIZE + length])
+            if SHARED_SEQUENCE.unpack_from(buf, 0)[0] == sequence:
+                self.cached = (sequence, version, body)
+                break
+        else:
+            STATS.incr("shared.read_retries_exhausted")
+        return self.cached[1], self.cached[2]
+
+    def fleet(self):
+        """Return (fleet version, decoded data, FleetIndex), rebuilt once per publication."""
+        version, body = self.read()
+        if self.decoded is None or self.decoded[0] is not body:
+            data = json.loads(body)
+            index = FleetIndex()
+            for host, entry in data.items():
+                index.update(host, entry)
+            self.decoded = (body, version, data, index)
+        return self.decoded[1:]
+
+
+def publish_state(state):
+    """Publish the current fleet state for the server processes."""
+    with data_lock:
+        version = fleet_version
+        body = json.dumps(pi_data).encode()
+    if not state.publish(version, body):
+        if STATS.counters.get("shared.overflow", 0) == 0:
+            print(
+                f"⚠️  Fleet state ({len(body)} bytes) exceeds SHARED_STATE_SIZE; "
+                "server processes keep serving the previous state"
+            )
+        STATS.incr("shared.overflow")
+
+
+def serve_shared(server, state):
+    """Server process entry point: serve HTTP from the shared fleet state."""
+    global shared_state
+    shared_state = state
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def run_multiprocess(server):
+    """
+    Poll in this process and serve HTTP from SERVER_PROCESSES forked children.
+
+    The children inherit the listening socket, which is made non-blocking so
+    that a child losing the race for a connection returns to its selector
+    instead of blocking in accept(). Returns when interrupted. Needs Python
+    3.8 for multiprocessing.shared_memory, imported here so that the default
+    single-process mode still runs on 3.7.
+    """
+    global shared_state
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(create=True, size=SHARED_STATE_SIZE)
+    shared_state = SharedState(shm)
+    publish_state(shared_state)
+    server.socket.setblocking(False)
+
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=serve_shared, args=(server, shared_state), name=f"server-{i}")
+        for i in range(SERVER_PROCESSES)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        if MONITORED_HOSTS:
+            poll_all_hosts()
+        else:
+            stop_event.wait()
+    finally:
+        stop_event.set()
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+        shared_state = None
+        shm.close()
+        shm.unlink()
 
 
 # =============================================================================
 # HTML Dashboard
 # =============================================================================
 
-DASHBOARD_HTML = """<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>🍓 Pi Monitor</title>
-    <style>
+# The page is split into an HTML shell, a stylesheet and a script, which
+# build_assets() encodes once. {styles} and {script} become the hashed
+# asset URLs.
+DASHBOARD_CSS = """\
         * { box-sizing: border-box; margin: 0; padding: 0; }
 
         body {
@@ -134,6 +1632,11 @@ DASHBOARD_HTML = """<!DOCTYPE html>
             border-color: #e74c3c;
         }
 
+        .card.degraded {
+            opacity: 0.7;
+            border-color: #f39c12;
+        }
+
         .card-header {
             display: flex;
             justify-content: space-between;
@@ -158,6 +1661,8 @@ DASHBOARD_HTML = """<!DOCTYPE html>
 
         .status.online { background: #27ae60; color: white; }
         .status.offline { background: #e74c3c; color: white; }
+        .status.degraded { background: #f39c12; color: white; }
+        .status.restored { background: #7f8c8d; color: white; }
 
         .info-row {
             display: flex;
@@ -209,6 +1714,9 @@ DASHBOARD_HTML = """<!DOCTYPE html>
         .fill-disk { background: linear-gradient(90deg, #e67e22, #f39c12); }
         .fill-temp { background: linear-gradient(90deg, #e74c3c, #c0392b); }
 
+        .metric.anomaly { box-shadow: inset 0 0 0 2px #f39c12; }
+        .metric.anomaly .metric-label { color: #f39c12; }
+
         .temp-warn { color: #f39c12; }
         .temp-hot { color: #e74c3c; }
 
@@ -243,6 +1751,17 @@ DASHBOARD_HTML = """<!DOCTYPE html>
             color: #3498db;
         }
 
+        .more { text-align: center; margin-top: 20px; }
+
+        .more button {
+            background: rgba(255, 255, 255, 0.1);
+            color: #eee;
+            border: none;
+            border-radius: 8px;
+            padding: 10px 20px;
+            cursor: pointer;
+        }
+
         .last-update {
             text-align: center;
             color: #666;
@@ -254,32 +1773,42 @@ DASHBOARD_HTML = """<!DOCTYPE html>
             .metrics { grid-template-columns: 1fr; }
             .card { padding: 15px; }
         }
-    </style>
-</head>
-<body>
-    <h1>🍓 Pi Monitor</h1>
-    <p class="subtitle">Real-time Raspberry Pi Fleet Dashboard</p>
-
-    <div id="dashboard" class="grid"></div>
-    <p class="last-update">Last update: <span id="timestamp">-</span></p>
+"""
 
-    <script>
+DASHBOARD_JS = """\
         function getTempClass(temp) {
             if (temp >= 70) return 'temp-hot';
             if (temp >= 60) return 'temp-warn';
             return '';
         }
 
+        function anomalyClass(pi, column) {
+            const flagged = (pi.anomaly && pi.anomaly.flagged) || [];
+            return flagged.includes(column) ? 'anomaly' : '';
+        }
+
+        function anomalyNote(pi, column) {
+            if (!anomalyClass(pi, column)) return '';
+            const z = pi.anomaly.scores[column];
+            return ` ⚠ ${z > 0 ? '+' : ''}${z}σ`;
+        }
+
+        const DOWN_STATUSES = {
+            offline: ['Offline', 'Unable to connect to agent'],
+            degraded: ['Degraded', 'Agent port answers, but metrics could not be fetched'],
+        };
+
         function createCard(pi) {
-            if (pi.status === 'offline') {
+            if (DOWN_STATUSES[pi.status]) {
+                const [label, note] = DOWN_STATUSES[pi.status];
                 return `
-                    <div class="card offline">
+                    <div class="card ${pi.status}">
                         <div class="card-header">
                             <span class="hostname">${escapeHtml(pi.hostname || pi.ip)}</span>
-                            <span class="status offline">Offline</span>
+                            <span class="status ${pi.status}">${label}</span>
                         </div>
                         <p style="color: #888; text-align: center; padding: 20px;">
-                            Unable to connect to agent
+                            ${note}
                         </p>
                     </div>
                 `;
@@ -296,36 +1825,38 @@ DASHBOARD_HTML = """<!DOCTYPE html>
                 <div class="card">
                     <div class="card-header">
                         <span class="hostname">${escapeHtml(pi.hostname)}</span>
-                        <span class="status online">Online</span>
+                        ${pi.restored
+                            ? '<span class="status restored">Cached</span>'
+                            : '<span class="status online">Online</span>'}
                     </div>
                     <div class="info-row">
                         <span>${escapeHtml(pi.ip)}</span>
                         <span>${escapeHtml(model)}</span>
                     </div>
                     <div class="metrics">
-                        <div class="metric">
-                            <div class="metric-label">CPU Usage</div>
+                        <div class="metric ${anomalyClass(pi, 'cpu_percent')}">
+                            <div class="metric-label">CPU Usage${anomalyNote(pi, 'cpu_percent')}</div>
                             <div class="metric-value">${cpu.usage_percent || 0}%</div>
                             <div class="metric-bar">
                                 <div class="metric-fill fill-cpu" style="width: ${cpu.usage_percent || 0}%"></div>
                             </div>
                         </div>
-                        <div class="metric">
-                            <div class="metric-label">Temperature</div>
+                        <div class="metric ${anomalyClass(pi, 'temperature')}">
+                            <div class="metric-label">Temperature${anomalyNote(pi, 'temperature')}</div>
                             <div class="metric-value ${tempClass}">${temp ? temp + '°C' : 'N/A'}</div>
                             <div class="metric-bar">
                                 <div class="metric-fill fill-temp" style="width: ${temp ? Math.min(temp, 85) / 85 * 100 : 0}%"></div>
                             </div>
                         </div>
-                        <div class="metric">
-                            <div class="metric-label">Memory</div>
+                        <div class="metric ${anomalyClass(pi, 'memory_percent')}">
+                            <div class="metric-label">Memory${anomalyNote(pi, 'memory_percent')}</div>
                             <div class="metric-value">${mem.percent || 0}%</div>
                             <div class="metric-bar">
                                 <div class="metric-fill fill-mem" style="width: ${mem.percent || 0}%"></div>
                             </div>
                         </div>
-                        <div class="metric">
-                            <div class="metric-label">Disk</div>
+                        <div class="metric ${anomalyClass(pi, 'disk_percent')}">
+                            <div class="metric-label">Disk${anomalyNote(pi, 'disk_percent')}</div>
                             <div class="metric-value">${disk.percent || 0}%</div>
                             <div class="metric-bar">
                                 <div class="metric-fill fill-disk" style="width: ${disk.percent || 0}%"></div>
@@ -361,20 +1892,38 @@ MONITORED_HOSTS = [<br>
             `;
         }
 
+        const PAGE_SIZE = 60;
+        let pageLimit = PAGE_SIZE;
+
+        function apiQuery() {
+            // Filters in the page URL (e.g. /?tag=site:garage&sort=-temperature) pass through
+            const params = new URLSearchParams(window.location.search);
+            if (!params.has('sort')) params.set('sort', 'hostname');
+            params.set('limit', pageLimit);
+            return params.toString();
+        }
+
+        function showMore() {
+            pageLimit += PAGE_SIZE;
+            updateDashboard();
+        }
+
         async function updateDashboard() {
             try {
-                const response = await fetch('/api/metrics');
+                const response = await fetch('/api/metrics?' + apiQuery());
                 const data = await response.json();
                 const dashboard = document.getElementById('dashboard');
 
-                if (Object.keys(data).length === 0) {
+                if (data.total === 0 && !window.location.search) {
                     dashboard.innerHTML = showNoHosts();
+                } else if (data.total === 0) {
+                    dashboard.innerHTML = '<p class="no-hosts">No hosts match this filter</p>';
                 } else {
-                    dashboard.innerHTML = Object.values(data)
-                        .sort((a, b) => (a.hostname || '').localeCompare(b.hostname || ''))
-                        .map(createCard)
-                        .join('');
+                    dashboard.innerHTML = data.hosts.map(createCard).join('');
                 }
+                document.getElementById('more').innerHTML = data.total > data.hosts.length
+                    ? `<button onclick="showMore()">Show more (${data.hosts.length} of ${data.total})</button>`
+                    : '';
 
                 document.getElementById('timestamp').textContent =
                     new Date().toLocaleTimeString();
@@ -386,16 +1935,132 @@ MONITORED_HOSTS = [<br>
         // Initial load and periodic refresh
         updateDashboard();
         setInterval(updateDashboard, 5000);
-    </script>
+"""
+
+DASHBOARD_HTML = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>🍓 Pi Monitor</title>
+    <link rel="stylesheet" href="{styles}">
+</head>
+<body>
+    <h1>🍓 Pi Monitor</h1>
+    <p class="subtitle">Real-time Raspberry Pi Fleet Dashboard</p>
+
+    <div id="dashboard" class="grid"></div>
+    <div id="more" class="more"></div>
+    <p class="last-update">Last update: <span id="timestamp">-</span></p>
+
+    <script src="{script}"></script>
 </body>
 </html>"""
 
+# The page itself is revalidated on every load; hashed assets never change
+PAGE_CACHE_CONTROL = "no-cache"
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class StaticAsset:
+    """
+    A page asset encoded to UTF-8 and gzipped once, with a strong ETag per encoding.
+
+    digest is a hash of the content, used in the asset's URL and its ETags.
+    """
+
+    __slots__ = ("content_type", "cache_control", "body", "gzipped", "digest", "etag", "gzip_etag")
+
+    def __init__(self, text, content_type, cache_control):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.body = text.encode("utf-8")
+        # A fixed mtime keeps the bytes identical across restarts (gzip.compress()
+        # only accepts mtime from Python 3.8)
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=9, mtime=0) as f:
+            f.write(self.body)
+        self.gzipped = buffer.getvalue()
+        self.digest = hashlib.sha256(self.body).hexdigest()[:16]
+        self.etag = f'"{self.digest}"'
+        self.gzip_etag = f'"{self.digest}-gzip"'
+
+
+def build_assets():
+    """Return {path: StaticAsset} for the page and its content-hashed stylesheet and script."""
+    styles = StaticAsset(DASHBOARD_CSS, "text/css; charset=utf-8", ASSET_CACHE_CONTROL)
+    script = StaticAsset(DASHBOARD_JS, "text/javascript; charset=utf-8", ASSET_CACHE_CONTROL)
+    styles_path = f"/static/dashboard.{styles.digest}.css"
+    script_path = f"/static/dashboard.{script.digest}.js"
+    html = DASHBOARD_HTML.replace("{styles}", styles_path).replace("{script}", script_path)
+    page = StaticAsset(html, "text/html; charset=utf-8", PAGE_CACHE_CONTROL)
+    return {"/": page, styles_path: styles, script_path: script}
+
+
+def accepts_gzip(accept_encoding):
+    """Return whether an Accept-Encoding header allows a gzip response."""
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        if coding.strip().lower() not in ("gzip", "*"):
+            continue
+        quality = params.strip().lower()
+        if quality.startswith("q="):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def etag_matches(if_none_match, etag):
+    """Return whether an If-None-Match header matches etag (weak comparison)."""
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+# Path -> StaticAsset, built at startup
+ASSETS = build_assets()
+
 
 # =============================================================================
 # HTTP Server
 # =============================================================================
 
 
+class DashboardServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server with a listen backlog sized for many watchers.
+
+    Watchers each hold a request thread, so request threads are started with
+    a THREAD_STACK_SIZE stack. The size is set and restored under
+    thread_start_lock, which every other thread start also takes (see
+    start_thread()), so the poller and resolver threads keep the default.
+    """
+
+    request_queue_size = 128
+
+    def process_request(self, request, client_address):
+        """Start the request's thread with a THREAD_STACK_SIZE stack."""
+        if not THREAD_STACK_SIZE:
+            super().process_request(request, client_address)
+            return
+        # stack_size() applies to every thread started while it is set
+        with thread_start_lock:
+            previous = threading.stack_size(THREAD_STACK_SIZE)
+            try:
+                super().process_request(request, client_address)
+            finally:
+                threading.stack_size(previous)
+
+
 class DashboardHandler(BaseHTTPRequestHandler):
     """HTTP handler for dashboard and API endpoints."""
 
@@ -405,25 +2070,184 @@ class DashboardHandler(BaseHTTPRequestHandler):
 
     def do_GET(self):
         """Handle GET requests."""
-        if self.path == "/":
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(DASHBOARD_HTML.encode("utf-8"))
-
-        elif self.path == "/api/metrics":
-            with data_lock:
-                response = json.dumps(pi_data)
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(response.encode())
+        start = perf_counter()
+        path, _, query = self.path.partition("?")
+        if path == "/" or path.startswith("/static/"):
+            route = "http./" if path == "/" else "http./static"
+            asset = ASSETS.get(path)
+            if asset is None:
+                STATS.incr("http.not_found")
+                self.send_text(404, b"Not Found")
+            else:
+                self.send_asset(asset)
+
+        elif path == "/api/metrics":
+            route = "http./api/metrics"
+            try:
+                spec = parse_fleet_query(query)
+            except ValueError as e:
+                self.send_text(400, str(e).encode())
+            else:
+                self.send_json(self.metrics_body(spec))
+
+        elif path == "/api/watch":
+            route = "http./api/watch"
+            self.send_watch(query)
+
+        elif path == "/api/export":
+            route = "http./api/export"
+            self.send_export(query)
+
+        elif path == "/debug/stats":
+            route = "http./debug/stats"
+            self.send_json(json.dumps(STATS.snapshot(), indent=2).encode())
+
+        elif path == "/debug/profile":
+            route = "http./debug/profile"
+            self.send_profile(query)
 
         else:
-            self.send_response(404)
-            self.send_header("Content-Type", "text/plain")
-            self.end_headers()
-            self.wfile.write(b"Not Found")
+            route = "http.other"
+            STATS.incr("http.not_found")
+            self.send_text(404, b"Not Found")
+        STATS.histogram(route).observe(perf_counter() - start)
+
+    def metrics_body(self, spec):
+        """Return the /api/metrics body: every host, or one page of a fleet query."""
+        if shared_state is not None:
+            if spec is None:
+                return shared_state.read()[1]
+            version, data, index = shared_state.fleet()
+            return fleet_page(index, data, version, spec)
+        with data_lock:
+            if spec is None:
+                return json.dumps(pi_data).encode()
+            return fleet_page(fleet_index, pi_data, fleet_version, spec)
+
+    def send_watch(self, query):
+        """Long-poll for host changes after ?since_version= (see watch())."""
+        if shared_state is not None:
+            self.send_text(503, b"/api/watch is not available with SERVER_PROCESSES")
+            return
+        params = parse_qs(query)
+        host = params.get("host", [None])[0]
+        try:
+            since = params.get("since_version", [None])[0]
+            since = None if since is None else int(since)
+            timeout = float(params.get("timeout", [WATCH_DEFAULT_TIMEOUT])[0])
+        except ValueError:
+            self.send_text(400, b"since_version must be an integer and timeout a number")
+            return
+        timeout = max(0.0, min(timeout, WATCH_MAX_TIMEOUT))
+        try:
+            body = watch(host, since, timeout)
+        except KeyError:
+            self.send_text(404, b"Unknown host")
+        except TooManyWatchers:
+            STATS.incr("watch.rejected")
+            self.send_text(503, b"Too many watchers")
+        else:
+            self.send_json(body)
+
+    def send_export(self, query):
+        """Stream history rows as NDJSON or CSV using chunked transfer encoding."""
+        if shared_state is not None:
+            self.send_text(503, b"history export is not available with SERVER_PROCESSES")
+            return
+        params = parse_qs(query)
+        export_format = params.get("format", ["ndjson"])[0]
+        if export_format not in ("ndjson", "csv"):
+            self.send_text(400, b"format must be ndjson or csv")
+            return
+        try:
+            now = time.time()
+            start = parse_time(params.get("from", [""])[0], now - HISTORY_RETENTION)
+            end = parse_time(params.get("to", [""])[0], now)
+        except ValueError:
+            self.send_text(400, b"from/to must be epoch seconds or ISO 8601")
+            return
+        hosts = [h for value in params.get("hosts", []) for h in value.split(",") if h]
+        if not hosts:
+            with history_lock:
+                hosts = list(history)
+
+        rows = history_rows(hosts, start, end)
+        pieces = format_ndjson(rows) if export_format == "ndjson" else format_csv(rows)
+        content_type = "application/x-ndjson" if export_format == "ndjson" else "text/csv"
+
+        use_chunks = self.request_version != "HTTP/1.0"
+        if use_chunks:
+            self.protocol_version = "HTTP/1.1"
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Connection", "close")
+        if use_chunks:
+            self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.close_connection = True
+
+        try:
+            for chunk in chunked(pieces):
+                if use_chunks:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                else:
+                    self.wfile.write(chunk)
+            if use_chunks:
+                self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            STATS.incr("export.aborted")
+
+    def send_profile(self, query):
+        """Run the sampling profiler and send collapsed stacks, if authorized."""
+        params = parse_qs(query)
+        token = params.get("token", [""])[0] or self.headers.get("X-Debug-Token", "")
+        if not DEBUG_TOKEN or not hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode()):
+            self.send_text(403, b"Forbidden")
+            return
+        try:
+            seconds = float(params.get("seconds", ["5"])[0])
+        except ValueError:
+            self.send_text(400, b"Invalid seconds")
+            return
+        seconds = max(0.0, min(seconds, PROFILE_MAX_SECONDS))
+        self.send_text(200, format_collapsed(sample_stacks(seconds)).encode())
+
+    def send_asset(self, asset):
+        """Send a static asset, gzipped if accepted, or 304 if the client's copy is current."""
+        if accepts_gzip(self.headers.get("Accept-Encoding", "")):
+            body, etag = asset.gzipped, asset.gzip_etag
+        else:
+            body, etag = asset.body, asset.etag
+        current = etag_matches(self.headers.get("If-None-Match", ""), etag)
+        if current:
+            STATS.incr("http.not_modified")
+            self.send_response(304)
+        else:
+            self.send_response(200)
+            self.send_header("Content-Type", asset.content_type)
+            self.send_header("Content-Length", str(len(body)))
+            if body is asset.gzipped:
+                self.send_header("Content-Encoding", "gzip")
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", asset.cache_control)
+        self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        if not current:
+            self.wfile.write(body)
+
+    def send_text(self, status, body):
+        """Send a plain text response."""
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, body):
+        """Send a 200 response with a JSON body."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
 
 
 # =============================================================================
@@ -469,23 +2293,44 @@ def main():
             print(f"  • {host}")
         print()
 
+    if STATE_FILE:
+        restored = load_snapshot(STATE_FILE)
+        if restored:
+            print(f"Restored {restored} host(s) from {STATE_FILE}")
+            print()
+
     print("=" * 50)
     print("Press Ctrl+C to stop")
     print()
 
+    # Stop cleanly (and write a final snapshot) when systemd stops the service
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    server = DashboardServer(("0.0.0.0", DASHBOARD_PORT), DashboardHandler)
+
+    if SERVER_PROCESSES > 0:
+        print(f"Serving from {SERVER_PROCESSES} process(es)")
+        try:
+            run_multiprocess(server)
+        except KeyboardInterrupt:
+            print("\n👋 Shutting down...")
+        server.server_close()
+        if STATE_FILE and MONITORED_HOSTS:
+            save_snapshot(STATE_FILE)
+        return
+
     # Start background polling thread
     if MONITORED_HOSTS:
-        poller = threading.Thread(target=poll_all_hosts, daemon=True)
-        poller.start()
-
-    # Start web server
-    server = HTTPServer(("0.0.0.0", DASHBOARD_PORT), DashboardHandler)
+        start_thread(threading.Thread(target=poll_all_hosts, daemon=True))
 
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print("\n👋 Shutting down...")
+        stop_event.set()
         server.shutdown()
+        if STATE_FILE and MONITORED_HOSTS:
+            save_snapshot(STATE_FILE)
 
 
 if __name__ == "__main__":
@@ -5,6 +5,8 @@
 # Fixtures defined here are automatically available to all test modules.
 
 import sys
+import threading
+from http.server import ThreadingHTTPServer
 from pathlib import Path
 
 import pytest
@@ -69,6 +71,23 @@ def mock_thermal_zone(tmp_path):
     return temp_file
 
 
+@pytest.fixture
+def serve():
+    """Start HTTP servers for handler classes on ephemeral ports; yields a factory."""
+    servers = []
+
+    def start(handler_class, server_class=ThreadingHTTPServer):
+        server = server_class(("127.0.0.1", 0), handler_class)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
 # =============================================================================
 # Configuration
 # =============================================================================
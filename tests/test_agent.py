@@ -3,8 +3,25 @@
 #
 # Tests for the pi_monitor_agent module.
 
+import functools
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
 import pytest
 
+from agent import pi_monitor_agent as agent
+from agent import pi_monitor_agent_py2 as lean
+
 
 class TestAgentMetricsCollection:
     """Tests for metrics collection functionality."""
@@ -74,3 +91,968 @@ class TestProcFilesParsing:
         assert mock_thermal_zone.exists()
         temp = int(mock_thermal_zone.read_text().strip())
         assert temp == 45000  # 45.0 degrees in millidegrees
+
+
+class TestCollectors:
+    """Tests for the collectors reading from mock kernel interfaces."""
+
+    @pytest.mark.unit
+    def test_get_cpu_temp(self, monkeypatch, mock_thermal_zone):
+        """Test temperature parsing from a thermal zone file."""
+        monkeypatch.setattr(agent, "THERMAL_ZONE_TEMP", str(mock_thermal_zone))
+        assert agent.get_cpu_temp() == 45.0
+
+    @pytest.mark.unit
+    def test_get_cpu_temp_missing(self, monkeypatch, tmp_path):
+        """Test that a missing thermal zone yields None."""
+        monkeypatch.setattr(agent, "THERMAL_ZONE_TEMP", str(tmp_path / "missing"))
+        assert agent.get_cpu_temp() is None
+
+    @pytest.mark.unit
+    def test_get_cpu_usage_delta(self, monkeypatch, mock_proc_stat):
+        """Test CPU usage computed from the delta between two /proc/stat reads."""
+        monkeypatch.setattr(agent, "PROC_STAT", str(mock_proc_stat))
+        monkeypatch.setattr(agent.get_cpu_usage, "prev", (50000, 62650), raising=False)
+        # 12650 jiffies since the previous read, none of them idle
+        mock_proc_stat.write_text("cpu  22650 500 2000 50000 100 0 50 0 0 0\n")
+        assert agent.get_cpu_usage() == 100.0
+
+    @pytest.mark.unit
+    def test_get_memory_info(self, monkeypatch, mock_proc_meminfo):
+        """Test memory figures parsed from /proc/meminfo."""
+        monkeypatch.setattr(agent, "PROC_MEMINFO", str(mock_proc_meminfo))
+        memory = agent.get_memory_info()
+        assert memory["total_mb"] == 3906
+        assert memory["available_mb"] == 1953
+        assert memory["percent"] == 50.0
+
+    @pytest.mark.unit
+    def test_use_fs_root_reads_recorded_tree(self):
+        """Test that every kernel interface is read from under FS_ROOT."""
+        root = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "fixtures", "pi4")
+        previous = agent.FS_ROOT
+
+        agent.use_fs_root(root)
+        try:
+            assert agent.PROC_STAT == os.path.join(root, "proc/stat")
+            assert agent.get_pi_model() == "Raspberry Pi 4 Model B Rev 1.4"
+            assert agent.get_throttled()["under_voltage"] == {"now": False, "since_boot": False}
+        finally:
+            agent.use_fs_root(previous)
+        assert agent.PROC_STAT == "/proc/stat"
+
+    @pytest.mark.unit
+    def test_use_fs_root_with_sampling_disabled(self, monkeypatch):
+        """Test that switching roots works with SAMPLE_INTERVAL = 0."""
+        monkeypatch.setattr(agent, "SAMPLE_INTERVAL", 0)
+        try:
+            agent.use_fs_root(agent.FS_ROOT)
+            assert agent.collect_metrics()["memory"]["total_mb"] > 0
+        finally:
+            monkeypatch.undo()
+            agent.SAMPLER.reset()
+
+    @pytest.mark.unit
+    def test_encode_metrics(self):
+        """Test that encoded metrics are JSON bytes."""
+        assert agent.encode_metrics({"hostname": "test-pi"}) == b'{\n  "hostname": "test-pi"\n}'
+
+
+class TestSelfInstrumentation:
+    """Tests for histograms, counters and /debug/stats."""
+
+    @pytest.mark.unit
+    def test_histogram_buckets_and_quantiles(self):
+        """Test bucket placement and bucket-bound quantile estimates."""
+        histogram = agent.Histogram()
+        for _ in range(98):
+            histogram.observe(0.0002)
+        histogram.observe(0.02)
+        histogram.observe(20.0)
+
+        snapshot = histogram.snapshot()
+        assert snapshot["count"] == 100
+        assert snapshot["buckets"]["0.00025"] == 98
+        assert snapshot["buckets"]["+Inf"] == 1
+        assert snapshot["p50_ms"] == 0.25
+        assert snapshot["p99_ms"] == 25.0
+        assert snapshot["max_ms"] == 20000.0
+
+    @pytest.mark.unit
+    def test_collector_runs_are_timed(self):
+        """Test that every collector run records one sample."""
+        before = agent.STATS.histogram("collector.memory").snapshot()["count"]
+        agent.collect_metrics()
+        after = agent.STATS.histogram("collector.memory").snapshot()["count"]
+        assert after == before + 1
+
+    @pytest.mark.integration
+    def test_debug_stats_endpoint(self, serve):
+        """Test that /debug/stats reports request latency per route."""
+        base = serve(agent.MetricsHandler)
+        urlopen(f"{base}/metrics").read()
+        with urlopen(f"{base}/debug/stats") as response:
+            stats = json.loads(response.read())
+
+        assert stats["histograms"]["http./metrics"]["count"] >= 1
+        assert "collector.cpu.temperature" in stats["histograms"]
+        assert stats["collectors"]["disk"] == {
+            "interval": 30,
+            "cost": "expensive",
+            "stale": False,
+            "overruns": 0,
+            "quarantined_for": 0.0,
+        }
+
+
+class TestProfiling:
+    """Tests for the /debug/profile sampling profiler."""
+
+    @pytest.mark.unit
+    def test_sample_stacks_sees_other_threads(self):
+        """Test that sampling captures a busy background thread by name."""
+        stop = threading.Event()
+        worker = threading.Thread(target=stop.wait, name="busy-worker")
+        worker.start()
+        try:
+            counts = agent.sample_stacks(0.05, interval=0.001)
+        finally:
+            stop.set()
+            worker.join()
+
+        stacks = agent.format_collapsed(counts).splitlines()
+        assert any(line.startswith("busy-worker;") for line in stacks)
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in stacks)
+
+    @pytest.mark.integration
+    def test_profile_requires_token(self, serve, monkeypatch):
+        """Test that profiling is refused without the configured token."""
+        monkeypatch.setattr(agent, "DEBUG_TOKEN", "s3cret")
+        base = serve(agent.MetricsHandler)
+
+        with pytest.raises(HTTPError) as excinfo:
+            urlopen(f"{base}/debug/profile?seconds=0&token=wrong")
+        assert excinfo.value.code == 403
+
+        with urlopen(f"{base}/debug/profile?seconds=0.05&token=s3cret") as response:
+            assert response.status == 200
+            assert response.headers["Content-Type"] == "text/plain"
+
+    @pytest.mark.integration
+    def test_profile_disabled_without_token(self, serve):
+        """Test that profiling is disabled while DEBUG_TOKEN is empty."""
+        base = serve(agent.MetricsHandler)
+        with pytest.raises(HTTPError) as excinfo:
+            urlopen(f"{base}/debug/profile?seconds=0&token=")
+        assert excinfo.value.code == 403
+
+
+class TestCollectorRegistry:
+    """Tests for the collector registry and per-collector cadences."""
+
+    @pytest.fixture(autouse=True)
+    def isolated_registry(self, monkeypatch):
+        """Give each test its own copy of the registries."""
+        monkeypatch.setattr(agent, "COLLECTORS", dict(agent.COLLECTORS))
+        monkeypatch.setattr(agent, "INFO_COLLECTORS", dict(agent.INFO_COLLECTORS))
+        monkeypatch.setattr(agent, "_selections", {})
+
+    @pytest.mark.unit
+    def test_collector_reruns_only_when_due(self):
+        """Test that a collector's value is reused within its interval."""
+        calls = []
+        agent.register_collector("custom.calls", lambda: calls.append(1) or len(calls), 60)
+
+        assert agent.collect_metrics()["custom"]["calls"] == 1
+        assert agent.collect_metrics()["custom"]["calls"] == 1
+
+        agent.invalidate_collectors()
+        assert agent.collect_metrics()["custom"]["calls"] == 2
+
+    @pytest.mark.unit
+    def test_info_collectors_run_once(self):
+        """Test that info collectors are computed once and kept off /metrics."""
+        calls = []
+        agent.register_collector("serial", lambda: calls.append(1) or "abc123", info=True)
+
+        assert agent.collect_info()["serial"] == "abc123"
+        assert agent.collect_info()["serial"] == "abc123"
+        assert len(calls) == 1
+        assert "serial" not in agent.collect_metrics()
+        assert agent.collect_info()["kernel"]
+
+    @pytest.mark.unit
+    def test_load_plugins(self, tmp_path):
+        """Test that plugins register collectors without editing the agent."""
+        (tmp_path / "answer.py").write_text(
+            "def register(agent):\n"
+            "    agent.register_collector('custom.answer', lambda: 42, interval=10)\n"
+        )
+        (tmp_path / "broken.py").write_text("raise RuntimeError('boom')\n")
+        (tmp_path / "notes.txt").write_text("ignored")
+
+        assert agent.load_plugins(str(tmp_path)) == ["answer.py"]
+        assert agent.collect_metrics()["custom"]["answer"] == 42
+        assert agent.load_plugins(str(tmp_path / "missing")) == []
+
+    @pytest.mark.integration
+    def test_info_endpoint(self, serve):
+        """Test that /info serves host metadata."""
+        base = serve(agent.MetricsHandler)
+        with urlopen(f"{base}/info") as response:
+            info = json.loads(response.read())
+        assert info["hostname"] == agent.HOSTNAME
+        assert set(info) >= {"hostname", "model", "kernel"}
+
+
+class TestFieldSelection:
+    """Tests for /metrics?fields= selective collection."""
+
+    @pytest.fixture(autouse=True)
+    def isolated_registry(self, monkeypatch):
+        """Give each test its own copy of the registries and selection cache."""
+        monkeypatch.setattr(agent, "COLLECTORS", dict(agent.COLLECTORS))
+        monkeypatch.setattr(agent, "_selections", {})
+
+    @pytest.mark.unit
+    def test_select_fields_is_cached_per_query(self):
+        """Test that a query string is parsed once."""
+        first = agent.select_fields("fields=cpu.temperature")
+        assert agent.select_fields("fields=cpu.temperature") is first
+        assert agent.select_fields("") is None
+
+    @pytest.mark.unit
+    def test_prefix_and_subfield_selection(self):
+        """Test group prefixes and keys inside a collector's value."""
+        metrics = agent.collect_metrics(agent.select_fields("fields=cpu,memory.percent"))
+
+        assert set(metrics) == {"hostname", "timestamp", "cpu", "memory"}
+        assert set(metrics["cpu"]) == {"usage_percent", "temperature", "load_average"}
+        assert set(metrics["memory"]) == {"percent"}
+
+    @pytest.mark.unit
+    def test_unselected_collectors_do_not_run(self):
+        """Test that a narrow scrape skips collectors it did not ask for."""
+        calls = []
+        agent.register_collector("custom.expensive", lambda: calls.append(1))
+
+        agent.collect_metrics(agent.select_fields("fields=cpu.temperature"))
+        assert calls == []
+        agent.collect_metrics()
+        assert calls == [1]
+
+    @pytest.mark.unit
+    def test_unknown_field(self):
+        """Test that unknown fields are rejected."""
+        with pytest.raises(ValueError, match="Unknown field: cpu.fan"):
+            agent.select_fields("fields=cpu.fan")
+
+    @pytest.mark.integration
+    def test_fields_query_over_http(self, serve):
+        """Test narrow scrapes and the 400 for unknown fields over HTTP."""
+        base = serve(agent.MetricsHandler)
+        with urlopen(f"{base}/metrics?fields=cpu.temperature,cpu.load_average") as response:
+            metrics = json.loads(response.read())
+        assert set(metrics["cpu"]) == {"temperature", "load_average"}
+        assert "disk" not in metrics
+
+        with pytest.raises(HTTPError) as excinfo:
+            urlopen(f"{base}/metrics?fields=nope")
+        assert excinfo.value.code == 400
+
+
+class TestNetworkIdentity:
+    """Tests for kernel address enumeration and change-driven refresh."""
+
+    @pytest.mark.unit
+    def test_pick_primary_prefers_default_route(self):
+        """Test that the default route's IPv4 address wins on a multi-homed host."""
+        addresses = {
+            "lo": ["127.0.0.1", "::1"],
+            "wlan0": ["192.168.1.20", "fe80::1"],
+            "eth0": ["10.0.0.5", "fd00::5"],
+        }
+        assert agent.pick_primary_address(addresses, "eth0") == "10.0.0.5"
+        assert agent.pick_primary_address(addresses, "wlan0") == "192.168.1.20"
+
+    @pytest.mark.unit
+    def test_pick_primary_without_default_route(self):
+        """Test air-gapped hosts still report a real address."""
+        assert agent.pick_primary_address({"eth0": ["169.254.3.4"]}, None) == "169.254.3.4"
+        assert agent.pick_primary_address({"eth0": ["fe80::1", "fd00::7"]}, None) == "fd00::7"
+        assert agent.pick_primary_address({"lo": ["127.0.0.1", "::1"]}, None) == "unknown"
+
+    @pytest.mark.unit
+    def test_default_route_interface(self, monkeypatch, tmp_path):
+        """Test picking the lowest-metric default route from /proc/net/route."""
+        route = tmp_path / "route"
+        route.write_text(
+            "Iface\tDestination\tGateway\tFlags\tRefCnt\tUse\tMetric\tMask\n"
+            "wlan0\t00000000\t0101A8C0\t0003\t0\t0\t303\t00000000\n"
+            "eth0\t00000000\t0101A8C0\t0003\t0\t0\t202\t00000000\n"
+            "eth0\t0001A8C0\t00000000\t0001\t0\t0\t202\t00FFFFFF\n"
+        )
+        monkeypatch.setattr(agent, "PROC_NET_ROUTE", str(route))
+        assert agent.default_route_interface() == "eth0"
+
+        route.write_text("Iface\tDestination\tGateway\tFlags\tRefCnt\tUse\tMetric\tMask\n")
+        assert agent.default_route_interface() is None
+
+    @pytest.mark.unit
+    def test_refresh_only_on_change_signal(self, monkeypatch):
+        """Test that addresses are re-enumerated only when the kernel signals a change."""
+
+        class FakeWatch:
+            pending = []
+
+            def recv(self, size):
+                if not self.pending:
+                    raise BlockingIOError
+                return self.pending.pop()
+
+        calls = []
+        monkeypatch.setattr(agent, "open_change_watch", FakeWatch)
+        monkeypatch.setattr(
+            agent, "kernel_addresses", lambda: calls.append(1) or {"eth0": ["10.0.0.5"]}
+        )
+        identity = agent.NetworkIdentity()
+
+        assert identity.current().primary == "10.0.0.5"
+        identity.current()
+        assert len(calls) == 1
+
+        FakeWatch.pending.append(b"RTM_NEWADDR")
+        identity.current()
+        assert len(calls) == 2
+
+
+class TestSingleFlight:
+    """Tests for coalescing concurrent /metrics requests."""
+
+    @pytest.mark.unit
+    def test_concurrent_callers_share_one_call(self):
+        """Test that callers arriving during a computation get its result."""
+        flight = agent.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return object()
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do("q", compute)))
+        leader.start()
+        started.wait(5)
+        followers = [
+            threading.Thread(target=lambda: results.append(flight.do("q", compute)))
+            for _ in range(4)
+        ]
+        for thread in followers:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join()
+
+        assert calls == [1]
+        assert len(results) == 5
+        assert all(result is results[0] for result in results)
+
+    @pytest.mark.unit
+    def test_window_and_keys(self, monkeypatch):
+        """Test reuse within the window, expiry after it and separate keys."""
+        monkeypatch.setattr(agent, "COALESCE_WINDOW", 0.05)
+        flight = agent.SingleFlight()
+        counter = iter(range(100))
+
+        first = flight.do("a", lambda: next(counter))
+        assert flight.do("a", lambda: next(counter)) == first
+        assert flight.do("b", lambda: next(counter)) != first
+        time.sleep(0.06)
+        assert flight.do("a", lambda: next(counter)) != first
+
+    @pytest.mark.unit
+    def test_errors_are_shared_and_not_cached(self, monkeypatch):
+        """Test that a failed computation raises for its callers only."""
+        monkeypatch.setattr(agent, "COALESCE_WINDOW", 0)
+        flight = agent.SingleFlight()
+
+        def fail():
+            raise OSError("boom")
+
+        with pytest.raises(OSError):
+            flight.do("a", fail)
+        assert flight.do("a", lambda: 1) == 1
+
+    @pytest.mark.unit
+    def test_collector_runs_are_serialized(self):
+        """Test that concurrent scrapes run a due collector once."""
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.05)
+            return len(calls)
+
+        collector = agent.Collector("slow", slow, interval=10)
+        now = time.monotonic()
+        threads = [
+            threading.Thread(target=agent.refresh, args=([collector], now)) for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert calls == [1]
+        assert collector.value == 1
+
+    @pytest.mark.integration
+    def test_threaded_server_coalesces(self, monkeypatch):
+        """Test that parallel scrapes of a threaded agent share one collection."""
+        monkeypatch.setattr(agent, "METRICS_FLIGHT", agent.SingleFlight())
+        server = ThreadingHTTPServer(("127.0.0.1", 0), agent.MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        before = agent.STATS.histogram("collect_metrics").snapshot()["count"]
+        bodies = []
+        try:
+            threads = [
+                threading.Thread(target=lambda: bodies.append(urlopen(f"{base}/metrics").read()))
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert len(set(bodies)) == 1 and len(bodies) == 8
+        assert agent.STATS.histogram("collect_metrics").snapshot()["count"] - before <= 2
+
+
+class TestBackgroundSampling:
+    """Tests for the rolling averages fed by the background sampler."""
+
+    @pytest.mark.unit
+    def test_rolling_averages_match_naive_means(self):
+        """Test running-sum averages against recomputed means, across ring wraps."""
+        lengths = [1, 4, 10]
+        rolling = agent.RollingAverages(lengths)
+        assert rolling.averages() == [None, None, None]
+
+        samples = []
+        for i in range(37):
+            value = (i * 7919) % 101 / 3
+            rolling.add(value)
+            samples.append(value)
+            expected = [sum(samples[-n:]) / len(samples[-n:]) for n in lengths]
+            assert rolling.averages() == pytest.approx(expected)
+
+    @pytest.mark.unit
+    def test_sampler_series(self, monkeypatch, mock_proc_stat, mock_proc_meminfo, tmp_path):
+        """Test that samples of each series land in the configured windows."""
+        monkeypatch.setattr(agent, "PROC_STAT", str(mock_proc_stat))
+        monkeypatch.setattr(agent, "PROC_MEMINFO", str(mock_proc_meminfo))
+        monkeypatch.setattr(agent, "THERMAL_ZONE_TEMP", str(tmp_path / "missing"))
+        monkeypatch.setattr(agent, "SAMPLE_INTERVAL", 1)
+        monkeypatch.setattr(agent, "AVERAGE_WINDOWS", (1, 10))
+        sampler = agent.Sampler()
+        assert sampler.averages() is None
+        sampler.reset()
+
+        sampler.sample_once()  # First /proc/stat read only primes the delta
+        mock_proc_stat.write_text("cpu  10100 500 2000 50100 100 0 50 0 0 0\n")
+        sampler.sample_once()  # 50% busy
+        mock_proc_stat.write_text("cpu  10200 500 2000 50100 100 0 50 0 0 0\n")
+        sampler.sample_once()  # 100% busy
+
+        averages = sampler.averages()
+        assert averages["cpu_percent"] == {"1s": 100.0, "10s": 75.0}
+        assert averages["memory_percent"] == {"1s": 50.0, "10s": 50.0}
+        assert averages["temperature"] == {"1s": None, "10s": None}
+
+    @pytest.mark.integration
+    def test_sampler_thread(self, monkeypatch):
+        """Test that the sampler thread fills the averages served on /metrics."""
+        monkeypatch.setattr(agent, "SAMPLE_INTERVAL", 0.01)
+        sampler = agent.Sampler()
+        monkeypatch.setitem(
+            agent.COLLECTORS, "averages", agent.Collector("averages", sampler.averages)
+        )
+        sampler.start()
+        try:
+            time.sleep(0.1)
+        finally:
+            sampler.stop()
+
+        assert sampler.series["memory_percent"].count >= 3
+        assert set(agent.collect_metrics()["averages"]["memory_percent"]) == {
+            "1s",
+            "10s",
+            "60s",
+            "300s",
+        }
+
+
+class TestPeaks:
+    """Tests for per-consumer peaks and throttling between scrapes."""
+
+    @pytest.fixture
+    def sysfs(self, monkeypatch, tmp_path):
+        """Point the sampler at a fake /proc/stat, two thermal zones and two cores."""
+        stat = tmp_path / "stat"
+        stat.write_text("cpu  0 0 0 100 0 0 0 0 0 0\ncpu0 0 0 0 50 0 0 0 0 0 0\n")
+        for zone in ("thermal_zone0", "thermal_zone1"):
+            (tmp_path / zone).mkdir()
+        for core in ("cpu0", "cpu1"):
+            (tmp_path / core).mkdir()
+        monkeypatch.setattr(agent, "PROC_STAT", str(stat))
+        monkeypatch.setattr(agent, "THERMAL_ZONES_GLOB", str(tmp_path / "thermal_zone*" / "temp"))
+        monkeypatch.setattr(agent, "CPUFREQ_GLOB", str(tmp_path / "cpu[0-9]*" / "freq"))
+        monkeypatch.setattr(agent, "THROTTLED_PATH", str(tmp_path / "get_throttled"))
+
+        def write(zones, freqs, throttled=None, stat_text=None):
+            for zone, value in zip(("thermal_zone0", "thermal_zone1"), zones):
+                (tmp_path / zone / "temp").write_text(f"{value}\n")
+            for core, value in zip(("cpu0", "cpu1"), freqs):
+                (tmp_path / core / "freq").write_text(f"{value}\n")
+            if throttled is not None:
+                (tmp_path / "get_throttled").write_text(throttled)
+            if stat_text is not None:
+                stat.write_text(stat_text)
+
+        write((50000, 52000), (1500000, 1500000))
+        return write
+
+    @pytest.mark.unit
+    def test_decode_throttled(self):
+        """Test decoding of current and since-boot throttling bits."""
+        flags = agent.decode_throttled(0x50005)
+        assert flags["under_voltage"] == {"now": True, "since_boot": True}
+        assert flags["throttled"] == {"now": True, "since_boot": True}
+        assert flags["freq_capped"] == {"now": False, "since_boot": False}
+
+    @pytest.mark.unit
+    def test_get_throttled_missing(self, monkeypatch, tmp_path):
+        """Test that systems without the firmware interface report None."""
+        monkeypatch.setattr(agent, "THROTTLED_PATH", str(tmp_path / "missing"))
+        assert agent.get_throttled() is None
+
+    @pytest.mark.unit
+    def test_peaks_since_previous_scrape(self, sysfs):
+        """Test that a short spike between scrapes is captured and then reset."""
+        sampler = agent.Sampler()
+        sampler.reset()
+        assert sampler.peaks("dash")["samples"] == 0
+
+        sampler.sample_once()
+        sysfs(
+            (81000, 60000),
+            (600000, 1500000),
+            throttled="4",
+            stat_text="cpu  50 0 0 150 0 0 0 0 0 0\ncpu0 50 0 0 50 0 0 0 0 0 0\n",
+        )
+        sampler.sample_once()
+        sysfs((50000, 52000), (1500000, 1500000), throttled="0")
+        sampler.sample_once()
+
+        peaks = sampler.peaks("dash")
+        assert peaks["samples"] == 3
+        assert peaks["temperature"]["max"] == 81.0
+        assert peaks["temperature"]["min"] == 50.0
+        assert peaks["cpu_freq_mhz"]["min"] == 600.0
+        assert peaks["cpu_percent"]["max"] == 100.0
+        assert peaks["throttled"]["throttled"]["now"] is True
+
+        assert sampler.peaks("dash")["samples"] == 0
+
+    @pytest.mark.unit
+    def test_consumers_are_independent(self, sysfs, monkeypatch):
+        """Test that each consumer has its own window and old ones are evicted."""
+        monkeypatch.setattr(agent, "MAX_CONSUMERS", 2)
+        sampler = agent.Sampler()
+        sampler.reset()
+        sampler.peaks("a")
+        sampler.peaks("b")
+        sampler.sample_once()
+        assert sampler.peaks("a")["samples"] == 1
+        sampler.sample_once()
+        assert sampler.peaks("a")["samples"] == 1
+        assert sampler.peaks("b")["samples"] == 2
+
+        sampler.peaks("c")  # Evicts "a", the least recently read
+        assert list(sampler.consumers) == ["b", "c"]
+
+    @pytest.mark.unit
+    def test_scrape_metrics_reports_peaks(self, monkeypatch):
+        """Test which scrapes include peaks."""
+        sampler = agent.Sampler()
+        sampler.reset()
+        monkeypatch.setattr(agent, "SAMPLER", sampler)
+        monkeypatch.setattr(agent, "_selections", {})
+
+        assert "peaks" in json.loads(agent.scrape_metrics("", None))
+        narrow = "fields=cpu.temperature"
+        selection = agent.select_fields(narrow)
+        assert "peaks" not in json.loads(agent.scrape_metrics(narrow, selection))
+        query = narrow + "&consumer=prom"
+        assert "peaks" in json.loads(agent.scrape_metrics(query, agent.select_fields(query)))
+        assert set(sampler.consumers) == {"default", "prom"}
+
+
+class TestCollectorWatchdog:
+    """Tests for collector time budgets, stale values and quarantine."""
+
+    @pytest.fixture
+    def watchdog(self, monkeypatch):
+        """Use a fresh watchdog with short budgets; release hung getters afterwards."""
+        monkeypatch.setattr(agent, "WATCHDOG", agent.Watchdog())
+        monkeypatch.setattr(agent, "COLLECTOR_BUDGETS", {"cheap": 0.05, "expensive": 0.1})
+        release = threading.Event()
+        yield release
+        release.set()
+
+    @staticmethod
+    def collect(collector, now):
+        """Refresh collector as collect_metrics() does and return its value."""
+        agent.refresh([collector], now)
+        return collector.value
+
+    @staticmethod
+    def hanging(release):
+        """Return a getter that answers 1 once, then blocks until release is set."""
+        calls = []
+
+        def getter():
+            calls.append(1)
+            if len(calls) > 1:
+                release.wait()
+            return len(calls)
+
+        getter.calls = calls
+        return getter
+
+    @pytest.mark.unit
+    def test_overrun_serves_stale_value_and_quarantines(self, watchdog):
+        """Test that a hung getter is abandoned within budget and keeps its last value."""
+        getter = self.hanging(watchdog)
+        collector = agent.Collector("mount", getter)
+        now = time.monotonic()
+        assert self.collect(collector, now) == 1
+
+        start = time.perf_counter()
+        assert self.collect(collector, now + 1) == 1
+        assert time.perf_counter() - start < 0.5
+        assert collector.stale
+        assert collector.overruns == 1
+        assert collector.quarantined_until == now + 1 + agent.QUARANTINE_BASE
+
+        # Quarantined and still stuck: skipped without calling the getter again
+        assert self.collect(collector, now + 2) == 1
+        assert len(getter.calls) == 2
+
+        watchdog.set()
+        deadline = time.monotonic() + 2
+        while collector.running:
+            assert time.monotonic() < deadline
+            time.sleep(0.005)
+        assert collector.value == 2  # The late result is kept
+        assert not collector.stale
+
+    @pytest.mark.unit
+    def test_quarantine_backs_off_exponentially(self):
+        """Test that consecutive overruns double the quarantine up to QUARANTINE_MAX."""
+        collector = agent.Collector("mount", lambda: 1)
+        lengths = []
+        for _ in range(8):
+            collector.overrun(100.0)
+            lengths.append(collector.quarantined_until - 100.0)
+
+        base = agent.QUARANTINE_BASE
+        assert lengths[:3] == [base, base * 2, base * 4]
+        assert lengths[-1] == agent.QUARANTINE_MAX
+
+    @pytest.mark.unit
+    def test_hung_collector_does_not_stall_collection(self, watchdog, monkeypatch):
+        """Test that other collectors still run and the hung field is listed as stale."""
+        getter = self.hanging(watchdog)
+        collectors = {"mount": agent.Collector("mount", getter)}
+        for name, collector in agent.COLLECTORS.items():
+            collectors[name] = agent.Collector(name, collector.func, collector.interval)
+        monkeypatch.setattr(agent, "COLLECTORS", collectors)
+        agent.get_cpu_usage()  # Prime the delta so the 0.1s warm-up sleep is excluded
+        agent.collect_metrics()
+
+        start = time.perf_counter()
+        metrics = agent.collect_metrics()
+
+        assert time.perf_counter() - start < 0.5
+        assert metrics["stale"] == ["mount"]
+        assert metrics["mount"] == 1
+        assert metrics["memory"]["total_mb"] > 0
+        assert "stale" not in agent.collect_metrics(agent.select_fields("fields=memory"))
+
+    @pytest.mark.unit
+    def test_getter_errors_mark_only_their_field_stale(self, watchdog, monkeypatch):
+        """Test that a raising getter keeps its last value and the rest still collects."""
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) > 1:
+                raise FileNotFoundError("/sys/kernel/debug/gpu_mem")
+            return 64
+
+        collectors = {"gpu_mem": agent.Collector("gpu_mem", flaky, interval=60)}
+        collectors["memory"] = agent.Collector("memory", agent.get_memory_info)
+        monkeypatch.setattr(agent, "COLLECTORS", collectors)
+        errors = agent.STATS.counters.get("collector.errors", 0)
+        now = time.monotonic()
+
+        assert self.collect(collectors["gpu_mem"], now) == 64
+        assert self.collect(collectors["gpu_mem"], now + 60) == 64
+        assert collectors["gpu_mem"].stale
+        assert agent.STATS.counters["collector.errors"] == errors + 1
+
+        collectors["gpu_mem"].updated = None  # Due again: the getter raises again
+        metrics = agent.collect_metrics()
+        assert metrics["gpu_mem"] == 64
+        assert metrics["stale"] == ["gpu_mem"]
+        assert metrics["memory"]["total_mb"] > 0
+        assert agent.collect_metrics()["stale"] == ["gpu_mem"]  # Not retried before its interval
+        assert len(calls) == 3
+
+
+class TestAgentServer:
+    """Tests for the pooled keep-alive HTTP server."""
+
+    @staticmethod
+    def port(base):
+        """Return the port of a base URL from the serve fixture."""
+        return int(base.rsplit(":", 1)[1])
+
+    @pytest.mark.integration
+    def test_requests_share_one_connection(self, serve):
+        """Test that HTTP/1.1 clients can send several requests over one connection."""
+        base = serve(agent.MetricsHandler, agent.AgentServer)
+        connection = http.client.HTTPConnection("127.0.0.1", self.port(base), timeout=5)
+        try:
+            for path in ("/metrics", "/info", "/metrics?fields=memory"):
+                connection.request("GET", path)
+                response = connection.getresponse()
+                body = response.read()
+                assert response.status == 200
+                assert not response.will_close
+                assert json.loads(body)["hostname"] == agent.HOSTNAME
+                sock = connection.sock
+            assert connection.sock is sock
+        finally:
+            connection.close()
+
+    @pytest.mark.integration
+    def test_idle_clients_do_not_hold_workers(self, serve):
+        """Test that connections sending nothing do not block scrapes."""
+        base = serve(agent.MetricsHandler, functools.partial(agent.AgentServer, workers=1))
+        idle = [socket.create_connection(("127.0.0.1", self.port(base))) for _ in range(4)]
+        try:
+            start = time.perf_counter()
+            with urlopen(f"{base}/info", timeout=5) as response:
+                assert response.status == 200
+            assert time.perf_counter() - start < 1
+        finally:
+            for sock in idle:
+                sock.close()
+
+    @pytest.mark.integration
+    def test_stalled_requests_end_within_dashboard_timeout(self, serve):
+        """Test that clients stalled mid-request delay a scrape by less than 3 seconds."""
+        base = serve(agent.MetricsHandler, functools.partial(agent.AgentServer, workers=2))
+        stalled = [socket.create_connection(("127.0.0.1", self.port(base))) for _ in range(2)]
+        try:
+            for sock in stalled:
+                sock.sendall(b"GET /metrics HTTP/1.1\r\n")  # Never finished
+            time.sleep(0.1)  # Both now hold a worker
+            start = time.perf_counter()
+            with urlopen(f"{base}/info", timeout=5) as response:
+                assert response.status == 200
+            assert time.perf_counter() - start < 3  # fetch_metrics() gives up after 3
+        finally:
+            for sock in stalled:
+                sock.close()
+
+    @pytest.mark.integration
+    def test_idle_connections_time_out(self, serve, monkeypatch):
+        """Test that a connection idle for KEEPALIVE_TIMEOUT is closed by the server."""
+        monkeypatch.setattr(agent, "KEEPALIVE_TIMEOUT", 0.1)
+        base = serve(agent.MetricsHandler, agent.AgentServer)
+        sock = socket.create_connection(("127.0.0.1", self.port(base)))
+        sock.settimeout(5)
+        try:
+            assert sock.recv(1) == b""  # Closed by the server
+        finally:
+            sock.close()
+
+    @pytest.mark.integration
+    def test_worker_count_bounds_concurrency(self, serve):
+        """Test that no more than `workers` requests are served at once."""
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        class SlowHandler(agent.MetricsHandler):
+            def do_GET(self):
+                with lock:
+                    active.append(1)
+                    peak.append(len(active))
+                time.sleep(0.05)
+                with lock:
+                    active.pop()
+                self.send_text(200, b"ok")
+
+        base = serve(SlowHandler, functools.partial(agent.AgentServer, workers=2))
+        threads = [
+            threading.Thread(target=lambda: urlopen(base, timeout=5).read()) for _ in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(peak) == 6
+        assert max(peak) == 2
+
+
+class TestLeanAgent:
+    """Tests for the minimal-footprint Python 2/3 agent."""
+
+    @pytest.fixture
+    def lean_port(self):
+        """Serve the lean agent on an ephemeral loopback port and return the port."""
+        server = lean.AgentServer(("127.0.0.1", 0), workers=2)
+        yield server.server_address[1]
+        server.stop()
+
+    @pytest.mark.unit
+    def test_render_metrics_is_valid_json(self):
+        """Test that the templated body parses into the documented response shape."""
+        metrics = json.loads(lean.render_metrics())
+
+        assert metrics["hostname"] == lean.HOSTNAME
+        assert set(metrics) == {
+            "hostname",
+            "ip",
+            "model",
+            "timestamp",
+            "cpu",
+            "memory",
+            "disk",
+            "uptime",
+        }
+        assert len(metrics["cpu"]["load_average"]) == 3
+        assert set(metrics["memory"]) == {"total_mb", "used_mb", "available_mb", "percent"}
+        assert datetime.fromisoformat(metrics["timestamp"])
+
+    @pytest.mark.unit
+    def test_json_value_quotes_unusual_strings(self):
+        """Test that plain strings are quoted directly and others through json."""
+        for value in (None, 12.5, 0, "pi-zero", 'say "hi"\n', "Zéro"):
+            assert json.loads(lean.json_value(value)) == value
+
+    @pytest.mark.unit
+    def test_format_timestamp_matches_isoformat(self):
+        """Test that timestamps built from time match datetime.isoformat()."""
+        now = 1760000000.25
+
+        assert lean.format_timestamp(now) == datetime.fromtimestamp(now).isoformat()
+
+    @pytest.mark.unit
+    def test_imports_stay_minimal(self):
+        """Test that importing the agent and rendering a scrape loads no heavy modules."""
+        code = (
+            "import sys; sys.path.insert(0, 'agent'); import pi_monitor_agent_py2 as a; "
+            "a.render_metrics(); "
+            "print(sorted(set(sys.modules) & {'json', 'datetime', 'http.server', 're'}))"
+        )
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run(  # noqa: S603 - runs a fixed snippet
+            [sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True
+        )
+
+        assert result.stdout.strip() == "[]"
+
+    @pytest.mark.integration
+    def test_keep_alive_and_not_found(self, lean_port):
+        """Test that requests share a connection and unknown paths return 404."""
+        connection = http.client.HTTPConnection("127.0.0.1", lean_port, timeout=5)
+        try:
+            for path, status in (("/metrics", 200), ("/nope", 404), ("/metrics?x=1", 200)):
+                connection.request("GET", path)
+                response = connection.getresponse()
+                body = response.read()
+                assert response.status == status
+                assert not response.will_close
+                sock = connection.sock
+            assert json.loads(body)["hostname"] == lean.HOSTNAME
+            assert connection.sock is sock
+        finally:
+            connection.close()
+
+    @pytest.mark.integration
+    def test_idle_connections_do_not_hold_workers(self, lean_port):
+        """Test that more idle keep-alive clients than workers do not block a scrape."""
+        idle = [socket.create_connection(("127.0.0.1", lean_port)) for _ in range(3)]
+        kept = http.client.HTTPConnection("127.0.0.1", lean_port, timeout=5)
+        connection = http.client.HTTPConnection("127.0.0.1", lean_port, timeout=2)
+        try:
+            kept.request("GET", "/metrics")
+            kept.getresponse().read()  # Now an idle keep-alive connection too
+            start = time.perf_counter()
+            connection.request("GET", "/metrics")
+            assert connection.getresponse().status == 200
+            assert time.perf_counter() - start < 1
+        finally:
+            connection.close()
+            kept.close()
+            for sock in idle:
+                sock.close()
+
+    @pytest.mark.integration
+    def test_partial_requests_time_out(self, lean_port, monkeypatch):
+        """Test that clients stalled mid-request are closed after REQUEST_TIMEOUT."""
+        monkeypatch.setattr(lean, "REQUEST_TIMEOUT", 0.2)
+        stalled = [socket.create_connection(("127.0.0.1", lean_port), timeout=5) for _ in range(2)]
+        try:
+            for sock in stalled:
+                sock.sendall(b"GET /metrics HTTP/1.1\r\n")  # Never finished
+            start = time.perf_counter()
+            for sock in stalled:
+                assert sock.recv(1) == b""
+            assert time.perf_counter() - start < 2
+        finally:
+            for sock in stalled:
+                sock.close()
+        with urlopen(f"http://127.0.0.1:{lean_port}/metrics", timeout=2) as response:
+            assert response.status == 200
+
+    @pytest.mark.integration
+    def test_http10_and_bad_requests_close(self, lean_port):
+        """Test that HTTP/1.0 requests and oversized heads close the connection."""
+        with socket.create_connection(("127.0.0.1", lean_port), timeout=5) as sock:
+            sock.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+            response = b"".join(iter(lambda: sock.recv(65536), b""))
+        head, _, body = response.partition(b"\r\n\r\n")
+        assert b"Connection: close" in head
+        assert json.loads(body)["hostname"] == lean.HOSTNAME
+
+        with socket.create_connection(("127.0.0.1", lean_port), timeout=5) as sock:
+            head = b"GET / HTTP/1.1\r\nX-Padding: "
+            sock.sendall(head + b"x" * (lean.REQUEST_BUFFER_SIZE - len(head)))
+            response = b"".join(iter(lambda: sock.recv(65536), b""))
+        assert response.startswith(b"HTTP/1.1 400 ")
@@ -0,0 +1,228 @@
+# Pi Monitor - Benchmark Tests
+# =============================
+#
+# Smoke tests for the benchmark harnesses in benchmarks/.
+
+import os
+from datetime import datetime
+
+import pytest
+
+from benchmarks import collectors, fleet, history, proctrace, scrape, startup
+from benchmarks.common import compare_to_baseline, percentile, summarize
+
+
+class TestBenchmarkHelpers:
+    """Tests for the shared benchmark helpers."""
+
+    @pytest.mark.unit
+    def test_percentile_nearest_rank(self):
+        """Test nearest-rank percentiles."""
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 50
+        assert percentile(values, 99) == 99
+        assert percentile(values, 100) == 100
+        assert percentile([], 50) == 0.0
+
+    @pytest.mark.unit
+    def test_summarize_scales_values(self):
+        """Test that summarize applies the scale factor."""
+        summary = summarize([0.001, 0.002, 0.003], scale=1000)
+        assert summary["count"] == 3
+        assert summary["p50"] == 2.0
+        assert summary["max"] == 3.0
+
+    @pytest.mark.unit
+    def test_compare_to_baseline(self):
+        """Test regression detection in both directions."""
+        baseline = {"latency": {"p99": 10.0}, "throughput": 100.0}
+        checks = {"latency.p99": "lower", "throughput": "higher"}
+
+        ok = {"latency": {"p99": 11.0}, "throughput": 95.0}
+        assert compare_to_baseline(ok, baseline, checks, 0.25) == []
+
+        bad = {"latency": {"p99": 20.0}, "throughput": 50.0}
+        assert len(compare_to_baseline(bad, baseline, checks, 0.25)) == 2
+
+
+class TestFleetBenchmark:
+    """Tests for the synthetic fleet benchmark."""
+
+    @pytest.mark.unit
+    def test_fleet_addresses_are_unique_loopback(self):
+        """Test that fake agents get distinct loopback addresses."""
+        addresses = fleet.fleet_addresses(600)
+        assert len(set(addresses)) == 600
+        assert all(address.startswith("127.") for address in addresses)
+
+    @pytest.mark.unit
+    def test_staleness_accepts_paged_responses(self):
+        """Test staleness of both the legacy and the paged /api/metrics shape."""
+        online = {"status": "online", "last_seen": "2024-01-01T00:00:00"}
+        now = datetime.fromisoformat("2024-01-01T00:00:10").timestamp()
+        assert fleet.staleness({"pi-a": online}, now) == 10
+        assert fleet.staleness({"total": 1, "hosts": [online]}, now) == 10
+
+    @pytest.mark.slow
+    @pytest.mark.integration
+    def test_small_fleet_run(self):
+        """Test a short end-to-end run against a handful of fake agents."""
+        args = fleet.parse_args(
+            [
+                "--agents",
+                "10",
+                "--port",
+                "15599",
+                "--latency-ms",
+                "0",
+                "--cycles",
+                "1",
+                "--poll-interval",
+                "0.2",
+                "--clients",
+                "2",
+                "--duration",
+                "0.5",
+            ]
+        )
+        report = fleet.run(args)
+
+        assert report["poll"]["hosts_online"] == 10
+        assert report["poll"]["cycle_seconds"]["count"] == 1
+        assert report["api"]["requests"] > 0
+        assert report["api"]["errors"] == 0
+        assert report["max_rss_mb"] > 0
+
+
+class TestCollectorBenchmark:
+    """Tests for the agent collector micro-benchmark."""
+
+    @pytest.mark.unit
+    def test_fixture_sources_are_discovered(self):
+        """Test that recorded fixture trees are offered as sources."""
+        sources = collectors.available_sources()
+        assert sources[0] == "real"
+        assert "fixture:pi4" in sources
+        assert "fixture:pi-zero-w" in sources
+
+    @pytest.mark.unit
+    def test_run_against_fixture_restores_paths(self):
+        """Test a fixture run times every case and restores the agent paths."""
+        results = collectors.run_source("fixture:pi4", number=2, repeat=1)
+
+        assert "collect_and_encode" in results
+        assert all(case["best_us"] > 0 for case in results.values())
+        assert collectors.agent.PROC_STAT == "/proc/stat"
+
+
+class TestProcTrace:
+    """Tests for the /proc and /sys trace recorder and replayer."""
+
+    PI4 = os.path.join(collectors.FIXTURES_DIR, "pi4")
+
+    @pytest.mark.unit
+    def test_record_stores_only_changes(self):
+        """Test that the first frame holds every file and unchanged files are not repeated."""
+        trace = proctrace.record(self.PI4, samples=3, interval=0)
+
+        first = trace["frames"][0][1]
+        assert "proc/stat" in first
+        assert "sys/devices/platform/soc/soc:firmware/get_throttled" in first
+        assert all(frame[1] == {} for frame in trace["frames"][1:])
+
+    @pytest.mark.unit
+    def test_trace_round_trip(self, tmp_path):
+        """Test that a saved trace loads back unchanged."""
+        trace = proctrace.record(self.PI4, samples=2, interval=0)
+        path = str(tmp_path / "pi4.trace.gz")
+
+        proctrace.save_trace(path, trace)
+
+        assert proctrace.load_trace(path) == trace
+
+    @pytest.mark.unit
+    def test_replay_reproduces_cpu_usage(self):
+        """Test that replayed /proc/stat deltas give the CPU usage computed from the trace."""
+        trace = proctrace.record(self.PI4, samples=1, interval=0)
+        stats = [
+            "cpu  1000 0 1000 8000 0 0 0 0 0 0\n",
+            "cpu  1250 0 1250 8500 0 0 0 0 0 0\n",  # 50% busy
+            "cpu  1260 0 1260 9480 0 0 0 0 0 0\n",  # 2% busy
+        ]
+        trace["frames"][0][1]["proc/stat"] = stats[0]
+        trace["frames"] += [[offset, {"proc/stat": stat}] for offset, stat in enumerate(stats[1:])]
+
+        results = proctrace.replay(trace)
+
+        assert results["frames"] == 2
+        assert results["collect_us"]["count"] == 2
+        assert results["cpu_percent_max_error"] == 0.0
+        assert proctrace.stat_cpu_percent(stats[0], stats[1]) == 50.0
+        assert collectors.agent.PROC_STAT == "/proc/stat"
+
+
+class TestScrapeBenchmark:
+    """Tests for the concurrent scrape benchmark."""
+
+    @pytest.mark.integration
+    def test_modes_serve_concurrent_scrapers(self):
+        """Test that the original and pooled servers both answer every scraper."""
+        args = scrape.parse_args(["--scrapers", "3", "--duration", "0.3"])
+
+        for mode in ("single", "pool"):
+            results = scrape.run_mode(mode, args)
+            assert results["requests"] > 0
+            assert results["errors"] == 0
+            assert results["latency_ms"]["p50"] > 0
+
+
+class TestHistoryBenchmark:
+    """Tests for the history compression benchmark."""
+
+    @pytest.mark.unit
+    def test_synthetic_series_compress_losslessly(self):
+        """Test that simulated Pi polls compress well and decode without loss."""
+        samples = history.synthetic_samples(hours=6)
+
+        results = history.measure(samples, repeat=1)
+
+        assert results["samples"] == 6 * 3600 // 5
+        assert results["lossless"]
+        assert results["compression_ratio"] > 6
+        assert results["encode_samples_per_second"] > 0
+
+    @pytest.mark.unit
+    def test_trace_samples_use_the_collectors(self, tmp_path):
+        """Test that a replayed trace yields one sample of collected metrics per frame."""
+        path = str(tmp_path / "pi4.trace.gz")
+        proctrace.save_trace(path, proctrace.record(TestProcTrace.PI4, samples=4, interval=0))
+
+        samples = history.trace_samples(path)
+
+        assert len(samples) == 3
+        assert samples[0][1][1] == 47.7  # The fixture's CPU temperature
+        assert history.measure(samples, repeat=1)["lossless"]
+
+
+class TestStartupBudget:
+    """Tests for the agent startup time and RSS budget check."""
+
+    @pytest.mark.integration
+    def test_lean_agent_meets_budget(self):
+        """Test that the lean agent starts within budget and uses less memory than the full one."""
+        lean = startup.measure("lean", runs=1, scrapes=5)
+        full = startup.measure("full", runs=1, scrapes=5)
+
+        assert startup.over_budget(lean, startup.STARTUP_BUDGET_MS, startup.RSS_BUDGET_MB) == []
+        assert lean["main_ms"] > 0
+        assert lean["rss_mb"] < full["rss_mb"]
+
+    @pytest.mark.unit
+    def test_over_budget_messages(self):
+        """Test that each exceeded budget is reported."""
+        results = {"startup_ms": 120.0, "rss_mb": 9.0, "rss_after_mb": 13.0}
+
+        assert startup.over_budget(results, 100, 12) == [
+            "startup_ms: 120.0 > 100",
+            "rss_after_mb: 13.0 > 12",
+        ]
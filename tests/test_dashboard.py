@@ -3,8 +3,24 @@
 #
 # Tests for the pi_monitor_dashboard module.
 
+import gzip
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from array import array
+from http.server import HTTPServer
+from multiprocessing import shared_memory
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
 import pytest
 
+from dashboard import pi_monitor_dashboard as dashboard
+
 
 class TestDashboardDataProcessing:
     """Tests for dashboard data processing."""
@@ -77,3 +93,1038 @@ class TestAlertThresholds:
         threshold = 70.0  # Celsius
         assert threshold > 0
         assert threshold < 100  # Reasonable upper limit for Pi
+
+
+class TestSelfInstrumentation:
+    """Tests for dashboard self-instrumentation."""
+
+    @pytest.mark.unit
+    def test_timed_lock_records_wait(self):
+        """Test that TimedLock records the time spent waiting to acquire."""
+        lock = dashboard.TimedLock("test.lock.wait")
+        histogram = dashboard.STATS.histogram("test.lock.wait")
+
+        def hold():
+            with lock:
+                time.sleep(0.05)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        time.sleep(0.01)
+        with lock:
+            pass
+        holder.join()
+
+        assert histogram.snapshot()["count"] == 2
+        assert histogram.max >= 0.02
+
+    @pytest.mark.unit
+    def test_poll_once_records_fetch_and_cycle(self, monkeypatch):
+        """Test that a poll cycle records per-host fetch latency and cycle time."""
+        monkeypatch.setattr(dashboard, "MONITORED_HOSTS", ["127.0.0.1"])
+        monkeypatch.setattr(dashboard, "pi_data", {})
+        monkeypatch.setattr(dashboard, "AGENT_PORT", 1)  # Nothing listens: refused at once
+        cycles = dashboard.STATS.histogram("poll.cycle").snapshot()["count"]
+
+        dashboard.poll_once()
+
+        assert dashboard.pi_data["127.0.0.1"]["status"] == "offline"
+        assert dashboard.STATS.histogram("fetch.127.0.0.1").snapshot()["count"] >= 1
+        assert dashboard.STATS.histogram("poll.cycle").snapshot()["count"] == cycles + 1
+
+    @pytest.mark.integration
+    def test_debug_stats_endpoint(self, serve):
+        """Test that /debug/stats reports API latency and lock waits."""
+        base = serve(dashboard.DashboardHandler)
+        urlopen(f"{base}/api/metrics").read()
+        with urlopen(f"{base}/debug/stats") as response:
+            stats = json.loads(response.read())
+
+        assert stats["histograms"]["http./api/metrics"]["count"] >= 1
+        assert stats["histograms"]["lock.data_lock.wait"]["count"] >= 1
+
+
+class TestProfiling:
+    """Tests for the dashboard's /debug/profile endpoint."""
+
+    @pytest.mark.integration
+    def test_profile_samples_poller_thread(self, serve, monkeypatch):
+        """Test that a profile taken over HTTP includes the poller thread."""
+        monkeypatch.setattr(dashboard, "DEBUG_TOKEN", "s3cret")
+        monkeypatch.setattr(dashboard, "MONITORED_HOSTS", [])
+        monkeypatch.setattr(dashboard, "POLL_INTERVAL", 0.01)
+        monkeypatch.setattr(dashboard, "STATE_FILE", "")
+        dashboard.stop_event.clear()
+        poller = threading.Thread(target=dashboard.poll_all_hosts, name="poller")
+        poller.start()
+        base = serve(dashboard.DashboardHandler)
+        try:
+            request = Request(
+                f"{base}/debug/profile?seconds=0.1", headers={"X-Debug-Token": "s3cret"}
+            )
+            with urlopen(request) as response:
+                profile = response.read().decode()
+        finally:
+            dashboard.stop_event.set()
+            poller.join()
+
+        assert "poller;" in profile
+        assert "poll_all_hosts (pi_monitor_dashboard.py:" in profile
+
+
+class TestStateSnapshots:
+    """Tests for checkpointing and warm-starting fleet state."""
+
+    @pytest.fixture(autouse=True)
+    def isolated_state(self, monkeypatch):
+        """Give each test empty fleet state."""
+        monkeypatch.setattr(dashboard, "pi_data", {})
+        monkeypatch.setattr(dashboard, "host_versions", {})
+        monkeypatch.setattr(dashboard, "schedule", {})
+        monkeypatch.setattr(dashboard, "fleet_version", 0)
+        monkeypatch.setattr(dashboard, "fleet_index", dashboard.FleetIndex())
+        monkeypatch.setattr(dashboard, "MONITORED_HOSTS", ["pi-a", "pi-b"])
+
+    @pytest.mark.unit
+    def test_round_trip(self, tmp_path, sample_metrics):
+        """Test that a saved snapshot restores data, versions and schedule."""
+        path = tmp_path / "state" / "dashboard-state.json"
+        with dashboard.data_lock:
+            dashboard.update_host("pi-a", dict(sample_metrics, status="online"))
+            dashboard.update_host("pi-b", {"hostname": "pi-b", "status": "offline"})
+            dashboard.schedule["pi-b"] = {"last_polled": 1700000000.0, "failures": 4}
+
+        assert dashboard.save_snapshot(str(path))
+        assert not (tmp_path / "state" / "dashboard-state.json.tmp").exists()
+
+        dashboard.pi_data.clear()
+        dashboard.host_versions.clear()
+        dashboard.schedule.clear()
+        dashboard.fleet_version = 0
+
+        assert dashboard.load_snapshot(str(path)) == 2
+        assert dashboard.pi_data["pi-a"]["hostname"] == "test-pi"
+        assert dashboard.pi_data["pi-a"]["restored"] is True
+        assert dashboard.host_versions == {"pi-a": 1, "pi-b": 2}
+        assert dashboard.fleet_version == 2
+        assert dashboard.schedule["pi-b"]["failures"] == 4
+
+    @pytest.mark.unit
+    def test_only_configured_hosts_are_restored(self, tmp_path, monkeypatch):
+        """Test that hosts removed from MONITORED_HOSTS are not resurrected."""
+        path = tmp_path / "dashboard-state.json"
+        with dashboard.data_lock:
+            dashboard.update_host("pi-a", {"hostname": "pi-a", "status": "online"})
+            dashboard.update_host("pi-b", {"hostname": "pi-b", "status": "online"})
+        dashboard.save_snapshot(str(path))
+        dashboard.pi_data.clear()
+
+        monkeypatch.setattr(dashboard, "MONITORED_HOSTS", ["pi-b"])
+        assert dashboard.load_snapshot(str(path)) == 1
+        assert list(dashboard.pi_data) == ["pi-b"]
+
+    @pytest.mark.unit
+    def test_missing_or_corrupt_snapshot(self, tmp_path):
+        """Test that unusable snapshots are ignored."""
+        assert dashboard.load_snapshot(str(tmp_path / "missing.json")) == 0
+
+        corrupt = tmp_path / "corrupt.json"
+        corrupt.write_text('{"format": 1, "hosts": ')
+        assert dashboard.load_snapshot(str(corrupt)) == 0
+
+        empty = tmp_path / "empty.json"
+        empty.write_text("")
+        assert dashboard.load_snapshot(str(empty)) == 0
+        assert dashboard.pi_data == {}
+
+
+AGENT_METRICS = {
+    "cpu": {"usage_percent": 25.5, "temperature": 42.5, "load_average": [0.5, 0.4, 0.3]},
+    "memory": {"percent": 45.2},
+    "disk": {"percent": 60.0},
+}
+
+
+class TestStaticAssets:
+    """Tests for the hashed, precompressed dashboard page assets."""
+
+    def get(self, url, **headers):
+        """Return (status, headers, body) of a GET, including 304 responses."""
+        try:
+            with urlopen(Request(url, headers=headers)) as response:
+                return response.status, response.headers, response.read()
+        except HTTPError as error:
+            return error.code, error.headers, error.read()
+
+    @pytest.mark.unit
+    def test_page_links_content_hashed_assets(self):
+        """Test that the page references its stylesheet and script by content hash."""
+        page = dashboard.ASSETS["/"].body.decode()
+        paths = sorted(path for path in dashboard.ASSETS if path != "/")
+
+        assert len(paths) == 2
+        for path in paths:
+            asset = dashboard.ASSETS[path]
+            assert f'"{path}"' in page
+            assert asset.digest in path
+            assert gzip.decompress(asset.gzipped) == asset.body
+        script = next(path for path in paths if path.endswith(".js"))
+        assert "updateDashboard" in dashboard.ASSETS[script].body.decode()
+
+    @pytest.mark.unit
+    def test_conditional_header_parsing(self):
+        """Test Accept-Encoding and If-None-Match matching."""
+        assert dashboard.accepts_gzip("gzip, deflate, br")
+        assert dashboard.accepts_gzip("br;q=1.0, *;q=0.5")
+        assert not dashboard.accepts_gzip("gzip;q=0, identity")
+        assert not dashboard.accepts_gzip("")
+        assert dashboard.etag_matches('"a", W/"b"', '"b"')
+        assert dashboard.etag_matches("*", '"b"')
+        assert not dashboard.etag_matches('"a"', '"b"')
+
+    @pytest.mark.integration
+    def test_assets_are_immutable_and_gzipped(self, serve):
+        """Test that hashed assets are cacheable forever and sent gzipped when accepted."""
+        base = serve(dashboard.DashboardHandler)
+        path = next(path for path in dashboard.ASSETS if path.endswith(".css"))
+        asset = dashboard.ASSETS[path]
+
+        status, headers, body = self.get(base + path, **{"Accept-Encoding": "gzip"})
+
+        assert status == 200
+        assert headers["Content-Type"] == "text/css; charset=utf-8"
+        assert headers["Content-Encoding"] == "gzip"
+        assert "immutable" in headers["Cache-Control"]
+        assert headers["ETag"] == asset.gzip_etag
+        assert gzip.decompress(body) == asset.body
+
+        status, headers, body = self.get(base + path)
+        assert headers["ETag"] == asset.etag and "Content-Encoding" not in headers
+        assert body == asset.body
+        assert self.get(base + "/static/dashboard.0000.css")[0] == 404
+
+    @pytest.mark.integration
+    def test_revalidation_returns_not_modified(self, serve):
+        """Test that a request with the current ETag gets an empty 304."""
+        base = serve(dashboard.DashboardHandler)
+        status, headers, _ = self.get(base + "/")
+        assert status == 200 and headers["Cache-Control"] == "no-cache"
+
+        status, headers, body = self.get(base + "/", **{"If-None-Match": headers["ETag"]})
+
+        assert status == 304
+        assert body == b""
+        assert headers["ETag"] == dashboard.ASSETS["/"].etag
+        # The gzip representation has its own ETag
+        gzipped = {"If-None-Match": headers["ETag"], "Accept-Encoding": "gzip"}
+        assert self.get(base + "/", **gzipped)[0] == 200
+
+
+class TestHistoryExport:
+    """Tests for the metrics history and the streaming /api/export endpoint."""
+
+    @pytest.fixture(autouse=True)
+    def isolated_history(self, monkeypatch):
+        """Give each test a small history of two hosts."""
+        monkeypatch.setattr(dashboard, "history", {})
+        monkeypatch.setattr(dashboard, "HISTORY_BLOCK_SIZE", 4)
+        for i in range(10):
+            dashboard.record_history("pi-a", 1000.0 + i, AGENT_METRICS)
+        dashboard.record_history("pi-b", 1005.0, {"cpu": {"usage_percent": 50.0}})
+
+    @pytest.mark.unit
+    def test_blocks_and_retention(self, monkeypatch):
+        """Test that full blocks are sealed and expired blocks dropped."""
+        assert [len(block) for block in dashboard.history["pi-a"].blocks] == [4, 4, 2]
+
+        monkeypatch.setattr(dashboard, "HISTORY_RETENTION", 5)
+        dashboard.record_history("pi-a", 1010.0, AGENT_METRICS)
+        assert [len(block) for block in dashboard.history["pi-a"].blocks] == [4, 3]
+
+    @pytest.mark.unit
+    def test_history_rows_range(self):
+        """Test that rows are limited to the requested hosts and time range."""
+        rows = list(dashboard.history_rows(["pi-a", "pi-b", "unknown"], 1003.0, 1005.0))
+
+        assert [(host, ts) for host, ts, _ in rows] == [
+            ("pi-a", 1003.0),
+            ("pi-a", 1004.0),
+            ("pi-a", 1005.0),
+            ("pi-b", 1005.0),
+        ]
+        assert rows[0][2] == [25.5, 42.5, 0.5, 45.2, 60.0]
+        assert rows[-1][2][0] == 50.0
+        assert rows[-1][2][1] != rows[-1][2][1]  # Missing temperature is NaN
+
+    @pytest.mark.integration
+    def test_export_ndjson_is_chunked(self, serve):
+        """Test that an NDJSON export streams with chunked transfer encoding."""
+        base = serve(dashboard.DashboardHandler)
+        with urlopen(f"{base}/api/export?format=ndjson&from=1000&to=1001") as response:
+            assert response.headers["Transfer-Encoding"] == "chunked"
+            rows = [json.loads(line) for line in response.read().decode().splitlines()]
+
+        assert [row["host"] for row in rows] == ["pi-a", "pi-a"]
+        assert rows[0]["cpu_percent"] == 25.5
+
+    @pytest.mark.integration
+    def test_export_csv_host_filter(self, serve):
+        """Test that a CSV export has a header and honours the hosts filter."""
+        base = serve(dashboard.DashboardHandler)
+        with urlopen(f"{base}/api/export?format=csv&from=0&hosts=pi-b") as response:
+            lines = response.read().decode().splitlines()
+
+        assert lines[0] == "host,timestamp," + ",".join(dashboard.HISTORY_COLUMNS)
+        assert len(lines) == 2
+        assert lines[1].startswith("pi-b,") and ",50.0," in lines[1]
+
+    @pytest.mark.integration
+    def test_export_rejects_bad_parameters(self, serve):
+        """Test that an unknown format or unparseable time is a 400."""
+        base = serve(dashboard.DashboardHandler)
+        for query in ("format=xml", "from=yesterday"):
+            with pytest.raises(HTTPError) as error:
+                urlopen(f"{base}/api/export?{query}")
+            assert error.value.code == 400
+
+
+class TestHistoryCompression:
+    """Tests for the Gorilla-encoded sealed history blocks."""
+
+    @pytest.mark.unit
+    def test_timestamps_round_trip_to_the_millisecond(self):
+        """Test that regular, jittered and very long intervals decode to the millisecond."""
+        timestamps = array("d", [1760000000.1234])
+        for interval in (5.0, 5.0, 5.0, 5.013, 4.9, 7.5, 64.0, 3600.0, 30 * 86400.0, 5.0):
+            timestamps.append(timestamps[-1] + interval)
+
+        decoded = dashboard.decode_timestamps(dashboard.encode_timestamps(timestamps), 11)
+
+        assert [round(t * 1000) for t in decoded] == [round(t * 1000) for t in timestamps]
+
+    @pytest.mark.unit
+    def test_floats_round_trip_bit_for_bit(self):
+        """Test that XOR encoding is lossless, including NaN, infinities and repeats."""
+        values = array("d", [25.5, 25.5, 25.5, 42.8, float("nan"), -0.0, 1e300, float("inf")])
+        values.extend([0.1 * i for i in range(50)])
+
+        data = dashboard.encode_floats(values)
+
+        assert dashboard.decode_floats(data, len(values)).tobytes() == values.tobytes()
+        assert dashboard.decode_floats(data, 3).tolist() == [25.5, 25.5, 25.5]
+
+    @pytest.mark.unit
+    def test_decimal_scale_is_exact(self):
+        """Test that columns are scaled only when dividing gives back the original."""
+        scale, scaled = dashboard.decimal_scale(array("d", [25.5, 0.3, float("nan"), 47.1]))
+        assert scale == 10
+        assert scaled[:2].tolist() == [255.0, 3.0]
+
+        assert dashboard.decimal_scale(array("d", [1.0, 2.0]))[0] == 1
+        assert dashboard.decimal_scale(array("d", [0.125, 1 / 3]))[0] == 1
+
+    @pytest.mark.unit
+    def test_full_blocks_are_sealed(self, monkeypatch):
+        """Test that full blocks are compressed and read back like the current block."""
+        monkeypatch.setattr(dashboard, "history", {})
+        monkeypatch.setattr(dashboard, "HISTORY_BLOCK_SIZE", 4)
+        for i in range(10):
+            metrics = {"cpu": {"usage_percent": 20.0 + i / 10, "temperature": 45.0}}
+            dashboard.record_history("pi-a", 1000.0 + 5 * i, metrics)
+
+        blocks = dashboard.history["pi-a"].blocks
+        assert [type(block).__name__ for block in blocks] == [
+            "SealedBlock",
+            "SealedBlock",
+            "HistoryBlock",
+        ]
+        rows = list(dashboard.history_rows(["pi-a"], 0, 2000))
+        assert [ts for _, ts, _ in rows] == [1000.0 + 5 * i for i in range(10)]
+        assert [values[0] for _, _, values in rows] == [20.0 + i / 10 for i in range(10)]
+        assert all(values[2] != values[2] for _, _, values in rows)  # Missing load is NaN
+
+    @pytest.mark.unit
+    def test_range_query_decodes_only_overlapping_blocks(self, monkeypatch):
+        """Test that a range query leaves sealed blocks outside the range encoded."""
+        monkeypatch.setattr(dashboard, "history", {})
+        monkeypatch.setattr(dashboard, "HISTORY_BLOCK_SIZE", 4)
+        for i in range(12):
+            dashboard.record_history("pi-a", 1000.0 + i, AGENT_METRICS)
+        decoded = []
+        decode = dashboard.decode_timestamps
+        monkeypatch.setattr(
+            dashboard,
+            "decode_timestamps",
+            lambda data, count: decoded.append(data) or decode(data, count),
+        )
+
+        rows = list(dashboard.history_rows(["pi-a"], 1005.0, 1006.0))
+
+        assert [ts for _, ts, _ in rows] == [1005.0, 1006.0]
+        assert rows[0][2] == [25.5, 42.5, 0.5, 45.2, 60.0]
+        assert decoded == [dashboard.history["pi-a"].blocks[1].timestamps]
+
+
+def cpu_sample(usage, temperature=None):
+    """Build agent-shaped metrics with the given CPU usage and temperature."""
+    return {"cpu": {"usage_percent": usage, "temperature": temperature}}
+
+
+class TestAnomalyDetection:
+    """Tests for the streaming EWMA anomaly scores."""
+
+    @pytest.mark.unit
+    def test_spike_is_flagged_after_warmup(self, monkeypatch):
+        """Test that a sudden jump is flagged once the baseline has warmed up."""
+        monkeypatch.setattr(dashboard, "ANOMALY_WARMUP", 10)
+        detector = dashboard.AnomalyDetector()
+        for i in range(30):
+            result = detector.observe("pi-a", cpu_sample(20.0 + i % 3))
+            if i < 10:
+                assert result["scores"]["cpu_percent"] is None
+
+        assert result["flagged"] == []
+        spike = detector.observe("pi-a", cpu_sample(95.0))
+        assert spike["flagged"] == ["cpu_percent"]
+        assert spike["scores"]["cpu_percent"] > dashboard.ANOMALY_THRESHOLD
+
+    @pytest.mark.unit
+    def test_warm_host_and_slow_drift_are_not_flagged(self, monkeypatch):
+        """Test that scores are relative to each host's own baseline."""
+        monkeypatch.setattr(dashboard, "ANOMALY_WARMUP", 5)
+        detector = dashboard.AnomalyDetector()
+        for i in range(200):
+            drift = detector.observe("pi-drift", cpu_sample(10.0 + i * 0.02 + i % 2))
+            warm = detector.observe("pi-warm", cpu_sample(50.0, 72.0 + i % 2))
+            assert drift["flagged"] == []
+            assert warm["flagged"] == []
+
+        assert detector.slots == {"pi-drift": 0, "pi-warm": 1}
+        assert len(detector.means[0]) == 2
+
+    @pytest.mark.unit
+    def test_missing_values_are_skipped(self):
+        """Test that metrics an agent did not report have no score."""
+        detector = dashboard.AnomalyDetector()
+        result = detector.observe("pi-a", cpu_sample(10.0))
+        assert result["scores"]["temperature"] is None
+        assert result["scores"]["disk_percent"] is None
+        assert detector.variances[1][0] != detector.variances[1][0]  # Still NaN
+
+
+class TestMultiProcessMode:
+    """Tests for publishing fleet state to shared memory for server processes."""
+
+    @pytest.fixture
+    def shm(self):
+        """Provide a small shared memory region."""
+        region = shared_memory.SharedMemory(create=True, size=256)
+        yield region
+        region.close()
+        region.unlink()
+
+    @pytest.mark.unit
+    def test_single_process_mode_does_not_need_shared_memory(self):
+        """Test that importing the dashboard leaves shared_memory (Python 3.8+) unloaded."""
+        code = (
+            "import sys; sys.path.insert(0, 'dashboard'); import pi_monitor_dashboard; "
+            "print('multiprocessing.shared_memory' in sys.modules)"
+        )
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run(  # noqa: S603 - runs a fixed snippet
+            [sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True
+        )
+
+        assert result.stdout.strip() == "False"
+
+    @pytest.mark.unit
+    def test_publish_and_read(self, shm):
+        """Test that a reader in another mapping sees the latest publication."""
+        writer = dashboard.SharedState(shm)
+        attached = shared_memory.SharedMemory(name=shm.name)
+        try:
+            reader = dashboard.SharedState(attached)
+            assert reader.read() == (0, b"{}")
+
+            assert writer.publish(7, b'{"pi-a": {}}')
+            assert reader.read() == (7, b'{"pi-a": {}}')
+            assert writer.publish(8, b"{}")
+            assert reader.read() == (8, b"{}")
+        finally:
+            attached.close()
+
+    @pytest.mark.unit
+    def test_reader_keeps_last_state_during_write(self, shm, monkeypatch):
+        """Test that an odd (in-progress) sequence is never read as data."""
+        monkeypatch.setattr(dashboard, "SHARED_READ_RETRIES", 3)
+        state = dashboard.SharedState(shm)
+        state.publish(1, b'{"old": 1}')
+        assert state.read() == (1, b'{"old": 1}')
+
+        dashboard.SHARED_SEQUENCE.pack_into(shm.buf, 0, state.sequence + 1)
+        shm.buf[dashboard.SHARED_HEADER_SIZE : dashboard.SHARED_HEADER_SIZE + 4] = b"junk"
+        assert state.read() == (1, b'{"old": 1}')
+
+    @pytest.mark.unit
+    def test_oversized_state_is_rejected(self, shm):
+        """Test that a body larger than the region is not published."""
+        state = dashboard.SharedState(shm)
+        assert not state.publish(1, b"x" * 256)
+        assert state.sequence == 0
+
+    @pytest.mark.integration
+    def test_server_processes_serve_published_state(self, monkeypatch):
+        """Test that forked server processes answer /api/metrics from shared memory."""
+        monkeypatch.setattr(dashboard, "SERVER_PROCESSES", 2)
+        monkeypatch.setattr(dashboard, "MONITORED_HOSTS", [])
+        monkeypatch.setattr(dashboard, "pi_data", {"pi-a": {"status": "online"}})
+        server = HTTPServer(("127.0.0.1", 0), dashboard.DashboardHandler)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        dashboard.stop_event.clear()
+        runner = threading.Thread(target=dashboard.run_multiprocess, args=(server,))
+        runner.start()
+        try:
+            for _ in range(5):
+                with urlopen(f"{base}/api/metrics", timeout=5) as response:
+                    assert json.loads(response.read()) == {"pi-a": {"status": "online"}}
+            with pytest.raises(HTTPError) as error:
+                urlopen(f"{base}/api/export", timeout=5)
+            assert error.value.code == 503
+        finally:
+            dashboard.stop_event.set()
+            runner.join()
+            server.server_close()
+            dashboard.stop_event.clear()
+
+        assert dashboard.shared_state is None
+
+
+def host_data(name, temperature=None, status="online", model="Raspberry Pi 4 Model B"):
+    """Build the dashboard's stored data for one host."""
+    if status != "online":
+        return {"hostname": name, "status": status, "ip": name}
+    return {"hostname": name, "status": status, "model": model, "cpu": {"temperature": temperature}}
+
+
+class TestFleetQueries:
+    """Tests for tags, filtering, sorting and paging of /api/metrics."""
+
+    @pytest.fixture(autouse=True)
+    def fleet(self, monkeypatch):
+        """Give each test a five-host fleet with tags."""
+        monkeypatch.setattr(dashboard, "pi_data", {})
+        monkeypatch.setattr(dashboard, "host_versions", {})
+        monkeypatch.setattr(dashboard, "fleet_version", 0)
+        monkeypatch.setattr(dashboard, "fleet_index", dashboard.FleetIndex())
+        monkeypatch.setattr(
+            dashboard,
+            "HOST_TAGS",
+            {"pi-a": ["site:garage"], "pi-b": ["site:garage", "role:dns"], "pi-c": ["site:attic"]},
+        )
+        with dashboard.data_lock:
+            dashboard.update_host("pi-a", host_data("pi-a", 55.0))
+            dashboard.update_host("pi-b", host_data("pi-b", 71.5, model="Raspberry Pi Zero W"))
+            dashboard.update_host("pi-c", host_data("pi-c", 48.0))
+            dashboard.update_host("pi-d", host_data("pi-d"))
+            dashboard.update_host("pi-e", host_data("pi-e", status="offline"))
+
+    def query(self, **spec):
+        """Run a query against the module's fleet and return the page's hosts."""
+        with dashboard.data_lock:
+            return dashboard.fleet_index.query(dashboard.pi_data, **spec)
+
+    @pytest.mark.unit
+    def test_indexes_follow_updates(self):
+        """Test that tag and status indexes change with a host's data."""
+        index = dashboard.fleet_index
+        assert index.by_tag["site:garage"] == {"pi-a", "pi-b"}
+        assert index.by_tag["model:Raspberry Pi Zero W"] == {"pi-b"}
+        assert index.by_status["offline"] == {"pi-e"}
+
+        with dashboard.data_lock:
+            dashboard.update_host("pi-b", host_data("pi-b", status="offline"))
+            dashboard.update_host("pi-e", host_data("pi-e", 40.0))
+        assert index.by_status["offline"] == {"pi-b"}
+        assert "model:Raspberry Pi Zero W" in index.host_tags["pi-b"]  # Last known model kept
+        assert "model:Raspberry Pi 4 Model B" in index.host_tags["pi-e"]
+
+    @pytest.mark.unit
+    def test_sort_orders_and_paging(self):
+        """Test ascending and descending sorts with missing values last."""
+        assert self.query(sort="temperature") == (5, ["pi-c", "pi-a", "pi-b", "pi-d", "pi-e"])
+        assert self.query(sort="temperature", descending=True)[1] == [
+            "pi-b",
+            "pi-a",
+            "pi-c",
+            "pi-d",
+            "pi-e",
+        ]
+        assert self.query(sort="hostname", offset=1, limit=2) == (5, ["pi-b", "pi-c"])
+
+    @pytest.mark.unit
+    def test_filters(self):
+        """Test tag and status filters, alone and combined."""
+        assert self.query(tags=["site:garage"], sort="temperature") == (2, ["pi-a", "pi-b"])
+        assert self.query(tags=["site:garage", "role:dns"]) == (1, ["pi-b"])
+        assert self.query(status="offline") == (1, ["pi-e"])
+        assert self.query(tags=["site:moon"]) == (0, [])
+
+    @pytest.mark.unit
+    def test_filtered_paths_agree(self, monkeypatch):
+        """Test that the sorted-matches and scan paths return the same pages."""
+        with dashboard.data_lock:
+            for i in range(200):
+                dashboard.update_host(f"pi-{i:03}", host_data(f"pi-{i:03}", (i * 37) % 90))
+        many = {f"pi-{i:03}" for i in range(0, 200, 2)}
+        few = {f"pi-{i:03}" for i in range(0, 200, 40)}
+        index = dashboard.fleet_index
+        for members in (many, few):
+            index.by_tag["test"] = set(members)
+            for descending in (False, True):
+                total, page = self.query(
+                    tags=["test"], sort="temperature", descending=descending, offset=3, limit=10
+                )
+                expected = sorted(
+                    members,
+                    key=lambda h: dashboard.pi_data[h]["cpu"]["temperature"]
+                    * (-1 if descending else 1),
+                )
+                assert total == len(members)
+                assert [dashboard.pi_data[h]["cpu"]["temperature"] for h in page] == [
+                    dashboard.pi_data[h]["cpu"]["temperature"] for h in expected[3:13]
+                ]
+
+    @pytest.mark.unit
+    def test_orders_are_cached_until_invalidated(self):
+        """Test that a sort order is reused within a poll cycle."""
+        self.query(sort="temperature")
+        cached = dashboard.fleet_index.orders["temperature"]
+        self.query(sort="temperature", offset=2)
+        assert dashboard.fleet_index.orders["temperature"] is cached
+
+        dashboard.fleet_index.invalidate_orders()
+        self.query(sort="temperature")
+        assert dashboard.fleet_index.orders["temperature"] is not cached
+
+    @pytest.mark.unit
+    def test_parse_fleet_query(self):
+        """Test query parsing, the legacy case and validation."""
+        assert dashboard.parse_fleet_query("") is None
+        spec = dashboard.parse_fleet_query("tag=a:b&tag=c:d&sort=-cpu&limit=5000")
+        assert spec["tags"] == ["a:b", "c:d"]
+        assert spec["sort"] == "cpu" and spec["descending"] is True
+        assert spec["limit"] == dashboard.API_MAX_PAGE_LIMIT
+        for bad in ("sort=fan", "limit=x", "offset=-1"):
+            with pytest.raises(ValueError):
+                dashboard.parse_fleet_query(bad)
+
+    @pytest.mark.integration
+    def test_api_envelope_and_legacy(self, serve):
+        """Test the paged envelope, the legacy response and 400s over HTTP."""
+        base = serve(dashboard.DashboardHandler)
+        with urlopen(f"{base}/api/metrics?tag=site:garage&sort=-temperature&limit=1") as response:
+            page = json.loads(response.read())
+        assert page["total"] == 2 and page["limit"] == 1 and page["offset"] == 0
+        assert page["version"] == dashboard.fleet_version
+        assert [host["host"] for host in page["hosts"]] == ["pi-b"]
+        assert page["hosts"][0]["tags"] == ["model:Raspberry Pi Zero W", "role:dns", "site:garage"]
+
+        with urlopen(f"{base}/api/metrics") as response:
+            assert set(json.loads(response.read())) == {"pi-a", "pi-b", "pi-c", "pi-d", "pi-e"}
+
+        with pytest.raises(HTTPError) as error:
+            urlopen(f"{base}/api/metrics?sort=fan")
+        assert error.value.code == 400
+
+    @pytest.mark.unit
+    def test_shared_state_fleet(self):
+        """Test that server processes index the published state once per publication."""
+        region = shared_memory.SharedMemory(create=True, size=4096)
+        try:
+            state = dashboard.SharedState(region)
+            dashboard.publish_state(state)
+            version, data, index = state.fleet()
+            assert state.fleet()[2] is index
+            assert version == dashboard.fleet_version
+            assert index.query(data, tags=["site:garage"]) == (2, ["pi-a", "pi-b"])
+        finally:
+            region.close()
+            region.unlink()
+
+
+class TestWatch:
+    """Tests for the long-poll /api/watch endpoint."""
+
+    @pytest.fixture(autouse=True)
+    def fleet(self, monkeypatch):
+        """Give each test a two-host fleet and fresh watch state."""
+        monkeypatch.setattr(dashboard, "pi_data", {})
+        monkeypatch.setattr(dashboard, "host_versions", {})
+        monkeypatch.setattr(dashboard, "fleet_version", 0)
+        monkeypatch.setattr(dashboard, "fleet_index", dashboard.FleetIndex())
+        monkeypatch.setattr(dashboard, "host_changed", {})
+        monkeypatch.setattr(dashboard, "watchers", 0)
+        monkeypatch.setattr(dashboard, "MONITORED_HOSTS", ["pi-a", "pi-b"])
+        with dashboard.data_lock:
+            dashboard.update_host("pi-a", host_data("pi-a", 50.0))
+            dashboard.update_host("pi-b", host_data("pi-b", 50.0))
+
+    def start_watch(self, host, since, timeout=5):
+        """Run watch() on a thread; returns (thread, results list)."""
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(json.loads(dashboard.watch(host, since, timeout)))
+        )
+        thread.start()
+        return thread, results
+
+    def wait_for_watchers(self, count):
+        """Wait until count watches are blocked."""
+        deadline = time.monotonic() + 5
+        while dashboard.watchers < count and time.monotonic() < deadline:
+            time.sleep(0.005)
+        assert dashboard.watchers == count
+
+    @pytest.mark.unit
+    def test_without_since_returns_current_state(self):
+        """Test that a watch without since_version answers at once."""
+        assert json.loads(dashboard.watch(None, None, 5)) == {
+            "version": 2,
+            "hosts": {"pi-a": dashboard.pi_data["pi-a"], "pi-b": dashboard.pi_data["pi-b"]},
+        }
+        assert set(json.loads(dashboard.watch("pi-b", None, 5))["hosts"]) == {"pi-b"}
+
+    @pytest.mark.unit
+    def test_host_watch_wakes_on_that_host_only(self):
+        """Test that a host watch ignores other hosts and returns only the delta."""
+        thread, results = self.start_watch("pi-a", 2)
+        self.wait_for_watchers(1)
+
+        with dashboard.data_lock:
+            dashboard.update_host("pi-b", host_data("pi-b", 60.0))
+        time.sleep(0.05)
+        assert results == []
+
+        with dashboard.data_lock:
+            dashboard.update_host("pi-a", host_data("pi-a", 70.0))
+        thread.join(5)
+        assert results == [{"version": 4, "hosts": {"pi-a": dashboard.pi_data["pi-a"]}}]
+
+    @pytest.mark.unit
+    def test_fleet_watch_wakes_at_end_of_poll_cycle(self, monkeypatch):
+        """Test that any-host watches are woken once per poll cycle with every change."""
+        thread, results = self.start_watch(None, 2)
+        self.wait_for_watchers(1)
+        with dashboard.data_lock:
+            dashboard.update_host("pi-a", host_data("pi-a", 70.0))
+            dashboard.update_host("pi-b", host_data("pi-b", 70.0))
+        time.sleep(0.05)
+        assert results == []
+
+        monkeypatch.setattr(dashboard, "MONITORED_HOSTS", [])
+        dashboard.poll_once()
+        thread.join(5)
+        assert set(results[0]["hosts"]) == {"pi-a", "pi-b"}
+
+    @pytest.mark.unit
+    def test_timeout_unknown_host_and_limit(self, monkeypatch):
+        """Test the empty delta on timeout, unknown hosts and MAX_WATCHERS."""
+        assert json.loads(dashboard.watch("pi-a", 2, 0.01)) == {"version": 2, "hosts": {}}
+
+        with pytest.raises(KeyError):
+            dashboard.watch("pi-z", 0, 0.01)
+
+        monkeypatch.setattr(dashboard, "watchers", dashboard.MAX_WATCHERS)
+        with pytest.raises(dashboard.TooManyWatchers):
+            dashboard.watch("pi-a", 2, 0.01)
+
+    @pytest.mark.integration
+    def test_many_watchers_over_http(self, serve):
+        """Test that one update wakes every concurrent HTTP watcher of a host."""
+        base = serve(dashboard.DashboardHandler, dashboard.DashboardServer)
+        url = f"{base}/api/watch?host=pi-a&since_version=2&timeout=10"
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(json.loads(urlopen(url).read())))
+            for _ in range(50)
+        ]
+        for thread in threads:
+            thread.start()
+        self.wait_for_watchers(50)
+
+        with dashboard.data_lock:
+            dashboard.update_host("pi-a", host_data("pi-a", 70.0))
+        for thread in threads:
+            thread.join(5)
+
+        assert len(results) == 50
+        assert all(result["version"] == 3 for result in results)
+
+        for query in ("since_version=x", "host=pi-z"):
+            with pytest.raises(HTTPError) as error:
+                urlopen(f"{base}/api/watch?{query}")
+            assert error.value.code == (400 if "since" in query else 404)
+
+    @pytest.mark.integration
+    def test_small_stacks_only_for_request_threads(self, serve, monkeypatch):
+        """Test that a background thread started mid-request keeps the default stack."""
+        sizes = []
+        start = threading.Thread.start
+
+        def stack_size():
+            size = threading.stack_size()  # Also resets it, so set it back
+            threading.stack_size(size)
+            return size
+
+        def record_start(thread):
+            size = stack_size()
+            sizes.append((thread.name, size))
+            if size == dashboard.THREAD_STACK_SIZE:
+                # A resolver refresh starting while the request thread starts
+                refresh = threading.Thread(target=lambda: None, name="resolve-pi")
+                starter = threading.Thread(target=dashboard.start_thread, args=(refresh,))
+                start(starter)
+                starter.join(0.1)
+            start(thread)
+
+        monkeypatch.setattr(threading.Thread, "start", record_start)
+        base = serve(dashboard.DashboardHandler, dashboard.DashboardServer)
+        urlopen(f"{base}/api/watch?host=pi-a&since_version=0").read()
+        deadline = time.monotonic() + 2
+        while len(sizes) < 3:
+            assert time.monotonic() < deadline
+            time.sleep(0.005)
+
+        assert [size for _, size in sizes] == [0, dashboard.THREAD_STACK_SIZE, 0]
+        assert sizes[2][0] == "resolve-pi"
+        assert stack_size() == 0
+
+
+class TestNameResolution:
+    """Tests for the poller's hostname resolution cache."""
+
+    @staticmethod
+    def fake_getaddrinfo(answers, calls):
+        """Return a getaddrinfo that pops answers[name] (an address or tuple) and logs names."""
+        real = dashboard.socket.getaddrinfo
+
+        def getaddrinfo(name, port, *args, **kwargs):
+            if dashboard.is_ip_address(name):
+                return real(name, port, *args, **kwargs)
+            calls.append(name)
+            answer = answers[name].pop(0)
+            if answer is None:
+                raise dashboard.socket.gaierror("Name or service not known")
+            infos = []
+            for address in (answer,) if isinstance(answer, str) else answer:
+                if ":" in address:
+                    family, sockaddr = dashboard.socket.AF_INET6, (address, port, 0, 0)
+                else:
+                    family, sockaddr = dashboard.socket.AF_INET, (address, port)
+                infos.append((family, dashboard.socket.SOCK_STREAM, 6, "", sockaddr))
+            return infos
+
+        return getaddrinfo
+
+    @pytest.mark.unit
+    def test_addresses_bypass_cache(self, monkeypatch):
+        """Test that IP literals are used as-is without a lookup."""
+        calls = []
+        monkeypatch.setattr(dashboard.socket, "getaddrinfo", lambda *args: calls.append(args))
+        resolver = dashboard.ResolverCache()
+
+        assert resolver.resolve("192.168.1.100") == ("192.168.1.100",)
+        assert resolver.resolve("fe80::1") == ("fe80::1",)
+        assert calls == []
+        assert resolver.entries == {}
+
+    @pytest.mark.unit
+    def test_positive_and_negative_caching(self, monkeypatch):
+        """Test that successes and failures are each looked up once within their TTL."""
+        calls = []
+        answers = {"pihole.local": [("192.168.1.50", "192.168.1.50")], "gone.local": [None]}
+        monkeypatch.setattr(dashboard.socket, "getaddrinfo", self.fake_getaddrinfo(answers, calls))
+        resolver = dashboard.ResolverCache(ttl=60, negative_ttl=60)
+
+        for _ in range(3):
+            assert resolver.resolve("pihole.local") == ("192.168.1.50",)
+            assert resolver.resolve("gone.local") is None
+
+        assert calls == ["pihole.local", "gone.local"]
+        assert dashboard.STATS.histogram("resolve.pihole.local").snapshot()["count"] >= 1
+
+    @pytest.mark.unit
+    def test_expired_entry_refreshes_in_background(self, monkeypatch):
+        """Test that an expired address is still returned while it is re-resolved."""
+        calls = []
+        answers = {"octopi.local": ["192.168.1.60", "192.168.1.61"]}
+        monkeypatch.setattr(dashboard.socket, "getaddrinfo", self.fake_getaddrinfo(answers, calls))
+        resolver = dashboard.ResolverCache(ttl=0, negative_ttl=0)
+
+        assert resolver.resolve("octopi.local") == ("192.168.1.60",)
+        assert resolver.resolve("octopi.local") == ("192.168.1.60",)  # Stale, refresh started
+        deadline = time.monotonic() + 2
+        while resolver.entries["octopi.local"][0] != ("192.168.1.61",):
+            assert time.monotonic() < deadline
+            time.sleep(0.005)
+
+        assert calls == ["octopi.local", "octopi.local"]
+
+    @pytest.mark.integration
+    def test_fetch_connects_by_address_with_host_header(self, serve, monkeypatch):
+        """Test that fetch_metrics connects to the cached address and sends the hostname."""
+        seen = []
+
+        class Agent(dashboard.BaseHTTPRequestHandler):
+            def do_GET(self):
+                seen.append((self.path, self.headers["Host"]))
+                body = json.dumps({"hostname": "pihole"}).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        port = int(serve(Agent).rsplit(":", 1)[1])
+        calls = []
+        answers = {"pihole.local": ["127.0.0.1"]}
+        monkeypatch.setattr(dashboard.socket, "getaddrinfo", self.fake_getaddrinfo(answers, calls))
+        monkeypatch.setattr(dashboard, "RESOLVER", dashboard.ResolverCache())
+        monkeypatch.setattr(dashboard, "AGENT_PORT", port)
+
+        assert dashboard.fetch_metrics("pihole.local")["status"] == "online"
+        assert dashboard.fetch_metrics("pihole.local")["status"] == "online"
+        assert seen == [("/metrics?consumer=dashboard", f"pihole.local:{port}")] * 2
+        assert calls == ["pihole.local"]
+
+    @pytest.mark.integration
+    def test_unreachable_first_address_falls_back(self, serve, monkeypatch):
+        """Test that fetches and probes try every address, as an IPv4-only agent needs."""
+        port = TestCircuitBreaker.agent(serve, 200)
+        calls = []
+        # An AAAA answer first (the agent binds 0.0.0.0), then an address nothing listens on
+        answers = {"pihole.local": [("::1", "127.0.0.2", "127.0.0.1")]}
+        monkeypatch.setattr(dashboard.socket, "getaddrinfo", self.fake_getaddrinfo(answers, calls))
+        monkeypatch.setattr(dashboard, "RESOLVER", dashboard.ResolverCache())
+        monkeypatch.setattr(dashboard, "AGENT_PORT", port)
+        monkeypatch.setattr(dashboard, "probes", {})
+
+        assert dashboard.fetch_metrics("pihole.local")["status"] == "online"
+        assert dashboard.probe_host("pihole.local") is True
+        assert calls == ["pihole.local"]
+
+
+class TestCircuitBreaker:
+    """Tests for the per-host circuit breaker and connect probes."""
+
+    @pytest.fixture(autouse=True)
+    def fresh_state(self, monkeypatch):
+        """Isolate fleet, schedule and probe state."""
+        monkeypatch.setattr(dashboard, "pi_data", {})
+        monkeypatch.setattr(dashboard, "schedule", {})
+        monkeypatch.setattr(dashboard, "probes", {})
+        monkeypatch.setattr(dashboard, "host_versions", {})
+        monkeypatch.setattr(dashboard, "fleet_index", dashboard.FleetIndex())
+        monkeypatch.setattr(dashboard, "MONITORED_HOSTS", ["127.0.0.1"])
+        yield
+        for probe in dashboard.probes.values():
+            probe.close()
+
+    @staticmethod
+    def agent(serve, status):
+        """Serve a fake agent answering every request with status; return its port."""
+
+        class Agent(dashboard.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps({"hostname": "pi-a"}).encode()
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return int(serve(Agent).rsplit(":", 1)[1])
+
+    @pytest.mark.unit
+    def test_breaker_opens_after_consecutive_failures(self, monkeypatch):
+        """Test that a dead host is fetched BREAKER_FAILURES times, then only probed."""
+        monkeypatch.setattr(dashboard, "AGENT_PORT", 1)  # Nothing listens: refused at once
+        fetches = []
+        fetch = dashboard.fetch_metrics
+        monkeypatch.setattr(
+            dashboard, "fetch_metrics", lambda host: fetches.append(host) or fetch(host)
+        )
+        probes = dashboard.STATS.counters.get("breaker.probe", 0)
+
+        for _ in range(dashboard.BREAKER_FAILURES + 3):
+            dashboard.poll_once()
+
+        assert len(fetches) == dashboard.BREAKER_FAILURES
+        assert dashboard.STATS.counters["breaker.probe"] == probes + 3
+        assert dashboard.pi_data["127.0.0.1"]["status"] == "offline"
+        assert dashboard.schedule["127.0.0.1"]["failures"] == dashboard.BREAKER_FAILURES + 3
+
+    @pytest.mark.integration
+    def test_probe_success_closes_breaker(self, serve, monkeypatch):
+        """Test that a tripped host is fetched and restored once its port answers."""
+        monkeypatch.setattr(dashboard, "AGENT_PORT", self.agent(serve, 200))
+        dashboard.schedule["127.0.0.1"] = {"last_polled": None, "failures": 10}
+
+        dashboard.poll_once()
+
+        assert dashboard.pi_data["127.0.0.1"]["status"] == "online"
+        assert dashboard.schedule["127.0.0.1"]["failures"] == 0
+
+    @pytest.mark.integration
+    def test_answering_port_with_failing_agent_is_degraded(self, serve, monkeypatch):
+        """Test that a tripped host whose port answers but whose agent fails is degraded."""
+        monkeypatch.setattr(dashboard, "AGENT_PORT", self.agent(serve, 500))
+        dashboard.schedule["127.0.0.1"] = {"last_polled": None, "failures": 10}
+
+        dashboard.poll_once()
+
+        assert dashboard.pi_data["127.0.0.1"]["status"] == "degraded"
+        assert dashboard.schedule["127.0.0.1"]["failures"] == 11
+
+    @pytest.mark.integration
+    def test_probes_above_fd_setsize(self, serve, monkeypatch):
+        """Test that probes on descriptors above 1024 (large fleets) still work."""
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard != resource.RLIM_INFINITY and hard < 1200:
+            pytest.skip("file descriptor limit too low")
+        resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, 1200), hard))
+        monkeypatch.setattr(dashboard, "AGENT_PORT", self.agent(serve, 200))
+        filler = []
+        try:
+            while not filler or filler[-1] < 1030:
+                filler.append(os.dup(0))
+            assert dashboard.ConnectProbe(("127.0.0.1",)).result(1) is True
+            monkeypatch.setattr(dashboard, "AGENT_PORT", 1)  # Refused
+            assert dashboard.ConnectProbe(("127.0.0.1",)).result(1) is False
+        finally:
+            for fd in filler:
+                os.close(fd)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    @pytest.mark.unit
+    def test_pending_probe_is_checked_without_waiting(self, monkeypatch):
+        """Test that a probe left in flight by the previous cycle costs no wait."""
+        monkeypatch.setattr(dashboard, "AGENT_PORT", 1)
+        monkeypatch.setattr(dashboard, "PROBE_TIMEOUT", 5)
+
+        assert dashboard.probe_host("127.0.0.1") is False
+        dashboard.probes["127.0.0.1"].started -= 10  # As if a poll cycle had passed
+        start = time.perf_counter()
+        assert dashboard.probe_host("127.0.0.1") is False
+        assert time.perf_counter() - start < 0.5
+
+    @pytest.mark.unit
+    def test_breaker_disabled_at_zero(self, monkeypatch):
+        """Test that BREAKER_FAILURES = 0 always fetches."""
+        monkeypatch.setattr(dashboard, "BREAKER_FAILURES", 0)
+
+        assert not dashboard.breaker_open(100)